@@ -0,0 +1,98 @@
+"""
+حساب‌های تلگرام (session) ربات رصد و تقسیم کانال‌ها بین آن‌ها
+
+هر حساب کلاینت و محدودکننده نرخ جداگانه دارد (FloodWait و سقف عضویت تلگرام برای
+هر حساب جداست). هر کانال به یک حساب تعلق دارد (ستون channels.account)؛ این
+انتساب ثابت می‌ماند و کانال‌های جدید به حسابی با کمترین بار نسبی داده می‌شوند.
+"""
+from typing import Dict, List, Optional, Tuple
+from dialog_index import DialogIndex
+from rate_limiter import RateLimiter
+
+
+# نام حساب وقتی accounts در config.json تعریف نشده باشد (همان session قدیمی new)
+DEFAULT_ACCOUNT = 'main'
+
+
+class Account:
+    """یک حساب تلگرام: session، کلاینت، محدودکننده نرخ و نمایه گفتگوهای آن"""
+    
+    def __init__(self, name: str, session: str, api_id=None, api_hash: str = None,
+                 phone: str = None, max_channels: int = 500, config: Dict = None):
+        self.name = name
+        self.session = session
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.phone = phone
+        self.max_channels = max(1, int(max_channels))
+        self.client = None
+        self.limiter = RateLimiter(config)
+        self.dialogs = DialogIndex((config or {}).get('dialog_index_refresh', 6 * 3600))
+
+
+def load_accounts(config: Dict) -> List[Account]:
+    """ساخت حساب‌ها از کلید accounts در config.json (یا یک حساب با session قدیمی)
+    
+    Raises:
+        ValueError: اگر نام حساب تکراری باشد
+    """
+    default_max = int(config.get('max_channels_per_account', 500))
+    entries = config.get('accounts')
+    if not entries:
+        return [Account(DEFAULT_ACCOUNT, config.get('session', 'new'), phone=config.get('phone'),
+                        max_channels=default_max, config=config)]
+    
+    accounts = []
+    for entry in entries:
+        name = entry.get('name') or entry['session']
+        if any(account.name == name for account in accounts):
+            raise ValueError(f"نام حساب تکراری در config.json: {name}")
+        accounts.append(Account(
+            name,
+            entry.get('session', name),
+            api_id=entry.get('api_id'),
+            api_hash=entry.get('api_hash'),
+            phone=entry.get('phone'),
+            max_channels=entry.get('max_channels', default_max),
+            config=config
+        ))
+    return accounts
+
+
+def plan_assignments(channels: List[Dict], accounts: List[Account]) -> List[Tuple[Dict, Optional[str]]]:
+    """تعیین حساب کانال‌هایی که حساب ندارند یا حسابشان از تنظیمات حذف شده است
+    
+    کانال‌هایی که قبل از اضافه شدن حساب‌ها عضوشان بودیم (account خالی و is_member=1)
+    به اولین حساب (session قدیمی) داده می‌شوند تا دوباره join لازم نباشد؛ بقیه به حسابی
+    با کمترین نسبت تعداد کانال به max_channels. اگر همه حساب‌ها پر باشند حساب None است.
+    
+    Returns:
+        لیست (channel, account) فقط برای کانال‌هایی که حسابشان باید تغییر کند
+    """
+    counts = {account.name: 0 for account in accounts}
+    for channel in channels:
+        if channel.get('account') in counts:
+            counts[channel['account']] += 1
+    
+    plan = []
+    unassigned = []
+    for channel in channels:
+        if channel.get('account') in counts:
+            continue
+        if channel.get('account') is None and channel.get('is_member'):
+            # قبل از انتخاب حساب بقیه کانال‌ها شمرده می‌شوند تا توزیع متوازن بماند
+            counts[accounts[0].name] += 1
+            plan.append((channel, accounts[0].name))
+        else:
+            unassigned.append(channel)
+    
+    for channel in unassigned:
+        candidates = [account for account in accounts if counts[account.name] < account.max_channels]
+        if not candidates:
+            if channel.get('account') is not None:
+                plan.append((channel, None))
+            continue
+        target = min(candidates, key=lambda account: counts[account.name] / account.max_channels).name
+        counts[target] += 1
+        plan.append((channel, target))
+    return plan
@@ -3,10 +3,12 @@
 """
 import os
 import json
+import asyncio
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler, JobQueue
-from database import Database
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+from database import Database, AsyncDatabase
+from wakeup import WakeupListener, send_wakeup, get_wakeup_address, DEFAULT_MONITOR_PORT, DEFAULT_ADMIN_PORT
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
 
@@ -18,10 +20,28 @@ class AdminBot:
     WAITING_CHANNEL_TO_REMOVE = 3
     WAITING_CATEGORY_NAME = 4
     
+    # دسته‌های خطای channel_failures
+    FAILURE_LABELS = {
+        'expired': 'لینک منقضی شده',
+        'invalid': 'کانال نامعتبر',
+        'banned': 'دسترسی مسدود',
+        'flood': 'محدودیت تلگرام',
+        'transient': 'خطای موقت',
+    }
+    
     def __init__(self):
         self.config_file = 'admin_config.json'
         self.db = Database()
+        # نسخه async برای مسیرهای پرتکرار (آمار و خروجی اکسل) تا event loop بلاک نشود
+        self.adb = AsyncDatabase(self.db)
         self.config = self.load_config()
+        # اطلاع‌رسانی‌ها از جدول notifications خوانده می‌شوند؛ بسته UDP ربات رصد فقط تحویل را فوری می‌کند
+        _, wakeup_port = get_wakeup_address(self.config, 'wakeup_host', 'wakeup_port', 'ADMIN_WAKEUP',
+                                            '0.0.0.0', DEFAULT_ADMIN_PORT)
+        self.notification_wakeup = WakeupListener(wakeup_port)
+        self.notification_poll_interval = float(self.config.get('notification_poll_interval', 300))
+        self.notification_max_attempts = int(self.config.get('notification_max_attempts', 5))
+        self.notification_task = None
         # همگام‌سازی دسته‌بندی‌های موجود از channels به categories
         try:
             synced_count = self.db.sync_categories_from_channels()
@@ -29,7 +49,7 @@ class AdminBot:
                 print(f"✅ {synced_count} دسته‌بندی از channels به categories همگام‌سازی شد")
         except Exception as e:
             print(f"⚠️ خطا در همگام‌سازی دسته‌بندی‌ها: {e}")
-        
+    
     def load_config(self):
         """بارگذاری تنظیمات"""
         if os.path.exists(self.config_file):
@@ -78,160 +98,106 @@ class AdminBot:
         ]
         return InlineKeyboardMarkup(keyboard)
     
-    def trigger_immediate_check(self, user_id: int = None) -> bool:
-        """ایجاد فایل flag برای بررسی فوری کانال‌ها"""
-        try:
-            # استفاده از دایرکتوری data برای فایل‌های flag (مشترک بین containers)
-            data_dir = os.path.join(os.getcwd(), 'data')
-            os.makedirs(data_dir, exist_ok=True)
-            
-            flag_file = 'trigger_check.flag'
-            flag_path = os.path.join(data_dir, flag_file)
-            with open(flag_path, 'w') as f:
-                if user_id:
-                    f.write(str(user_id))  # ذخیره user_id در فایل
-                else:
-                    f.write('')  # ایجاد فایل خالی
-            return True
-        except Exception as e:
-            print(f"خطا در ایجاد فایل flag: {e}")
-            import traceback
-            traceback.print_exc()
+    async def send_command(self, command: str, payload: dict) -> bool:
+        """ثبت دستور در صف commands و بیدار کردن فوری ربات رصد"""
+        command_id = await self.adb.enqueue_command(command, payload)
+        if not command_id:
             return False
+        print(f"🚩 دستور {command} (id={command_id}) در صف ثبت شد: {payload}")
+        host, port = get_wakeup_address(self.config, 'monitor_wakeup_host', 'monitor_wakeup_port',
+                                        'MONITOR_WAKEUP', '127.0.0.1', DEFAULT_MONITOR_PORT)
+        # اگر بسته UDP نرسد، ربات رصد در poll بعدی دستور را برمی‌دارد
+        send_wakeup(host, port, {'command_id': command_id})
+        return True
     
-    def trigger_join_channel(self, channel_id: int, channel_identifier: str):
-        """ایجاد فایل flag برای join کردن کانال"""
-        try:
-            # استفاده از دایرکتوری data برای فایل‌های flag (مشترک بین containers)
-            data_dir = os.path.join(os.getcwd(), 'data')
-            os.makedirs(data_dir, exist_ok=True)
-            
-            join_file = 'join_channel.flag'
-            join_path = os.path.join(data_dir, join_file)
-            join_data = {
-                'channel_id': channel_id,
-                'channel_identifier': channel_identifier
-            }
-            with open(join_path, 'w', encoding='utf-8') as f:
-                json.dump(join_data, f, ensure_ascii=False, indent=2)
-            print(f"🚩 فایل join_channel.flag ایجاد شد در {join_path} برای channel_id: {channel_id}")
-            return True
-        except Exception as e:
-            print(f"خطا در ایجاد فایل join flag: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+    async def trigger_immediate_check(self, user_id: int = None) -> bool:
+        """درخواست بررسی فوری کانال‌ها"""
+        return await self.send_command('check', {'user_id': user_id})
     
-    def trigger_leave_channel(self, channel_id: int, username: str):
-        """ایجاد فایل flag برای leave کردن کانال فوری"""
-        try:
-            # استفاده از دایرکتوری data برای فایل‌های flag (مشترک بین containers)
-            data_dir = os.path.join(os.getcwd(), 'data')
-            os.makedirs(data_dir, exist_ok=True)
-            
-            leave_file = 'leave_channel.flag'
-            leave_path = os.path.join(data_dir, leave_file)
-            leave_data = {
-                'channel_id': channel_id,
-                'username': username
-            }
-            with open(leave_path, 'w', encoding='utf-8') as f:
-                json.dump(leave_data, f, ensure_ascii=False, indent=2)
-            print(f"🚩 فایل leave_channel.flag ایجاد شد در {leave_path} برای channel_id: {channel_id}")
-            return True
-        except Exception as e:
-            print(f"خطا در ایجاد فایل leave flag: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+    async def trigger_join_channel(self, channel_id: int, channel_identifier: str):
+        """درخواست join کردن کانال"""
+        return await self.send_command('join', {
+            'channel_id': channel_id,
+            'channel_identifier': channel_identifier
+        })
     
-    def read_notification_file(self) -> dict:
-        """خواندن فایل notification بدون حذف"""
-        notification_file = 'check_notification.json'
-        notification_path = os.path.join(os.getcwd(), notification_file)
-        
-        if not os.path.exists(notification_path):
+    async def trigger_leave_channel(self, channel_id: int, username: str):
+        """درخواست leave کردن فوری کانال"""
+        return await self.send_command('leave', {
+            'channel_id': channel_id,
+            'username': username
+        })
+    
+    def format_notification(self, notification: dict) -> str:
+        """متن پیام یک اطلاع‌رسانی (None اگر پیامی لازم نیست)"""
+        payload = notification['payload']
+        if notification['kind'] != 'check_finished' or not payload.get('success'):
             return None
         
-        try:
-            with open(notification_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return data
-        except Exception as e:
-            print(f"❌ خطا در خواندن فایل notification: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
+        last_update_text = ""
+        if payload.get('last_update'):
+            last_update = datetime.utcfromtimestamp(payload['last_update'])
+            last_update_text = f"\n🕐 آخرین آپدیت: {last_update.strftime('%Y-%m-%d %H:%M')}"
+        
+        return (
+            "✅ بررسی کانال‌ها تکمیل شد!\n\n"
+            f"📊 تعداد کانال‌های بررسی شده: {payload.get('channels_count', 0)}{last_update_text}\n\n"
+            "حالا می‌توانید:\n"
+            "• آمار را مشاهده کنید (📊 مشاهده آمار)\n"
+            "• خروجی اکسل بگیرید (📥 خروجی اکسل)"
+        )
+    
+    async def deliver_notifications(self, bot):
+        """تحویل اطلاع‌رسانی‌های در انتظار به کاربران (حداقل یک‌بار)
+        
+        هر اطلاع‌رسانی فقط بعد از ارسال موفق پیام delivered می‌شود؛ ارسال ناموفق در
+        بیدارباش یا poll بعدی تا notification_max_attempts بار تکرار می‌شود.
+        """
+        for notification in await self.adb.get_pending_notifications():
+            notification_id = notification['id']
+            user_id = notification['user_id']
+            try:
+                message_text = self.format_notification(notification)
+                if message_text:
+                    await bot.send_message(
+                        chat_id=user_id,
+                        text=message_text,
+                        reply_markup=self.get_main_keyboard()
+                    )
+                    print(f"✅ پیام اطلاع‌رسانی {notification_id} به کاربر {user_id} ارسال شد")
+                else:
+                    print(f"⚠️ notification {notification_id} پیامی ندارد: {notification['payload']}")
+                await self.adb.mark_notification_delivered(notification_id)
+            except Exception as e:
+                print(f"❌ خطا در ارسال notification {notification_id} به کاربر {user_id}: {e}")
+                try:
+                    if await self.adb.mark_notification_failed(notification_id, self.notification_max_attempts):
+                        print(f"⚠️ notification {notification_id} بعد از {self.notification_max_attempts} تلاش کنار گذاشته شد")
+                except Exception as db_error:
+                    print(f"❌ خطا در ثبت تلاش ناموفق notification {notification_id}: {db_error}")
     
-    def delete_notification_file(self):
-        """حذف فایل notification"""
-        notification_file = 'check_notification.json'
-        notification_path = os.path.join(os.getcwd(), notification_file)
-        if os.path.exists(notification_path):
+    async def notification_loop(self, bot):
+        """انتظار برای بیدارباش ربات رصد (یا poll پشتیبان) و تحویل اطلاع‌رسانی‌ها"""
+        await self.notification_wakeup.start()
+        while True:
             try:
-                os.remove(notification_path)
-                print(f"🗑️ فایل notification حذف شد")
+                await self.deliver_notifications(bot)
             except Exception as e:
-                print(f"⚠️ خطا در حذف فایل notification: {e}")
+                print(f"❌ خطا در تحویل notificationها: {e}")
+                import traceback
+                traceback.print_exc()
+            await self.notification_wakeup.wait(self.notification_poll_interval)
     
-    async def check_and_notify(self, context: ContextTypes.DEFAULT_TYPE):
-        """چک کردن فایل notification و اطلاع‌رسانی به کاربر"""
-        try:
-            # خواندن فایل notification (بدون حذف)
-            notification = self.read_notification_file()
-            
-            if notification:
-                user_id = notification.get('user_id')
-                channels_count = notification.get('channels_count', 0)
-                success = notification.get('success', False)
-                
-                print(f"📩 فایل notification پیدا شد!")
-                print(f"   user_id={user_id}, channels={channels_count}, success={success}")
-                
-                if user_id and success:
-                    try:
-                        # دریافت آخرین زمان آپدیت
-                        latest_stats = self.db.get_all_stats()
-                        last_update_text = ""
-                        if latest_stats:
-                            last_stat = latest_stats[0]
-                            if last_stat.get('recorded_at'):
-                                try:
-                                    date_obj = datetime.fromisoformat(last_stat['recorded_at'].replace('Z', '+00:00'))
-                                    last_update_text = f"\n🕐 آخرین آپدیت: {date_obj.strftime('%Y-%m-%d %H:%M')}"
-                                except:
-                                    pass
-                        
-                        message_text = (
-                            "✅ بررسی کانال‌ها تکمیل شد!\n\n"
-                            f"📊 تعداد کانال‌های بررسی شده: {channels_count}{last_update_text}\n\n"
-                            "حالا می‌توانید:\n"
-                            "• آمار را مشاهده کنید (📊 مشاهده آمار)\n"
-                            "• خروجی اکسل بگیرید (📥 خروجی اکسل)"
-                        )
-                        
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=message_text,
-                            reply_markup=self.get_main_keyboard()
-                        )
-                        print(f"✅ پیام اطلاع‌رسانی به کاربر {user_id} با موفقیت ارسال شد!")
-                        # فقط بعد از ارسال موفق پیام، فایل را حذف می‌کنیم
-                        self.delete_notification_file()
-                    except Exception as e:
-                        print(f"❌ خطا در ارسال پیام به کاربر {user_id}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                elif not user_id:
-                    print(f"⚠️ user_id در notification موجود نیست. notification: {notification}")
-                    self.delete_notification_file()  # حذف فایل نامعتبر
-                elif not success:
-                    print(f"⚠️ بررسی موفق نبوده است. notification: {notification}")
-                    self.delete_notification_file()  # حذف فایل نامعتبر
-        except Exception as e:
-            print(f"❌ خطا در check_and_notify: {e}")
-            import traceback
-            traceback.print_exc()
+    async def post_init(self, application: Application):
+        """شروع حلقه اطلاع‌رسانی بعد از راه‌اندازی ربات"""
+        self.notification_task = asyncio.create_task(self.notification_loop(application.bot))
+        print("✅ حلقه اطلاع‌رسانی (جدول notifications) فعال شد")
+    
+    async def post_shutdown(self, application: Application):
+        """توقف حلقه اطلاع‌رسانی"""
+        if self.notification_task:
+            self.notification_task.cancel()
+        self.notification_wakeup.close()
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور /start"""
@@ -243,8 +209,8 @@ class AdminBot:
             return
         
         # افزودن کاربر اول به عنوان ادمین
-        if not self.db.is_admin(user_id):
-            self.db.add_admin(user_id, username)
+        if not await self.adb.is_admin(user_id):
+            await self.adb.add_admin(user_id, username)
             message_text = (
                 "✅ به عنوان ادمین اضافه شدید!\n\n"
                 "🤖 ربات مدیریت کانال‌های تلگرام\n\n"
@@ -264,24 +230,46 @@ class AdminBot:
     async def check_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
         """بررسی ادمین بودن کاربر"""
         user_id = update.effective_user.id
-        if not self.db.is_admin(user_id):
+        if not await self.adb.is_admin(user_id):
             message = self.get_message(update)
             if message:
                 await message.reply_text("❌ شما دسترسی ادمین ندارید!")
             return False
         return True
     
+    def channel_status(self, channel: dict) -> str:
+        """وضعیت عضویت کانال در لیست کانال‌ها (شامل قرنطینه و زمان تلاش بعدی join)"""
+        failure = channel.get('failure')
+        label = self.FAILURE_LABELS.get(failure, failure)
+        if channel.get('quarantined'):
+            # join یا آمار کانال چند بار پشت سر هم با خطای دائمی شکست خورده است
+            return f"🚫 قرنطینه ({label})"
+        if channel.get('is_member', 0):
+            return "✅ عضو"
+        if failure and channel.get('retry_at'):
+            retry_at = datetime.utcfromtimestamp(channel['retry_at']).strftime('%Y-%m-%d %H:%M')
+            return f"⏳ در انتظار عضویت ({label}، تلاش بعدی {retry_at})"
+        return "⏳ در انتظار عضویت"
+    
+    def quarantine_summary(self, channels: list) -> str:
+        """تعداد کانال‌های قرنطینه برای انتهای لیست کانال‌ها"""
+        quarantined = sum(1 for channel in channels if channel.get('quarantined'))
+        if not quarantined:
+            return ""
+        return (f"\n🚫 قرنطینه: {quarantined} کانال "
+                f"(لینک یا username را اصلاح کنید یا کانال را حذف و دوباره اضافه کنید)")
+    
     async def list_channels(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """لیست کانال‌ها"""
         if not await self.check_admin(update, context):
             return
         
-        channels = self.db.get_all_active_channels()  # همه کانال‌های فعال را بگیر
+        channels = await self.adb.get_all_active_channels()  # همه کانال‌های فعال را بگیر
         
         message = self.get_message(update)
         if not message:
             return
-            
+        
         if not channels:
             await message.reply_text(
                 "📭 هیچ کانال فعالی وجود ندارد.\n\n"
@@ -295,8 +283,7 @@ class AdminBot:
             title = channel.get('title', 'بدون عنوان')
             username = channel['username']
             category = channel.get('category', '')
-            is_member = channel.get('is_member', 0)
-            member_status = "✅ عضو" if is_member else "⏳ در انتظار عضویت"
+            member_status = self.channel_status(channel)
             
             text += f"{i}. {title}\n"
             if username.startswith('http') or username.startswith('+'):
@@ -308,6 +295,7 @@ class AdminBot:
             text += f"   {member_status}\n\n"
         
         text += f"\n📊 تعداد کل: {len(channels)} کانال"
+        text += self.quarantine_summary(channels)
         
         await message.reply_text(text, reply_markup=self.get_main_keyboard())
     
@@ -380,7 +368,7 @@ class AdminBot:
         context.user_data['channel_input'] = input_text
         
         # دریافت لیست دسته‌بندی‌های موجود از دیتابیس
-        categories = self.db.get_all_categories()
+        categories = await self.adb.get_all_categories()
         
         print(f"DEBUG: دسته‌بندی‌های دریافت شده: {categories}")  # لاگ برای دیباگ
         
@@ -437,12 +425,12 @@ class AdminBot:
         
         # افزودن کانال با دسته‌بندی (اول بدون is_member)
         if is_invite_link:
-            success = self.db.add_channel(input_text, "", user_id, invite_link=input_text, category=category)
+            success = await self.adb.add_channel(input_text, "", user_id, invite_link=input_text, category=category)
             channel_display = f"لینک کانال"
             channel_identifier = input_text
         else:
             username = input_text.lstrip('@')
-            success = self.db.add_channel(username, "", user_id, category=category)
+            success = await self.adb.add_channel(username, "", user_id, category=category)
             channel_display = f"@{username}"
             channel_identifier = username
         
@@ -454,12 +442,12 @@ class AdminBot:
             # برای invite link، از input_text استفاده می‌کنیم (همان چیزی که در دیتابیس ذخیره شده)
             # برای username، از channel_identifier استفاده می‌کنیم
             search_username = input_text if is_invite_link else channel_identifier
-            channel_info = self.db.get_channel_by_username(search_username)
+            channel_info = await self.adb.get_channel_by_username(search_username)
             
             if channel_info:
                 channel_id = channel_info['id']
-                # ایجاد فایل flag برای join کردن کانال
-                self.trigger_join_channel(channel_id, channel_identifier)
+                # ثبت دستور join در صف ربات رصد
+                await self.trigger_join_channel(channel_id, channel_identifier)
             else:
                 # اگر نتوانستیم channel_info را پیدا کنیم، سعی می‌کنیم از آخرین کانال اضافه شده استفاده کنیم
                 print(f"⚠️ نتوانستیم channel_info را برای {search_username} پیدا کنیم")
@@ -517,7 +505,7 @@ class AdminBot:
         category_name = message.text.strip()
         
         # بررسی اینکه دسته‌بندی قبلاً وجود داشته
-        existing_categories = self.db.get_all_categories()
+        existing_categories = await self.adb.get_all_categories()
         if category_name in existing_categories:
             await message.reply_text(
                 f"⚠️ دسته‌بندی '{category_name}' قبلاً وجود دارد!",
@@ -526,7 +514,7 @@ class AdminBot:
             return ConversationHandler.END
         
         # ذخیره دسته‌بندی در جدول categories
-        success = self.db.add_category(category_name)
+        success = await self.adb.add_category(category_name)
         
         if success:
             await message.reply_text(
@@ -552,7 +540,7 @@ class AdminBot:
             return
         
         # دریافت لیست دسته‌بندی‌های موجود
-        categories = self.db.get_all_categories()
+        categories = await self.adb.get_all_categories()
         
         if not categories:
             await message.reply_text(
@@ -566,7 +554,7 @@ class AdminBot:
         
         for i, category in enumerate(sorted(categories), 1):
             # شمارش تعداد کانال‌های این دسته
-            channel_count = self.db.get_channels_count_by_category(category)
+            channel_count = await self.adb.get_channels_count_by_category(category)
             text += f"{i}. {category}\n   📊 تعداد کانال‌ها: {channel_count}\n\n"
         
         text += f"\n📊 تعداد کل: {len(categories)} دسته‌بندی"
@@ -583,7 +571,7 @@ class AdminBot:
             return
         
         # دریافت لیست دسته‌بندی‌های موجود
-        categories = self.db.get_all_categories()
+        categories = await self.adb.get_all_categories()
         
         if not categories:
             await message.reply_text(
@@ -596,7 +584,7 @@ class AdminBot:
         keyboard = []
         for category in sorted(categories):
             # شمارش تعداد کانال‌های این دسته
-            channel_count = self.db.get_channels_count_by_category(category)
+            channel_count = await self.adb.get_channels_count_by_category(category)
             button_text = f"📁 {category} ({channel_count} کانال)"
             keyboard.append([InlineKeyboardButton(button_text, callback_data=f"delete_category_{category}")])
         
@@ -616,7 +604,7 @@ class AdminBot:
         if not await self.check_admin(update, context):
             return
         
-        channels = self.db.get_all_active_channels()  # همه کانال‌های فعال را نمایش می‌دهیم
+        channels = await self.adb.get_all_active_channels()  # همه کانال‌های فعال را نمایش می‌دهیم
         
         message = self.get_message(update)
         if not message:
@@ -650,16 +638,16 @@ class AdminBot:
         query = update.callback_query
         await query.answer()
         
-        channel = self.db.get_channel_by_id(channel_id)
+        channel = await self.adb.get_channel_by_id(channel_id)
         
         if channel:
             username = channel['username']
             channel_id = channel['id']
-            success = self.db.remove_channel(username)
+            success = await self.adb.remove_channel(username)
             
             if success:
-                # ایجاد فایل flag برای خروج فوری از کانال
-                self.trigger_leave_channel(channel_id, username)
+                # ثبت دستور leave در صف ربات رصد
+                await self.trigger_leave_channel(channel_id, username)
                 
                 await query.edit_message_text(
                     f"✅ کانال @{username} با موفقیت حذف شد!\n\n"
@@ -686,7 +674,7 @@ class AdminBot:
         if not message:
             return
         
-        stats = self.db.get_all_stats()
+        stats = await self.adb.get_stats_with_baselines()
         
         if not stats:
             await message.reply_text(
@@ -717,12 +705,11 @@ class AdminBot:
             text += f"├" + "─" * 28 + "\n"
             
             for i, stat in enumerate(category_stats, 1):
-                channel_id = stat.get('id')
                 username = stat.get('username', 'نامشخص')
                 title = stat.get('title', 'بدون عنوان')
                 member_count = stat.get('member_count', 0) or 0
                 member_change = stat.get('member_change', 0) or 0
-                recorded_at = stat.get('recorded_at', '')
+                recorded_at = stat.get('recorded_at')
                 views_count = stat.get('views_count', 0) or 0
                 views_change = stat.get('views_change', 0) or 0
                 
@@ -734,10 +721,9 @@ class AdminBot:
                 
                 # محاسبه تغییر نسبت به اولین روز
                 change_from_first = 0
-                if channel_id:
-                    first_stats = self.db.get_first_stats(channel_id)
-                    if first_stats and first_stats.get('member_count'):
-                        change_from_first = member_count - (first_stats.get('member_count', 0) or 0)
+                first_member_count = stat.get('first_member_count')
+                if first_member_count:
+                    change_from_first = member_count - first_member_count
                 
                 # نمایش username یا invite link
                 if username.startswith('http') or username.startswith('+') or username.startswith('t.me'):
@@ -747,14 +733,8 @@ class AdminBot:
                 else:
                     username_display = f"@{username}"
                 
-                # فرمت تاریخ آخرین آپدیت
-                last_update_text = ""
-                if recorded_at:
-                    try:
-                        date_obj = datetime.fromisoformat(recorded_at.replace('Z', '+00:00'))
-                        last_update_text = date_obj.strftime('%Y/%m/%d %H:%M')
-                    except:
-                        last_update_text = recorded_at[:16] if len(recorded_at) >= 16 else recorded_at
+                # فرمت تاریخ آخرین آپدیت (recorded_at از دیتابیس datetime است)
+                last_update_text = recorded_at.strftime('%Y/%m/%d %H:%M') if recorded_at else ""
                 
                 # تعیین وضعیت تغییر
                 status_icon = "📈" if member_change > 0 else "📉" if member_change < 0 else "➡️"
@@ -784,6 +764,10 @@ class AdminBot:
                 # نمایش views اگر موجود باشد
                 if views_count > 0:
                     text += f"│    👁️ بازدید: {views_count:,}\n"
+                # میانگین بازدید پست‌ها 24 ساعت بعد از انتشار (از post_stats)
+                if stat.get('avg_views_after_hours') is not None:
+                    text += (f"│    🕒 میانگین بازدید 24 ساعت اول: {stat['avg_views_after_hours']:,} "
+                             f"({stat['views_after_hours_posts']} پست)\n")
                 
                 # خط جداکننده بین کانال‌ها (جز آخرین)
                 if i < len(category_stats):
@@ -836,9 +820,8 @@ class AdminBot:
             reply_markup=reply_markup
         )
     
-    def create_excel(self) -> str:
-        """ایجاد فایل اکسل - گروه‌بندی بر اساس دسته‌بندی"""
-        stats = self.db.get_all_stats()
+    def create_excel(self, stats: list) -> str:
+        """ایجاد فایل اکسل - گروه‌بندی بر اساس دسته‌بندی (stats از get_stats_with_baselines)"""
         
         # ایجاد workbook
         wb = openpyxl.Workbook()
@@ -848,7 +831,8 @@ class AdminBot:
             wb.remove(wb["Sheet"])
         
         # هدرها
-        headers = ["Title", "Username Date", "Member Count", "Change from Yesterday", "Change from First Day", "Positive Change"]
+        headers = ["Title", "Username Date", "Member Count", "Change from Yesterday", "Change from First Day", "Positive Change",
+                   "Avg Views 24h"]
         
         # استایل هدر
         header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
@@ -877,36 +861,24 @@ class AdminBot:
             
             # داده‌ها برای این دسته‌بندی
             for stat in category_stats:
-                channel_id = stat.get('id')
                 username = stat.get('username', '')
                 title = stat.get('title', 'بدون عنوان')
-                recorded_at = stat.get('recorded_at', '')
+                recorded_at = stat.get('recorded_at') or datetime.now()
                 
-                # فرمت تاریخ
-                if recorded_at:
-                    try:
-                        date_obj = datetime.fromisoformat(recorded_at.replace('Z', '+00:00'))
-                        date_str = date_obj.strftime('%Y-%m-%d')
-                    except:
-                        date_str = recorded_at[:10] if len(recorded_at) >= 10 else datetime.now().strftime('%Y-%m-%d')
-                else:
-                    date_str = datetime.now().strftime('%Y-%m-%d')
+                # فرمت تاریخ (recorded_at از دیتابیس datetime است)
+                date_str = recorded_at.strftime('%Y-%m-%d')
                 
                 member_count = stat.get('member_count', 0) or 0
                 
                 # محاسبه تغییر نسبت به دیروز
                 change_from_yesterday = 0
-                if channel_id:
-                    yesterday_stats = self.db.get_yesterday_stats(channel_id)
-                    if yesterday_stats:
-                        change_from_yesterday = member_count - (yesterday_stats.get('member_count', 0) or 0)
+                if stat.get('yesterday_member_count') is not None:
+                    change_from_yesterday = member_count - (stat['yesterday_member_count'] or 0)
                 
                 # محاسبه تغییر نسبت به اولین روز
                 change_from_first_day = 0
-                if channel_id:
-                    first_stats = self.db.get_first_stats(channel_id)
-                    if first_stats:
-                        change_from_first_day = member_count - (first_stats.get('member_count', 0) or 0)
+                if stat.get('first_member_count') is not None:
+                    change_from_first_day = member_count - (stat['first_member_count'] or 0)
                 
                 positive_change = stat.get('positive_change', 0) or 0
                 
@@ -932,7 +904,8 @@ class AdminBot:
                     member_count,
                     change_from_yesterday,
                     change_from_first_day,
-                    positive_change
+                    positive_change,
+                    stat.get('avg_views_after_hours')
                 ]
                 ws.append(row)
             
@@ -943,6 +916,7 @@ class AdminBot:
             ws.column_dimensions['D'].width = 20
             ws.column_dimensions['E'].width = 20
             ws.column_dimensions['F'].width = 18
+            ws.column_dimensions['G'].width = 15
         
         # ذخیره فایل
         filename = f"channel_stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
@@ -960,9 +934,9 @@ class AdminBot:
             return
         
         # دریافت لیست همه دسته‌بندی‌های موجود
-        all_categories = self.db.get_all_categories()
+        all_categories = await self.adb.get_all_categories()
         # دریافت دسته‌بندی‌هایی که کانال فعال دارند
-        categories_with_channels = set(self.db.get_categories_with_active_channels())
+        categories_with_channels = set(await self.adb.get_categories_with_active_channels())
         
         if not all_categories:
             await message.reply_text(
@@ -1009,7 +983,7 @@ class AdminBot:
             await message.edit_text("⏳ در حال ساخت فایل‌های اکسل (همه دسته‌بندی‌ها)...\nلطفاً صبر کنید...")
             
             # دریافت لیست همه دسته‌بندی‌ها
-            categories = self.db.get_all_categories()
+            categories = await self.adb.get_all_categories()
             
             if not categories:
                 await message.edit_text(
@@ -1021,7 +995,7 @@ class AdminBot:
             # ساخت فایل برای هر دسته‌بندی
             filenames = []
             for category in sorted(categories):
-                filename = self.create_excel_by_category(category)
+                filename = await self.build_excel_by_category(category)
                 filenames.append((filename, category))
             
             # ارسال فایل‌ها
@@ -1039,7 +1013,7 @@ class AdminBot:
                 f"✅ {len(filenames)} فایل اکسل با موفقیت ارسال شد!",
                 reply_markup=self.get_main_keyboard()
             )
-            
+        
         except Exception as e:
             await message.reply_text(
                 f"❌ خطا در ساخت فایل اکسل: {e}",
@@ -1062,7 +1036,7 @@ class AdminBot:
         
         try:
             await message.edit_text(f"⏳ در حال ساخت فایل اکسل (دسته‌بندی: {category})...\nلطفاً صبر کنید...")
-            filename = self.create_excel_by_category(category)
+            filename = await self.build_excel_by_category(category)
             
             with open(filename, 'rb') as f:
                 await message.reply_document(
@@ -1073,19 +1047,22 @@ class AdminBot:
             
             # حذف فایل موقت
             os.remove(filename)
-            
+        
         except Exception as e:
             await message.reply_text(
                 f"❌ خطا در ساخت فایل اکسل: {e}",
                 reply_markup=self.get_main_keyboard()
             )
     
-    def create_excel_by_category(self, category: str) -> str:
-        """ایجاد فایل اکسل برای یک دسته‌بندی خاص"""
-        stats = self.db.get_all_stats()
-        
-        # فیلتر کردن آمار بر اساس دسته‌بندی
-        category_stats = [stat for stat in stats if stat.get('category') == category]
+    async def build_excel_by_category(self, category: str) -> str:
+        """ساخت فایل اکسل یک دسته‌بندی بدون بلاک کردن event loop"""
+        # آمار فقط همین دسته‌بندی به همراه مبناهای دیروز و روز اول در یک پرس‌وجو
+        category_stats = await self.adb.get_stats_with_baselines(category)
+        # ساخت و ذخیره workbook کار CPU/دیسک است و در thread جداگانه انجام می‌شود
+        return await asyncio.to_thread(self.create_excel_by_category, category, category_stats)
+    
+    def create_excel_by_category(self, category: str, category_stats: list) -> str:
+        """ایجاد فایل اکسل برای یک دسته‌بندی خاص (category_stats از get_stats_with_baselines)"""
         
         # ایجاد workbook
         wb = openpyxl.Workbook()
@@ -1093,7 +1070,8 @@ class AdminBot:
         ws.title = category[:31]  # محدودیت 31 کاراکتر
         
         # هدرها
-        headers = ["Title", "Username Date", "Member Count", "Change from Yesterday", "Change from First Day", "Positive Change"]
+        headers = ["Title", "Username Date", "Member Count", "Change from Yesterday", "Change from First Day", "Positive Change",
+                   "Avg Views 24h"]
         ws.append(headers)
         
         # استایل هدر
@@ -1107,36 +1085,24 @@ class AdminBot:
         
         # داده‌ها
         for stat in category_stats:
-            channel_id = stat.get('id')
             username = stat.get('username', '')
             title = stat.get('title', 'بدون عنوان')
-            recorded_at = stat.get('recorded_at', '')
+            recorded_at = stat.get('recorded_at') or datetime.now()
             
-            # فرمت تاریخ
-            if recorded_at:
-                try:
-                    date_obj = datetime.fromisoformat(recorded_at.replace('Z', '+00:00'))
-                    date_str = date_obj.strftime('%Y-%m-%d')
-                except:
-                    date_str = recorded_at[:10] if len(recorded_at) >= 10 else datetime.now().strftime('%Y-%m-%d')
-            else:
-                date_str = datetime.now().strftime('%Y-%m-%d')
+            # فرمت تاریخ (recorded_at از دیتابیس datetime است)
+            date_str = recorded_at.strftime('%Y-%m-%d')
             
             member_count = stat.get('member_count', 0) or 0
             
             # محاسبه تغییر نسبت به دیروز
             change_from_yesterday = 0
-            if channel_id:
-                yesterday_stats = self.db.get_yesterday_stats(channel_id)
-                if yesterday_stats:
-                    change_from_yesterday = member_count - (yesterday_stats.get('member_count', 0) or 0)
+            if stat.get('yesterday_member_count') is not None:
+                change_from_yesterday = member_count - (stat['yesterday_member_count'] or 0)
             
             # محاسبه تغییر نسبت به اولین روز
             change_from_first_day = 0
-            if channel_id:
-                first_stats = self.db.get_first_stats(channel_id)
-                if first_stats:
-                    change_from_first_day = member_count - (first_stats.get('member_count', 0) or 0)
+            if stat.get('first_member_count') is not None:
+                change_from_first_day = member_count - (stat['first_member_count'] or 0)
             
             positive_change = stat.get('positive_change', 0) or 0
             
@@ -1161,7 +1127,8 @@ class AdminBot:
                 member_count,
                 change_from_yesterday,
                 change_from_first_day,
-                positive_change
+                positive_change,
+                stat.get('avg_views_after_hours')
             ]
             ws.append(row)
         
@@ -1172,6 +1139,7 @@ class AdminBot:
         ws.column_dimensions['D'].width = 20
         ws.column_dimensions['E'].width = 20
         ws.column_dimensions['F'].width = 18
+        ws.column_dimensions['G'].width = 15
         
         # ذخیره فایل
         filename = f"channel_stats_{category}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
@@ -1212,7 +1180,7 @@ class AdminBot:
         elif text == "⚡ بررسی فوری":
             user_id = update.effective_user.id
             # محاسبه زمان تقریبی بر اساس تعداد کانال‌ها (همه کانال‌های فعال)
-            channels = self.db.get_all_active_channels()
+            channels = await self.adb.get_all_active_channels()
             channel_count = len(channels)
             # هر کانال حدود 2-3 ثانیه زمان می‌برد
             estimated_seconds = channel_count * 3
@@ -1227,7 +1195,7 @@ class AdminBot:
             else:
                 time_text = f"حدود {estimated_seconds} ثانیه"
             
-            success = self.trigger_immediate_check(user_id)
+            success = await self.trigger_immediate_check(user_id)
             if success:
                 await message.reply_text(
                     "⚡ درخواست بررسی فوری ارسال شد!\n\n"
@@ -1252,7 +1220,7 @@ class AdminBot:
         
         if data == "list_channels":
             await query.answer("در حال دریافت لیست کانال‌ها...")
-            channels = self.db.get_all_active_channels()  # همه کانال‌های فعال را بگیر
+            channels = await self.adb.get_all_active_channels()  # همه کانال‌های فعال را بگیر
             
             if not channels:
                 await query.edit_message_text(
@@ -1267,8 +1235,7 @@ class AdminBot:
                 title = channel.get('title', 'بدون عنوان')
                 username = channel['username']
                 category = channel.get('category', '')
-                is_member = channel.get('is_member', 0)
-                member_status = "✅ عضو" if is_member else "⏳ در انتظار عضویت"
+                member_status = self.channel_status(channel)
                 
                 text += f"{i}. {title}\n"
                 if username.startswith('http') or username.startswith('+'):
@@ -1280,12 +1247,13 @@ class AdminBot:
                 text += f"   {member_status}\n\n"
             
             text += f"\n📊 تعداد کل: {len(channels)} کانال"
+            text += self.quarantine_summary(channels)
             
             await query.edit_message_text(text, reply_markup=self.get_inline_keyboard())
         
         elif data == "show_stats":
             await query.answer("در حال دریافت آمار...")
-            stats = self.db.get_all_stats()
+            stats = await self.adb.get_stats_with_baselines()
             
             if not stats:
                 await query.edit_message_text(
@@ -1323,7 +1291,6 @@ class AdminBot:
                 text += f"├" + "─" * 28 + "\n"
                 
                 for i, stat in enumerate(category_stats[:3], 1):
-                    channel_id = stat.get('id')
                     username = stat.get('username', 'نامشخص')
                     title = stat.get('title', 'بدون عنوان')
                     member_count = stat.get('member_count', 0) or 0
@@ -1332,10 +1299,9 @@ class AdminBot:
                     
                     # محاسبه تغییرات
                     change_from_first = 0
-                    if channel_id:
-                        first_stats = self.db.get_first_stats(channel_id)
-                        if first_stats and first_stats.get('member_count'):
-                            change_from_first = member_count - (first_stats.get('member_count', 0) or 0)
+                    first_member_count = stat.get('first_member_count')
+                    if first_member_count:
+                        change_from_first = member_count - first_member_count
                     
                     # نمایش username
                     if username.startswith('http') or username.startswith('+') or username.startswith('t.me'):
@@ -1357,6 +1323,9 @@ class AdminBot:
                     if change_from_first != 0:
                         first_sign = "+" if change_from_first > 0 else ""
                         text += f"│    📊 {first_sign}{change_from_first:,}\n"
+                    
+                    if stat.get('avg_views_after_hours') is not None:
+                        text += f"│    🕒 {stat['avg_views_after_hours']:,} (24h)\n"
                 
                 if len(category_stats) > 3:
                     text += f"│\n│    ... و {len(category_stats) - 3} کانال دیگر\n"
@@ -1386,7 +1355,7 @@ class AdminBot:
             await query.answer()
             # نمایش منوی انتخاب نوع خروجی
             # دریافت لیست همه دسته‌بندی‌های موجود
-            categories = self.db.get_all_categories()
+            categories = await self.adb.get_all_categories()
             
             if not categories:
                 await query.edit_message_text(
@@ -1434,7 +1403,7 @@ class AdminBot:
             await query.answer()
             
             # حذف دسته‌بندی (تبدیل همه کانال‌های آن به NULL)
-            success = self.db.delete_category(category)
+            success = await self.adb.delete_category(category)
             
             if success:
                 await query.edit_message_text(
@@ -1457,7 +1426,7 @@ class AdminBot:
         
         elif data == "confirm_reset_all":
             await query.answer("در حال Reset آمار...")
-            success = self.db.reset_channel_stats()
+            success = await self.adb.reset_channel_stats()
             
             if success:
                 await query.edit_message_text(
@@ -1482,7 +1451,7 @@ class AdminBot:
         elif data == "trigger_check":
             await query.answer("درخواست بررسی فوری ارسال شد...")
             user_id = update.effective_user.id
-            success = self.trigger_immediate_check(user_id)
+            success = await self.trigger_immediate_check(user_id)
             if success:
                 await query.edit_message_text(
                     "⚡ درخواست بررسی فوری ارسال شد!\n\n"
@@ -1520,7 +1489,13 @@ class AdminBot:
             self.config['bot_token'] = token
             self.save_config()
         
-        application = Application.builder().token(token).build()
+        application = (
+            Application.builder()
+            .token(token)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         
         # Conversation handler برای افزودن کانال
         add_channel_conv = ConversationHandler(
@@ -1568,19 +1543,6 @@ class AdminBot:
         # در آخر MessageHandler را اضافه می‌کنیم
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
         
-        # اضافه کردن JobQueue برای چک کردن notification
-        job_queue = application.job_queue
-        if job_queue:
-            # چک کردن notification هر 3 ثانیه
-            job_queue.run_repeating(
-                self.check_and_notify,
-                interval=3.0,
-                first=3.0
-            )
-            print("✅ JobQueue برای چک کردن notification فعال شد")
-        else:
-            print("⚠️ JobQueue در دسترس نیست!")
-        
         print("🤖 ربات مدیریتی شروع به کار کرد...")
         application.run_polling(allowed_updates=Update.ALL_TYPES)
 
@@ -0,0 +1,86 @@
+"""
+دسته‌بندی خطاهای join و دریافت آمار کانال‌ها و زمان تلاش بعدی با backoff نمایی
+
+هر شکست join یا دریافت آمار یک کانال با دسته خطا (expired، invalid، banned، flood،
+transient)، تعداد تلاش‌ها و زمان تلاش بعدی در جدول channel_failures ثبت می‌شود و
+sync_channels تا رسیدن آن زمان دوباره برای کانال درخواست نمی‌فرستد. فاصله تلاش‌ها با هر
+شکست دو برابر می‌شود؛ کانالی که failure_quarantine_after بار پشت سر هم با خطای دائمی
+(لینک منقضی، کانال نامعتبر یا مسدود) شکست خورده قرنطینه است و در ربات مدیریتی نمایش
+داده می‌شود. اولین نمونه آمار موفق وضعیت شکست کانال را پاک می‌کند.
+"""
+from typing import Dict, Optional
+from rate_limiter import RateLimitedError
+
+
+FAILURE_EXPIRED = 'expired'
+FAILURE_INVALID = 'invalid'
+FAILURE_BANNED = 'banned'
+FAILURE_FLOOD = 'flood'
+FAILURE_TRANSIENT = 'transient'
+
+# خطاهایی که با تکرار درخواست برطرف نمی‌شوند (لینک یا username باید در ربات مدیریتی اصلاح شود)
+PERMANENT_FAILURES = (FAILURE_EXPIRED, FAILURE_INVALID, FAILURE_BANNED)
+
+# نام کلاس خطاهای Telethon برای هر دسته (نام کلاس به جای import تا خطاهای نسخه‌های مختلف Telethon پوشش داده شوند)
+_ERROR_CLASSES = {
+    'InviteHashExpiredError': FAILURE_EXPIRED,
+    'InviteHashInvalidError': FAILURE_INVALID,
+    'InviteHashEmptyError': FAILURE_INVALID,
+    'UsernameNotOccupiedError': FAILURE_INVALID,
+    'UsernameInvalidError': FAILURE_INVALID,
+    'ChannelInvalidError': FAILURE_INVALID,
+    'PeerIdInvalidError': FAILURE_INVALID,
+    'ChannelPrivateError': FAILURE_BANNED,
+    'ChannelBannedError': FAILURE_BANNED,
+    'UserBannedInChannelError': FAILURE_BANNED,
+    'InviteRequestSentError': FAILURE_BANNED,
+    'FloodWaitError': FAILURE_FLOOD,
+    'SlowModeWaitError': FAILURE_FLOOD,
+    'ChannelsTooMuchError': FAILURE_FLOOD,
+}
+
+
+def classify_error(error) -> str:
+    """دسته خطای یک exception (یا پیام خطا) برای ثبت در channel_failures"""
+    if isinstance(error, RateLimitedError):
+        return FAILURE_FLOOD
+    failure = _ERROR_CLASSES.get(type(error).__name__)
+    if failure:
+        return failure
+    error_msg = str(error).lower()
+    if 'expired' in error_msg:
+        return FAILURE_EXPIRED
+    if 'flood' in error_msg or 'too much' in error_msg:
+        return FAILURE_FLOOD
+    if 'private' in error_msg or 'banned' in error_msg:
+        return FAILURE_BANNED
+    if 'invalid' in error_msg or 'not valid' in error_msg or 'not occupied' in error_msg:
+        return FAILURE_INVALID
+    return FAILURE_TRANSIENT
+
+
+class FailureBackoff:
+    """محاسبه زمان تلاش بعدی و وضعیت قرنطینه کانال‌هایی که join یا آمارشان شکست خورده"""
+    
+    def __init__(self, config: Dict = None):
+        config = config or {}
+        # اولین فاصله برای خطاهای گذرا و FloodWait؛ خطاهای دائمی از فاصله بزرگ‌تری شروع می‌شوند
+        self.base_delay = float(config.get('failure_retry_base', 600))
+        self.permanent_delay = float(config.get('failure_permanent_retry_base', 6 * 3600))
+        self.max_delay = max(self.base_delay, float(config.get('failure_retry_max', 7 * 86400)))
+        self.quarantine_after = max(1, int(config.get('failure_quarantine_after', 3)))
+    
+    def delay(self, failure: str, attempts: int, wait: Optional[float] = None) -> float:
+        """فاصله تا تلاش بعدی بعد از attempts شکست پشت سر هم (wait: زمان FloodWait اعلام شده)"""
+        base = self.permanent_delay if failure in PERMANENT_FAILURES else self.base_delay
+        delay = min(self.max_delay, base * 2 ** max(0, attempts - 1))
+        if wait:
+            delay = max(delay, float(wait))
+        return delay
+    
+    def next_retry_at(self, failure: str, attempts: int, now: float, wait: Optional[float] = None) -> int:
+        return int(now + self.delay(failure, attempts, wait))
+    
+    def is_quarantined(self, failure: str, attempts: int) -> bool:
+        """کانال با خطای دائمی که quarantine_after بار پشت سر هم شکست خورده است"""
+        return failure in PERMANENT_FAILURES and attempts >= self.quarantine_after
@@ -2,32 +2,116 @@
 ربات Telethon برای رصد کانال‌ها و ثبت آمار
 """
 import asyncio
+import contextvars
 import json
 import os
 import sys
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError, UsernameNotOccupiedError, InviteHashExpiredError, InviteHashInvalidError
-from telethon.tl.functions.channels import GetFullChannelRequest, JoinChannelRequest, LeaveChannelRequest
-from telethon.tl.functions.messages import ImportChatInviteRequest, CheckChatInviteRequest
-from database import Database
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError
+from telethon.tl.functions.channels import GetFullChannelRequest, GetChannelsRequest, JoinChannelRequest, LeaveChannelRequest
+from telethon.tl.functions.messages import ImportChatInviteRequest, CheckChatInviteRequest, GetHistoryRequest, GetMessagesViewsRequest
+from telethon.tl.types import InputChannel, InputPeerChannel, ChatInviteAlready
+from database import Database, AsyncDatabase
+from accounts import Account, load_accounts, plan_assignments
+from cycles import CycleCheckpoint
+from channel_failures import FailureBackoff, classify_error, FAILURE_EXPIRED, FAILURE_INVALID, FAILURE_TRANSIENT
+from leases import LeaseManager, default_worker_id
+from maintenance import DatabaseMaintenance
+from rate_limiter import RateLimiter, RateLimitedError
+from post_stats import PostRefreshPolicy, VIEWS_BATCH_SIZE
+from scheduler import ChannelScheduler
+from wakeup import WakeupListener, send_wakeup, get_wakeup_address, DEFAULT_MONITOR_PORT, DEFAULT_ADMIN_PORT
+
+
+# حسابی که task فعلی با آن کار می‌کند (هر task نسخه جداگانه دارد)
+_current_account = contextvars.ContextVar('current_account', default=None)
+
+# دلیل آخرین شکست join یا دریافت آمار در task فعلی: (دسته خطا، پیام، زمان FloodWait)
+_last_failure = contextvars.ContextVar('last_failure', default=None)
+
+# وضعیت لینک‌های invite در invite_cache
+INVITE_MEMBER = 'member'
+INVITE_JOINABLE = 'joinable'
+INVITE_EXPIRED = 'expired'
+INVITE_INVALID = 'invalid'
+
+
+def entity_id(entity):
+    """شناسه کانال از entity یا InputPeerChannel"""
+    return getattr(entity, 'id', None) or getattr(entity, 'channel_id', None)
 
 
 class ChannelMonitor:
     def __init__(self):
         self.config_file = 'config.json'
-        self.session_file = 'new'
-        self.client = None
         self.config = self.load_config()
+        # هر حساب session، کلاینت و محدودکننده نرخ خودش را دارد؛ اولین حساب پیش‌فرض است
+        self.accounts = {account.name: account for account in load_accounts(self.config)}
+        self.default_account = next(iter(self.accounts.values()))
         self.db = Database()
-        # استفاده از دایرکتوری data برای فایل‌های flag (مشترک بین containers)
-        self.data_dir = os.path.join(os.getcwd(), 'data')
-        os.makedirs(self.data_dir, exist_ok=True)
-        self.trigger_flag_file = os.path.join(self.data_dir, 'trigger_check.flag')
-        self.notification_file = 'check_notification.json'
-        self.join_flag_file = os.path.join(self.data_dir, 'join_channel.flag')
-        self.leave_flag_file = os.path.join(self.data_dir, 'leave_channel.flag')
-        
+        # چند worker روی یک دیتابیس: هر worker فقط حساب‌هایی را که lease آن‌ها را دارد پردازش می‌کند
+        self.leases = LeaseManager(self.db, default_worker_id(self.config), int(self.config.get('lease_ttl', 120)))
+        self.next_rebalance_at = 0.0
+        # پرس‌وجوهای مسیرهای پرتکرار روی thread دیتابیس اجرا می‌شوند تا event loop بلاک نشود
+        self.adb = AsyncDatabase(self.db)
+        self.maintenance = DatabaseMaintenance(self.db, self.config)
+        # دستورات ربات مدیریتی از جدول commands خوانده می‌شوند؛ بسته UDP فقط حلقه را زودتر بیدار می‌کند
+        _, wakeup_port = get_wakeup_address(self.config, 'wakeup_host', 'wakeup_port', 'MONITOR_WAKEUP',
+                                            '0.0.0.0', DEFAULT_MONITOR_PORT)
+        self.wakeup = WakeupListener(wakeup_port)
+        self.command_poll_interval = float(self.config.get('command_poll_interval', 30))
+        # هر check_interval ثانیه لیست کانال‌ها همگام می‌شود (join/leave)؛ زمان بررسی آمار هر کانال را scheduler تعیین می‌کند
+        self.normal_interval = int(self.config.get('check_interval', 1800))
+        self.next_check_at = 0.0
+        self.scheduler = ChannelScheduler(self.config)
+        # حداکثر کانال‌هایی که در هر نوبت از صف زمان‌بندی برداشته می‌شوند (بین نوبت‌ها دستورات اجرا می‌شوند)
+        self.schedule_batch_size = int(self.config.get('schedule_batch_size', 100))
+        # جمع‌آوری افزایشی پست‌ها: فقط پیام‌های بعد از last_message_id هر کانال و بازدید چند پست آخر
+        self.posts_enabled = bool(self.config.get('collect_posts', True))
+        self.posts_fetch_limit = max(1, int(self.config.get('posts_fetch_limit', 100)))
+        self.views_refresh_posts = max(1, int(self.config.get('views_refresh_posts', 20)))
+        # سری زمانی بازدید هر پست (post_stats) با فاصله به‌روزرسانی متناسب با سن پست
+        self.post_policy = PostRefreshPolicy(self.config)
+        # کش نتیجه CheckChatInviteRequest (لینک منقضی یا نامعتبر مدت بیشتری در کش می‌ماند)
+        self.invite_cache_ttl = int(self.config.get('invite_cache_ttl', 86400))
+        self.invite_negative_ttl = int(self.config.get('invite_negative_ttl', 7 * 86400))
+        # backoff نمایی برای کانال‌هایی که join یا آمارشان شکست می‌خورد (جدول channel_failures)
+        self.failure_backoff = FailureBackoff(self.config)
+        # دور بررسی کاملی که کمتر از cycle_resume_window ثانیه قبل شروع شده بعد از ری‌استارت ادامه پیدا می‌کند
+        self.cycle_resume_window = int(self.config.get('cycle_resume_window', self.normal_interval))
+    
+    @property
+    def account(self) -> Account:
+        """حساب task فعلی (با using_account تعیین می‌شود)"""
+        return _current_account.get() or self.default_account
+    
+    @property
+    def client(self):
+        """کلاینت تلگرام حساب فعلی"""
+        return self.account.client
+    
+    @property
+    def limiter(self) -> RateLimiter:
+        """همه درخواست‌های تلگرام از محدودکننده نرخ حساب فعلی عبور می‌کنند"""
+        return self.account.limiter
+    
+    def owns(self, account_name: str) -> bool:
+        """آیا lease حساب account_name (خالی: حساب پیش‌فرض) در اختیار این worker است"""
+        return (account_name or self.default_account.name) in self.leases.accounts
+    
+    @contextmanager
+    def using_account(self, name: str):
+        """اجرای درخواست‌های داخل بلوک با حساب name (حساب ناشناخته: حساب پیش‌فرض)"""
+        token = _current_account.set(self.accounts.get(name) or self.default_account)
+        try:
+            yield self.account
+        finally:
+            _current_account.reset(token)
+    
     def load_config(self):
         """بارگذاری تنظیمات از فایل"""
         if os.path.exists(self.config_file):
@@ -40,9 +124,19 @@ class ChannelMonitor:
         return {}
     
     async def setup_client(self):
-        """تنظیم و اتصال کلاینت تلگرام"""
+        """تنظیم و اتصال کلاینت حساب‌هایی که lease آن‌ها در اختیار این worker است"""
+        for name in self.accounts:
+            if not self.owns(name):
+                continue
+            with self.using_account(name):
+                await self.setup_account_client()
+        return True
+    
+    async def setup_account_client(self):
+        """تنظیم و اتصال کلاینت تلگرام حساب فعلی"""
+        account = self.account
         # دریافت api_id و api_hash از کاربر اگر وجود نداشته باشد
-        if not self.config.get('api_id') or not self.config.get('api_hash'):
+        if not (account.api_id and account.api_hash) and (not self.config.get('api_id') or not self.config.get('api_hash')):
             print("=== تنظیمات اولیه ===")
             api_id = input("API ID خود را وارد کنید: ").strip()
             api_hash = input("API Hash خود را وارد کنید: ").strip()
@@ -56,26 +150,30 @@ class ChannelMonitor:
             self.save_config()
         
         try:
-            api_id = int(self.config['api_id'])
-            api_hash = self.config['api_hash']
+            api_id = int(account.api_id or self.config['api_id'])
+            api_hash = account.api_hash or self.config['api_hash']
         except (ValueError, KeyError):
             print("خطا: API ID یا API Hash نامعتبر است!")
             sys.exit(1)
         
         # ایجاد کلاینت
-        self.client = TelegramClient(self.session_file, api_id, api_hash)
+        # FloodWaitها به محدودکننده نرخ می‌رسند (Telethon خودش صبر نمی‌کند)
+        account.client = TelegramClient(account.session, api_id, api_hash, flood_sleep_threshold=0)
         
         # اتصال
         await self.client.connect()
         
         # بررسی احراز هویت
         if not await self.client.is_user_authorized():
-            print("\n=== احراز هویت ===")
+            print(f"\n=== احراز هویت حساب {account.name} (session: {account.session}) ===")
             await self.authenticate()
         
         # تست اتصال
         me = await self.client.get_me()
-        print(f"\n✅ با موفقیت به حساب '{me.first_name}' متصل شدید!")
+        print(f"\n✅ حساب {account.name}: با موفقیت به حساب '{me.first_name}' متصل شدید!")
+        
+        # نمایه گفتگوها با به‌روزرسانی‌های همین کلاینت به‌روز می‌ماند
+        account.dialogs.attach(account.client, account.limiter)
         return True
     
     def save_config(self):
@@ -85,7 +183,8 @@ class ChannelMonitor:
     
     async def authenticate(self):
         """احراز هویت کاربر"""
-        phone = input("شماره تلفن خود را وارد کنید (با کد کشور مثلا +989123456789): ").strip()
+        phone = self.account.phone or input(
+            f"شماره تلفن حساب {self.account.name} را وارد کنید (با کد کشور مثلا +989123456789): ").strip()
         
         try:
             await self.client.send_code_request(phone)
@@ -152,12 +251,103 @@ class ChannelMonitor:
         
         return hash_part
     
+    async def check_invite(self, invite_link: str, use_cache: bool = True) -> tuple:
+        """بررسی لینک invite با کش invite_cache (جداگانه برای هر حساب)
+        
+        نتیجه مثبت تا invite_cache_ttl ثانیه و لینک منقضی یا نامعتبر تا invite_negative_ttl
+        ثانیه از کش خوانده می‌شود و CheckChatInviteRequest دوباره ارسال نمی‌شود.
+        
+        Returns:
+            (status, chat): status یکی از INVITE_MEMBER (chat: entity کانال یا InputPeerChannel)،
+            INVITE_JOINABLE (هنوز عضو نیستیم)، INVITE_EXPIRED یا INVITE_INVALID
+        
+        Raises:
+            RateLimitedError: اگر CheckChatInviteRequest محدود شده باشد
+        """
+        invite_hash = self.extract_invite_hash(invite_link)
+        cached = await self.adb.get_invite_cache(invite_hash, self.account.name) if use_cache else None
+        if cached and cached['status'] != INVITE_MEMBER:
+            return (cached['status'], None)
+        if cached:
+            chat = await self.find_dialog_entity(cached['chat_id'])
+            if chat is None and cached['access_hash'] is not None:
+                chat = InputPeerChannel(cached['chat_id'], cached['access_hash'])
+            if chat is not None:
+                return (INVITE_MEMBER, chat)
+        
+        chat = None
+        try:
+            invite = await self.rpc(CheckChatInviteRequest(invite_hash))
+        except RateLimitedError:
+            raise
+        except InviteHashExpiredError:
+            status = INVITE_EXPIRED
+        except InviteHashInvalidError:
+            status = INVITE_INVALID
+        except Exception as e:
+            error_msg = str(e).lower()
+            if 'expired' in error_msg:
+                status = INVITE_EXPIRED
+            elif 'invalid' in error_msg or 'not valid' in error_msg:
+                status = INVITE_INVALID
+            else:
+                raise
+        else:
+            if isinstance(invite, ChatInviteAlready):
+                status, chat = INVITE_MEMBER, invite.chat
+                self.account.dialogs.add(chat)
+            else:
+                status = INVITE_JOINABLE
+        
+        ttl = self.invite_negative_ttl if status in (INVITE_EXPIRED, INVITE_INVALID) else self.invite_cache_ttl
+        await self.adb.set_invite_cache(invite_hash, self.account.name, status, entity_id(chat),
+                                        getattr(chat, 'access_hash', None), ttl)
+        return (status, chat)
+    
+    async def remember_invite(self, invite_link: str, chat):
+        """ثبت عضویت در کانال لینک invite در کش (بعد از join موفق)"""
+        self.account.dialogs.add(chat)
+        await self.adb.set_invite_cache(self.extract_invite_hash(invite_link), self.account.name, INVITE_MEMBER,
+                                        entity_id(chat), getattr(chat, 'access_hash', None), self.invite_cache_ttl)
+    
+    async def forget_membership(self, telegram_id: int):
+        """حذف کانال از نمایه گفتگوها و کش invite حساب فعلی (بعد از خروج یا peer نامعتبر)"""
+        if not telegram_id:
+            return
+        self.account.dialogs.remove(telegram_id)
+        await self.adb.forget_invite_chat(telegram_id, self.account.name)
+    
+    def note_failure(self, error):
+        """ثبت دلیل شکست join یا دریافت آمار در task فعلی (exception یا دسته خطا)"""
+        if isinstance(error, str):
+            _last_failure.set((error, error, None))
+        else:
+            _last_failure.set((classify_error(error), str(error), getattr(error, 'seconds', None)))
+    
+    async def record_failure(self, channel_id: int, operation: str, display_name: str):
+        """ثبت شکست کانال با دلیل ثبت شده در task فعلی و زمان تلاش بعدی (backoff نمایی)"""
+        failure, error, wait = _last_failure.get() or (FAILURE_TRANSIENT, None, None)
+        attempts = await self.adb.get_channel_failure_attempts(channel_id) + 1
+        now = time.time()
+        next_retry_at = self.failure_backoff.next_retry_at(failure, attempts, now, wait)
+        quarantined = self.failure_backoff.is_quarantined(failure, attempts)
+        if not await self.adb.record_channel_failure(channel_id, operation, failure, error,
+                                                     attempts, next_retry_at, quarantined, now):
+            return
+        retry_in = max(0, next_retry_at - int(now))
+        if quarantined:
+            print(f"🚫 کانال {display_name} قرنطینه شد ({failure}، {attempts} تلاش) - "
+                  f"تلاش بعدی {retry_in // 3600} ساعت دیگر")
+        else:
+            print(f"⏳ تلاش بعدی برای کانال {display_name} ({failure}، تلاش {attempts}) "
+                  f"{retry_in // 60} دقیقه دیگر")
+    
     async def ensure_connected(self):
-        """اطمینان از اتصال کلاینت - اگر قطع شده باشد، دوباره متصل می‌شود"""
+        """اطمینان از اتصال کلاینت حساب فعلی - اگر قطع شده باشد، دوباره متصل می‌شود"""
         try:
             if not self.client:
                 print("⚠️ کلاینت وجود ندارد، در حال تنظیم...")
-                await self.setup_client()
+                await self.setup_account_client()
                 return
             
             # بررسی اتصال
@@ -177,7 +367,7 @@ class ChannelMonitor:
                     except Exception as e:
                         print(f"⚠️ خطا در تست اتصال: {e}")
                         # اگر تست ناموفق بود، دوباره setup کنیم
-                        await self.setup_client()
+                        await self.setup_account_client()
         except Exception as e:
             print(f"❌ خطا در اتصال مجدد کلاینت: {e}")
             import traceback
@@ -185,12 +375,38 @@ class ChannelMonitor:
             # تلاش برای تنظیم مجدد کلاینت
             try:
                 print("🔄 تلاش برای تنظیم مجدد کلاینت...")
-                await self.setup_client()
+                await self.setup_account_client()
             except Exception as e2:
                 print(f"❌ خطا در تنظیم مجدد کلاینت: {e2}")
                 import traceback
                 traceback.print_exc()
     
+    async def rpc(self, request):
+        """ارسال یک درخواست TL از طریق محدودکننده نرخ (bucket بر اساس نوع درخواست)"""
+        return await self.limiter.call(self.client, request)
+    
+    async def get_entity(self, target):
+        """client.get_entity از طریق محدودکننده نرخ (username با bucket جداگانه ResolveUsername)"""
+        kind = 'ResolveUsername' if isinstance(target, str) else 'GetEntity'
+        return await self.limiter.run(kind, self.client.get_entity, target)
+    
+    async def find_dialog_entity(self, telegram_id: int = None, username: str = None):
+        """جستجوی کانال در نمایه گفتگوهای حساب فعلی (None اگر عضو آن نیستیم)
+        
+        نمایه فقط وقتی ساخته یا دوباره ساخته می‌شود که کهنه باشد؛ پس جستجوهای پشت سر هم
+        (مثلاً خروج از چند کانال) لیست گفتگوها را دوباره دریافت نمی‌کنند.
+        """
+        dialogs = self.account.dialogs
+        entity = dialogs.get(telegram_id, username)
+        if entity is None and dialogs.is_stale:
+            try:
+                await dialogs.build(self.client, self.limiter)
+            except Exception as e:
+                print(f"⚠️ خطا در ساخت نمایه گفتگوها: {e}")
+                return None
+            entity = dialogs.get(telegram_id, username)
+        return entity
+    
     async def join_channel(self, username_or_link: str) -> tuple:
         """عضویت در کانال و برگرداندن (success, entity, telegram_id)"""
         try:
@@ -204,78 +420,70 @@ class ChannelMonitor:
             if username_or_link.startswith('http') or username_or_link.startswith('t.me/+') or username_or_link.startswith('+'):
                 # این یک invite link است
                 try:
-                    # استخراج hash از لینک با استفاده از تابع کمکی
-                    hash_part = self.extract_invite_hash(username_or_link)
-                    print(f"🔍 Hash استخراج شده از لینک: {hash_part}")
-                    
-                    # چک کردن invite
-                    from telethon.tl.types import ChatInvite, ChatInviteAlready
-                    from telethon.errors import InviteHashExpiredError, InviteHashInvalidError
-                    
-                    try:
-                        invite = await self.client(CheckChatInviteRequest(hash_part))
-                    except InviteHashExpiredError as e:
-                        print(f"⚠️ لینک invite منقضی شده است: {username_or_link}")
-                        print(f"   خطا: {e}")
-                        return (False, None, None)
-                    except InviteHashInvalidError as e:
-                        print(f"⚠️ لینک invite نامعتبر است: {username_or_link}")
-                        print(f"   خطا: {e}")
-                        return (False, None, None)
-                    except Exception as e:
-                        error_msg = str(e).lower()
-                        if 'expired' in error_msg:
-                            print(f"⚠️ لینک invite منقضی شده است: {username_or_link}")
-                        elif 'invalid' in error_msg or 'not valid' in error_msg:
-                            print(f"⚠️ لینک invite نامعتبر است: {username_or_link}")
-                        else:
-                            print(f"❌ خطا در چک کردن invite: {e}")
-                            import traceback
-                            traceback.print_exc()
+                    # چک کردن invite (نتیجه از کش invite_cache اگر معتبر باشد)
+                    status, entity = await self.check_invite(username_or_link)
+                    if status in (INVITE_EXPIRED, INVITE_INVALID):
+                        print(f"⚠️ لینک invite {'منقضی شده' if status == INVITE_EXPIRED else 'نامعتبر'} است: {username_or_link}")
+                        self.note_failure(FAILURE_EXPIRED if status == INVITE_EXPIRED else FAILURE_INVALID)
                         return (False, None, None)
                     
                     # اگر نیاز به join دارد
-                    if isinstance(invite, ChatInvite):
+                    if status == INVITE_JOINABLE:
                         print(f"📥 در حال پیوستن به کانال با invite link...")
                         try:
-                            # پیوستن به کانال
-                            await self.client(ImportChatInviteRequest(hash_part))
-                            # بعد از join، دوباره چک می‌کنیم
-                            invite = await self.client(CheckChatInviteRequest(hash_part))
+                            # پیوستن به کانال؛ پاسخ خودش entity کانال را دارد
+                            updates = await self.rpc(ImportChatInviteRequest(self.extract_invite_hash(username_or_link)))
+                            entity = next(iter(getattr(updates, 'chats', None) or []), None)
+                        except RateLimitedError:
+                            raise
                         except Exception as e:
-                            print(f"❌ خطا در پیوستن به کانال: {e}")
-                            import traceback
-                            traceback.print_exc()
+                            if 'already' not in str(e).lower():
+                                print(f"❌ خطا در پیوستن به کانال: {e}")
+                                import traceback
+                                traceback.print_exc()
+                                self.note_failure(e)
+                                return (False, None, None)
+                            # کش قدیمی بود و از قبل عضو هستیم
+                            status, entity = await self.check_invite(username_or_link, use_cache=False)
+                            if status != INVITE_MEMBER:
+                                self.note_failure(status if status in (INVITE_EXPIRED, INVITE_INVALID) else FAILURE_TRANSIENT)
+                                return (False, None, None)
+                        if entity is None:
+                            print(f"⚠️ نتوانستیم به کانال با لینک {username_or_link} بپیوندیم")
+                            self.note_failure(FAILURE_TRANSIENT)
                             return (False, None, None)
-                    
-                    # دریافت entity
-                    if isinstance(invite, ChatInviteAlready):
-                        entity = invite.chat
-                        telegram_id = entity.id if hasattr(entity, 'id') else None
-                        print(f"✅ با موفقیت به کانال پیوستیم (از قبل عضو بودیم)")
-                    elif isinstance(invite, ChatInvite):
-                        # اگر هنوز ChatInvite است، یعنی join موفق نبود
-                        print(f"⚠️ نتوانستیم به کانال با لینک {username_or_link} بپیوندیم")
-                        return (False, None, None)
+                        await self.remember_invite(username_or_link, entity)
+                        print(f"✅ با موفقیت به کانال پیوستیم")
                     else:
-                        print(f"⚠️ نوع invite نامعتبر: {type(invite)}")
-                        return (False, None, None)
+                        print(f"✅ با موفقیت به کانال پیوستیم (از قبل عضو بودیم)")
+                    telegram_id = entity_id(entity)
+                except RateLimitedError:
+                    raise
                 except Exception as e:
                     error_msg = str(e).lower()
                     print(f"❌ خطا در پیوستن به کانال با لینک {username_or_link}: {e}")
                     import traceback
                     traceback.print_exc()
+                    self.note_failure(e)
                     return (False, None, None)
             else:
                 # این یک username است
                 username = username_or_link.lstrip('@')
+                # اگر از قبل عضو هستیم (در نمایه گفتگوها) resolve و join لازم نیست
+                entity = await self.find_dialog_entity(username=username)
+                if entity:
+                    print(f"✅ از قبل عضو کانال @{username} هستیم")
+                    return (True, entity, entity_id(entity))
                 try:
-                    entity = await self.client.get_entity(username)
+                    entity = await self.get_entity(username)
                     telegram_id = entity.id if hasattr(entity, 'id') else None
                     
                     # پیوستن به کانال (اگر عضو نیستیم)
                     try:
-                        await self.client(JoinChannelRequest(entity))
+                        await self.rpc(JoinChannelRequest(entity))
+                    except RateLimitedError:
+                        # join انجام نشده است؛ در دور بعد دوباره تلاش می‌شود
+                        raise
                     except Exception as e:
                         # ممکن است قبلاً عضو باشیم یا خطای دیگری داشته باشیم
                         error_msg = str(e).lower()
@@ -284,36 +492,88 @@ class ChannelMonitor:
                             pass
                         else:
                             print(f"⚠️ خطا در پیوستن به کانال @{username}: {e}")
+                except RateLimitedError:
+                    raise
                 except Exception as e:
                     print(f"❌ خطا در دریافت کانال @{username}: {e}")
+                    self.note_failure(e)
                     return (False, None, None)
             
             if entity:
+                self.account.dialogs.add(entity)
                 return (True, entity, telegram_id)
             else:
                 return (False, None, None)
+        except RateLimitedError:
+            # محدودیت تلگرام؛ کانال نامعتبر نیست و فراخواننده join را به بعد موکول می‌کند
+            raise
         except Exception as e:
             print(f"❌ خطا در join_channel: {e}")
             import traceback
             traceback.print_exc()
+            self.note_failure(e)
             return (False, None, None)
     
-    async def get_channel_stats(self, username_or_link: str, channel_id: int = None) -> dict:
-        """دریافت آمار کانال (پشتیبانی از username و invite link)"""
+    def build_channel_stats(self, full_info, fallback_username: str) -> dict:
+        """ساخت dict آمار از نتیجه GetFullChannelRequest (شامل access_hash برای دور بعد)"""
+        chat_id = full_info.full_chat.id
+        chat = next((c for c in full_info.chats if c.id == chat_id), None)
+        return self.build_chat_stats(chat, chat_id, full_info.full_chat.participants_count, fallback_username)
+    
+    def build_chat_stats(self, chat, chat_id: int, member_count: int, fallback_username: str) -> dict:
+        """ساخت dict آمار از شیء Channel و تعداد اعضا"""
+        # دریافت username واقعی (اگر موجود باشد)؛ برای کانال‌های پرایوت از ID استفاده می‌کنیم
+        channel_username = getattr(chat, 'username', None) or f"private_{chat_id}"
+        
+        return {
+            'title': getattr(chat, 'title', None),
+            'member_count': member_count or 0,
+            # با fetch_posts پر می‌شوند؛ None یعنی مقدار نمونه قبلی تکرار شود
+            'views_count': None,
+            'posts_count': None,
+            'username': channel_username or fallback_username,
+            'telegram_id': chat_id,
+            'access_hash': getattr(chat, 'access_hash', None)
+        }
+    
+    async def get_channel_stats(self, username_or_link: str, channel_id: int = None,
+                                channel: dict = None) -> dict:
+        """دریافت آمار کانال (پشتیبانی از username و invite link)
+        
+        اگر telegram_id و access_hash کانال در دیتابیس باشد، InputPeerChannel مستقیماً
+        ساخته می‌شود و فقط یک RPC (GetFullChannelRequest) لازم است؛ resolve دوباره
+        فقط وقتی انجام می‌شود که تلگرام peer را نامعتبر اعلام کند.
+        """
         try:
             # اطمینان از اتصال قبل از استفاده
             await self.ensure_connected()
             
             entity = None
             
-            # اگر channel_id داریم، ابتدا سعی می‌کنیم از telegram_id استفاده کنیم
-            if channel_id:
-                channel_info = self.db.get_channel_by_id(channel_id)
-                if channel_info and channel_info.get('telegram_id'):
-                    try:
-                        entity = await self.client.get_entity(channel_info['telegram_id'])
-                    except:
-                        pass  # اگر خطا داد، از username استفاده می‌کنیم
+            if channel is None and channel_id:
+                channel = await self.adb.get_channel_by_id(channel_id)
+            
+            # مسیر سریع: peer ذخیره شده در دیتابیس
+            if channel and channel.get('telegram_id') and channel.get('access_hash') is not None:
+                peer = InputPeerChannel(channel['telegram_id'], channel['access_hash'])
+                try:
+                    full_info = await self.rpc(GetFullChannelRequest(peer))
+                    return self.build_channel_stats(full_info, username_or_link)
+                except (ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError) as e:
+                    print(f"⚠️ peer ذخیره شده کانال {username_or_link} نامعتبر است، resolve دوباره: {e}")
+                    await self.adb.clear_channel_access_hash(channel['id'])
+                    await self.forget_membership(channel['telegram_id'])
+            
+            # نمایه گفتگوها entity با access_hash معتبر را بدون resolve دارد
+            entity = await self.find_dialog_entity(channel.get('telegram_id') if channel else None,
+                                                   username_or_link)
+            
+            # اگر telegram_id داریم، سعی می‌کنیم از آن استفاده کنیم (کش session)
+            if not entity and channel and channel.get('telegram_id'):
+                try:
+                    entity = await self.get_entity(channel['telegram_id'])
+                except:
+                    pass  # اگر خطا داد، از username استفاده می‌کنیم
             
             # اگر entity پیدا نشد، از username_or_link استفاده می‌کنیم
             if not entity:
@@ -321,56 +581,37 @@ class ChannelMonitor:
                 if username_or_link.startswith('http') or username_or_link.startswith('t.me/+') or username_or_link.startswith('+'):
                     # این یک invite link است
                     try:
-                        # استخراج hash از لینک با استفاده از تابع کمکی
-                        hash_part = self.extract_invite_hash(username_or_link)
-                        print(f"🔍 Hash استخراج شده از لینک: {hash_part}")
-                        
-                        # چک کردن invite
-                        from telethon.tl.types import ChatInviteAlready
-                        from telethon.errors import InviteHashExpiredError, InviteHashInvalidError
-                        
-                        try:
-                            invite = await self.client(CheckChatInviteRequest(hash_part))
-                        except InviteHashExpiredError as e:
+                        # چک کردن invite (نتیجه از کش invite_cache اگر معتبر باشد)
+                        status, entity = await self.check_invite(username_or_link)
+                        if status == INVITE_EXPIRED:
                             print(f"⚠️ لینک invite منقضی شده است: {username_or_link}")
-                            print(f"   خطا: {e}")
+                            self.note_failure(FAILURE_EXPIRED)
                             return None
-                        except InviteHashInvalidError as e:
-                            print(f"⚠️ لینک invite نامعتبر است: {username_or_link}")
-                            print(f"   خطا: {e}")
-                            return None
-                        except Exception as e:
-                            error_msg = str(e).lower()
-                            if 'expired' in error_msg:
-                                print(f"⚠️ لینک invite منقضی شده است: {username_or_link}")
-                            elif 'invalid' in error_msg or 'not valid' in error_msg:
-                                print(f"⚠️ لینک invite نامعتبر است: {username_or_link}")
-                            else:
-                                print(f"❌ خطا در چک کردن invite: {e}")
-                                import traceback
-                                traceback.print_exc()
-                            return None
-                        
-                        # دریافت entity
-                        if isinstance(invite, ChatInviteAlready):
-                            entity = invite.chat
-                        else:
+                        if status != INVITE_MEMBER:
                             print(f"⚠️ لینک invite نامعتبر است: {username_or_link}")
+                            # joinable یعنی دیگر عضو نیستیم و join دوباره لازم است
+                            self.note_failure(FAILURE_INVALID if status == INVITE_INVALID else FAILURE_TRANSIENT)
                             return None
+                    except RateLimitedError:
+                        raise
                     except Exception as e:
                         error_msg = str(e).lower()
                         if 'expired' in error_msg or 'not valid' in error_msg:
                             print(f"⚠️ لینک invite منقضی شده یا نامعتبر است: {username_or_link}")
                         else:
                             print(f"❌ خطا در دریافت کانال با لینک {username_or_link}: {e}")
+                        self.note_failure(e)
                         return None
                 else:
                     # این یک username است
                     username = username_or_link.lstrip('@')
                     try:
-                        entity = await self.client.get_entity(username)
+                        entity = await self.get_entity(username)
+                    except RateLimitedError:
+                        raise
                     except Exception as e:
                         print(f"❌ خطا در دریافت کانال @{username}: {e}")
+                        self.note_failure(e)
                         return None
             
             if not entity:
@@ -378,147 +619,563 @@ class ChannelMonitor:
             
             # بررسی اینکه entity یک کانال است یا نه (نه ربات یا کاربر)
             from telethon.tl.types import Channel, ChannelForbidden, Chat, ChatForbidden
-            is_channel = isinstance(entity, (Channel, ChannelForbidden, Chat, ChatForbidden))
+            # InputPeerChannel از کش invite_cache می‌آید و همیشه کانال است
+            is_channel = isinstance(entity, (Channel, ChannelForbidden, Chat, ChatForbidden, InputPeerChannel))
             
             if not is_channel:
                 # این یک ربات یا کاربر است، نه کانال
                 print(f"⚠️ {username_or_link} یک کانال نیست (احتمالاً ربات یا کاربر است)")
+                self.note_failure(FAILURE_INVALID)
                 return None
             
             # دریافت اطلاعات کامل کانال
-            full_info = await self.client(GetFullChannelRequest(entity))
-            
-            # دریافت username واقعی (اگر موجود باشد)
-            channel_username = ''
-            if hasattr(entity, 'username') and entity.username:
-                channel_username = entity.username
-            elif hasattr(entity, 'id'):
-                # برای کانال‌های پرایوت، از ID استفاده می‌کنیم
-                channel_username = f"private_{entity.id}"
-            
-            stats = {
-                'title': entity.title,
-                'member_count': full_info.full_chat.participants_count or 0,
-                'views_count': 0,  # این اطلاعات در API موجود نیست
-                'posts_count': 0,  # نیاز به محاسبه جداگانه دارد
-                'username': channel_username or username_or_link,
-                'telegram_id': entity.id if hasattr(entity, 'id') else None
-            }
-            
-            return stats
+            full_info = await self.rpc(GetFullChannelRequest(entity))
+            return self.build_channel_stats(full_info, username_or_link)
         except UsernameNotOccupiedError:
             print(f"❌ کانال {username_or_link} یافت نشد!")
+            self.note_failure(FAILURE_INVALID)
             return None
+        except RateLimitedError:
+            # محدودیت تلگرام؛ کانال نامعتبر نیست و در دور بعد دوباره بررسی می‌شود
+            raise
         except Exception as e:
             print(f"❌ خطا در دریافت آمار کانال {username_or_link}: {e}")
             import traceback
             traceback.print_exc()
+            self.note_failure(e)
             return None
     
-    async def monitor_channels(self, triggered_by_user_id=None):
-        """رصد کانال‌ها و ثبت آمار"""
-        # ابتدا سعی می‌کنیم به کانال‌هایی که عضو نیستیم بپیوندیم
-        all_channels = self.db.get_all_active_channels()
-        channels_to_join = [ch for ch in all_channels if not ch.get('is_member', 0)]
+    async def assign_accounts(self) -> list:
+        """انتساب کانال‌های بدون حساب (یا با حساب حذف شده) به حساب‌ها - برمی‌گرداند کانال‌های فعال"""
+        all_channels = await self.adb.get_all_active_channels()
+        plan = plan_assignments(all_channels, list(self.accounts.values()))
+        if plan:
+            # کانالی که از حساب دیگری منتقل شده باید با حساب جدید دوباره join شود
+            await self.adb.assign_channel_accounts([
+                (channel['id'], account, channel.get('account') is not None) for channel, account in plan
+            ])
+            for channel, account in plan:
+                if channel.get('account') is not None:
+                    channel['is_member'] = 0
+                channel['account'] = account
+            unassigned = sum(1 for _, account in plan if account is None)
+            if unassigned:
+                print(f"⚠️ {unassigned} کانال حساب ندارند: همه حساب‌ها به max_channels رسیده‌اند")
+        return all_channels
+    
+    async def join_channels(self, channels: list):
+        """پیوستن به کانال‌ها با حساب هر کانال (حساب‌ها همزمان، joinهای هر حساب پشت سر هم)"""
+        by_account = {}
+        for channel in channels:
+            if channel.get('account') is None:
+                continue
+            by_account.setdefault(channel['account'], []).append(channel)
+        
+        async def join_account_channels(account_name, account_channels):
+            with self.using_account(account_name):
+                for channel in account_channels:
+                    channel_identifier = channel.get('invite_link') or channel['username']
+                    print(f"🔄 در حال پیوستن به کانال: {channel_identifier} (حساب {account_name})")
+                    # فاصله بین joinها را bucket درخواست JoinChannel/ImportChatInvite حساب تعیین می‌کند
+                    try:
+                        await self.process_join_channel(channel['id'], channel_identifier)
+                    except RateLimitedError as e:
+                        # joinهای بعدی این حساب هم محدود هستند؛ شکست ثبت نمی‌شود و در دور بعد تکرار می‌شوند
+                        print(f"⏭️ پیوستن حساب {account_name} به کانال‌ها به دلیل FloodWait متوقف شد: {e}")
+                        break
+        
+        await asyncio.gather(*(join_account_channels(name, chs) for name, chs in by_account.items()))
+    
+    async def sync_channels(self) -> list:
+        """پیوستن به کانال‌های جدید و همگام کردن زمان‌بندی با کانال‌هایی که عضو هستیم
+        
+        فقط کانال‌های حساب‌هایی که lease آن‌ها در اختیار این worker است پردازش می‌شوند.
+        """
+        # ابتدا هماهنگ‌کننده کانال‌های جدید را به حساب‌ها می‌دهد و به کانال‌هایی که عضو نیستیم می‌پیوندیم
+        if self.leases.is_coordinator:
+            all_channels = await self.assign_accounts()
+        else:
+            all_channels = await self.adb.get_all_active_channels()
+        channels_to_join = [ch for ch in all_channels
+                            if not ch.get('is_member', 0) and ch.get('account') and self.owns(ch['account'])]
+        
+        # کانال‌هایی که join یا آمارشان شکست خورده تا زمان تلاش بعدی (backoff نمایی) رد می‌شوند
+        now = time.time()
+        waiting = [ch for ch in channels_to_join if ch.get('retry_at') and ch['retry_at'] > now]
+        if waiting:
+            quarantined = sum(1 for ch in waiting if ch.get('quarantined'))
+            print(f"⏳ {len(waiting)} کانال تا زمان تلاش بعدی رد شدند ({quarantined} قرنطینه)")
+            channels_to_join = [ch for ch in channels_to_join if ch not in waiting]
         
         if channels_to_join:
             print(f"\n➕ تلاش برای پیوستن به {len(channels_to_join)} کانال...")
-            for channel in channels_to_join:
-                channel_id = channel['id']
-                username = channel['username']
-                invite_link = channel.get('invite_link')
-                channel_identifier = invite_link if invite_link else username
-                print(f"🔄 در حال پیوستن به کانال: {channel_identifier}")
-                await self.process_join_channel(channel_id, channel_identifier)
-                await asyncio.sleep(1)  # تاخیر کوتاه بین join ها
-        
-        # حالا فقط کانال‌هایی که عضو هستیم را بررسی می‌کنیم
-        channels = self.db.get_active_channels()
+            await self.join_channels(channels_to_join)
+        
+        # فقط کانال‌هایی که عضو هستیم بررسی می‌شوند
+        channels = [ch for ch in await self.adb.get_active_channels() if self.owns(ch.get('account'))]
+        if not self.scheduler.entries:
+            # نرخ تغییر اولیه هر کانال از تاریخچه channel_stats
+            since = int(time.time()) - self.scheduler.history_window
+            self.scheduler.load_activity(await self.adb.get_channel_activity(since))
+        self.scheduler.sync(channels)
+        return channels
+    
+    async def start_cycles(self, channels: list) -> tuple:
+        """ادامه دور بررسی نیمه‌کاره هر حساب (بعد از ری‌استارت) یا شروع دور جدید
+        
+        Returns:
+            (کانال‌هایی که در این دور باقی مانده‌اند به ترتیب شناسه، {حساب: CycleCheckpoint})
+        """
+        by_account = {}
+        for channel in channels:
+            by_account.setdefault(channel.get('account') or self.default_account.name, []).append(channel)
+        now = int(time.time())
+        since = now - self.cycle_resume_window
+        # کانالی که کمتر از min_check_interval ثانیه قبل بررسی شده در دور جدید هم رد می‌شود
+        # تا ری‌استارت‌های پشت سر هم همه کانال‌ها را دوباره از تلگرام نخواهند
+        recently_sampled = await self.adb.get_channels_sampled_since(now - int(self.scheduler.min_interval))
+        remaining = []
+        cycles = {}
+        for account_name, account_channels in by_account.items():
+            cycle = await self.adb.get_open_monitor_cycle(account_name, since)
+            if cycle:
+                # کانال‌های قبل از cursor و کانال‌هایی که بعد از شروع دور آمارشان ثبت شده رد می‌شوند
+                sampled = await self.adb.get_channels_sampled_since(cycle['started_at'])
+                pending = [ch for ch in account_channels if ch['id'] > cycle['cursor'] and ch['id'] not in sampled]
+                print(f"⏯️ ادامه دور بررسی {cycle['id']} حساب {account_name}: "
+                      f"{len(account_channels) - len(pending)} کانال قبلاً بررسی شده، {len(pending)} کانال باقی‌مانده")
+                account_channels = pending
+            else:
+                pending = [ch for ch in account_channels if ch['id'] not in recently_sampled]
+                if len(pending) < len(account_channels):
+                    print(f"⏭️ دور بررسی جدید حساب {account_name}: {len(account_channels) - len(pending)} کانال "
+                          f"به تازگی بررسی شده رد شدند، {len(pending)} کانال باقی‌مانده")
+                account_channels = pending
+                cycle = await self.adb.start_monitor_cycle(account_name, self.leases.worker_id, len(account_channels))
+            if cycle:
+                cycles[account_name] = CycleCheckpoint(cycle, [ch['id'] for ch in account_channels])
+            remaining.extend(account_channels)
+        remaining.sort(key=lambda ch: ch['id'])
+        return remaining, cycles
+    
+    async def checkpoint_cycles(self, cycles: dict, finished: bool = False):
+        """ذخیره پیشرفت دورهای بررسی (فقط دورهایی که از ذخیره قبلی تغییر کرده‌اند)"""
+        if not cycles:
+            return
+        changed = [cycle for cycle in cycles.values() if cycle.dirty or finished]
+        await self.adb.checkpoint_monitor_cycles(
+            [(cycle.id, self.leases.worker_id, cycle.done, cycle.cursor) for cycle in changed], finished)
+        for cycle in changed:
+            cycle.dirty = False
+    
+    async def monitor_channels(self, triggered_by_user_id=None, account: str = None):
+        """بررسی همه کانال‌ها (اولین اجرا و بررسی فوری) و ثبت آمار
+        
+        پیشرفت دور در جدول monitor_cycles ذخیره می‌شود؛ اگر ربات وسط دور ری‌استارت شود،
+        دور از همان‌جا ادامه پیدا می‌کند (cycles.py).
+        
+        Args:
+            account: اگر داده شود فقط کانال‌های این حساب بررسی می‌شوند
+        """
+        channels = await self.sync_channels()
+        if account:
+            channels = [ch for ch in channels if (ch.get('account') or self.default_account.name) == account]
         start_time = datetime.now()
         
         if not channels:
             print("⚠️ هیچ کانال فعالی یافت نشد (یا هنوز عضو نشده‌ایم)!")
-            # ایجاد فایل notification برای اطلاع‌رسانی
-            self.create_notification(triggered_by_user_id, start_time, 0, False)
+            await self.notify_check_finished(triggered_by_user_id, start_time, 0, False)
             return
         
+        channels, cycles = await self.start_cycles(channels)
         print(f"\n📊 بررسی {len(channels)} کانال...")
         
-        successful_checks = 0
+        successful_checks = await self.collect_stats(channels, cycles)
+        await self.checkpoint_cycles(cycles, finished=True)
+        
+        # بررسی کانال‌های غیرفعال برای خروج
+        await self.leave_inactive_channels()
+        
+        # اطلاع‌رسانی به کاربری که بررسی فوری را درخواست کرده بود
+        await self.notify_check_finished(triggered_by_user_id, start_time, successful_checks, True)
+    
+    async def check_due_channels(self) -> int:
+        """بررسی کانال‌هایی که زمان آن‌ها در صف زمان‌بندی رسیده - برمی‌گرداند تعداد کانال‌های برداشته شده"""
+        due = self.scheduler.pop_due(limit=self.schedule_batch_size)
+        if due:
+            print(f"\n📊 بررسی {len(due)} کانال (از {len(self.scheduler)} کانال زمان‌بندی شده)")
+            await self.collect_stats(due)
+        return len(due)
+    
+    async def fetch_channel_stats(self, channel: dict) -> dict:
+        """دریافت آمار یک کانال (نرخ درخواست‌ها و FloodWait با self.limiter مدیریت می‌شود)"""
+        invite_link = channel.get('invite_link')
+        # استفاده از invite_link اگر موجود باشد، در غیر این صورت username
+        channel_identifier = invite_link if invite_link else channel['username']
+        return await self.get_channel_stats(channel_identifier, channel['id'], channel)
+    
+    async def collect_stats(self, channels: list, cycles: dict = None) -> int:
+        """جمع‌آوری همزمان آمار کانال‌ها - برمی‌گرداند تعداد آمار ثبت شده
+        
+        کانال‌ها بر اساس حساب گروه‌بندی می‌شوند و هر حساب با کلاینت و محدودکننده نرخ
+        خودش همزمان با بقیه کار می‌کند؛ نتایج همه حساب‌ها به یک نویسنده واحد دیتابیس
+        می‌رسد که آمار را به صورت دسته‌ای (هر stats_flush_size نمونه یک تراکنش) ثبت می‌کند.
+        
+        Args:
+            cycles: {حساب: CycleCheckpoint} دور بررسی کامل که پیشرفتش بعد از هر ثبت ذخیره می‌شود
+        """
+        results = asyncio.Queue()
+        writer = asyncio.create_task(self.write_stats(results, cycles))
+        
+        by_account = {}
         for channel in channels:
-            username = channel['username']
-            channel_id = channel['id']
-            invite_link = channel.get('invite_link')  # ممکن است None باشد
-            
-            # استفاده از invite_link اگر موجود باشد، در غیر این صورت username
-            channel_identifier = invite_link if invite_link else username
+            by_account.setdefault(channel.get('account'), []).append(channel)
+        try:
+            await asyncio.gather(*(
+                self.collect_account_stats(account_name, account_channels, results)
+                for account_name, account_channels in by_account.items()
+            ))
+        finally:
+            await results.put(None)
+        return await writer
+    
+    async def collect_account_stats(self, account_name: str, channels: list, results: asyncio.Queue):
+        """جمع‌آوری آمار کانال‌های یک حساب
+        
+        collection_concurrency worker درخواست‌ها را همزمان ارسال می‌کنند (نرخ کل با
+        bucket همان نوع درخواست در محدودکننده نرخ حساب محدود است).
+        """
+        with self.using_account(account_name):
+            try:
+                await self._collect_account_stats(channels, results)
+            except Exception as e:
+                print(f"❌ خطا در جمع‌آوری آمار حساب {self.account.name}: {e}")
+                import traceback
+                traceback.print_exc()
+    
+    async def _collect_account_stats(self, channels: list, results: asyncio.Queue):
+        # اتصال یک‌بار قبل از شروع workerها بررسی می‌شود تا اتصال مجدد همزمان رخ ندهد
+        await self.ensure_connected()
+        
+        # collection_strategy: full (یک GetFullChannel برای هر کانال) یا batched (GetChannels دسته‌ای)
+        # هر مورد صف (channel, stats) است؛ stats خالی یعنی آمار کانال باید تک‌تک دریافت شود
+        pending_channels = asyncio.Queue()
+        if self.config.get('collection_strategy', 'full') == 'batched':
+            try:
+                channels = await self.collect_stats_batched(channels, pending_channels)
+            except Exception as e:
+                print(f"⚠️ خطا در جمع‌آوری دسته‌ای آمار، ادامه با GetFullChannel: {e}")
+        
+        concurrency = max(1, int(self.config.get('collection_concurrency', 4)))
+        for channel in channels:
+            pending_channels.put_nowait((channel, None))
+        
+        async def worker():
+            while True:
+                try:
+                    channel, stats = pending_channels.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                _last_failure.set(None)
+                try:
+                    if stats is None:
+                        stats = await self.fetch_channel_stats(channel)
+                except RateLimitedError:
+                    # کانال نامعتبر نیست؛ در این دور رد می‌شود و وضعیت عضویت تغییر نمی‌کند
+                    print(f"⏭️ آمار کانال {channel.get('username')} به دلیل FloodWait در این دور ثبت نشد")
+                    continue
+                except Exception as e:
+                    print(f"❌ خطا در دریافت آمار کانال {channel.get('username')}: {e}")
+                    self.note_failure(e)
+                    stats = None
+                if not stats:
+                    # join دوباره کانال تا زمان تلاش بعدی انجام نمی‌شود
+                    await self.record_failure(channel['id'], 'stats',
+                                              channel.get('invite_link') or channel.get('username'))
+                if stats and self.posts_enabled:
+                    await self.fetch_posts(channel, stats)
+                await results.put((channel, stats))
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, pending_channels.qsize()))]
+        await asyncio.gather(*workers)
+    
+    async def collect_stats_batched(self, channels: list, results: asyncio.Queue,
+                                    batch_size: int = 100) -> list:
+        """دریافت تعداد اعضا با GetChannelsRequest (حداکثر 100 کانال در هر درخواست)
+        
+        فقط کانال‌هایی که telegram_id و access_hash آن‌ها ذخیره شده دسته‌ای پرسیده می‌شوند.
+        نتایج دارای participants_count به صورت (channel, stats) به results می‌روند.
+        
+        Returns:
+            کانال‌هایی که باید با GetFullChannelRequest بررسی شوند (بدون peer ذخیره شده،
+            بدون participants_count در پاسخ، یا دسته‌ای که با خطا مواجه شد)؛ کانال‌های دسته‌هایی
+            که به دلیل FloodWait (RateLimitedError) پرسیده نشدند در این دور بررسی نمی‌شوند
+        """
+        fallback = [ch for ch in channels if not (ch.get('telegram_id') and ch.get('access_hash') is not None)]
+        batchable = [ch for ch in channels if ch.get('telegram_id') and ch.get('access_hash') is not None]
+        batched_count = 0
+        
+        for start in range(0, len(batchable), batch_size):
+            batch = batchable[start:start + batch_size]
+            try:
+                response = await self.rpc(GetChannelsRequest(
+                    [InputChannel(ch['telegram_id'], ch['access_hash']) for ch in batch]
+                ))
+            except RateLimitedError as e:
+                # GetFullChannel تک‌تک برای این کانال‌ها درخواست‌ها را چند برابر می‌کند؛
+                # دسته‌های باقی‌مانده در این دور رد می‌شوند و در نوبت بعدی زمان‌بندی بررسی می‌شوند
+                skipped = len(batchable) - start
+                print(f"⏭️ آمار {skipped} کانال به دلیل FloodWait در GetChannelsRequest در این دور ثبت نشد: {e}")
+                break
+            except Exception as e:
+                # یک peer نامعتبر کل درخواست را خراب می‌کند؛ این دسته تک‌تک بررسی می‌شود
+                print(f"⚠️ خطا در GetChannelsRequest برای {len(batch)} کانال: {e}")
+                fallback.extend(batch)
+                continue
             
-            display_name = invite_link if invite_link else f"@{username}"
-            print(f"\n🔍 بررسی کانال: {display_name}")
+            chats = {chat.id: chat for chat in response.chats}
+            for channel in batch:
+                chat = chats.get(channel['telegram_id'])
+                member_count = getattr(chat, 'participants_count', None)
+                if member_count is None:
+                    fallback.append(channel)
+                    continue
+                identifier = channel.get('invite_link') or channel['username']
+                await results.put((channel, self.build_chat_stats(chat, chat.id, member_count, identifier)))
+                batched_count += 1
+        
+        print(f"📦 آمار {batched_count} کانال به صورت دسته‌ای دریافت شد، "
+              f"{len(fallback)} کانال با GetFullChannel بررسی می‌شوند")
+        return fallback
+    
+    async def get_message_views(self, peer, message_ids: list) -> list:
+        """بازدید پیام‌ها با GetMessagesViewsRequest (VIEWS_BATCH_SIZE پیام در هر درخواست)
+        
+        Returns:
+            بازدید هر پیام به همان ترتیب (None برای پیام حذف شده)
+        """
+        views = []
+        for start in range(0, len(message_ids), VIEWS_BATCH_SIZE):
+            response = await self.rpc(GetMessagesViewsRequest(
+                peer=peer, id=message_ids[start:start + VIEWS_BATCH_SIZE], increment=False
+            ))
+            views.extend(getattr(message_views, 'views', None) for message_views in response.views)
+        return views
+    
+    def post_sample(self, message_id: int, posted_at: int, views: int, now: float) -> tuple:
+        """ردیف ثبت بازدید پست: (message_id, posted_at, views, bucket, next_refresh_at)"""
+        return (message_id, posted_at, views, self.post_policy.bucket(posted_at, now),
+                self.post_policy.next_refresh_at(posted_at, now))
+    
+    async def fetch_posts(self, channel: dict, stats: dict):
+        """دریافت افزایشی پست‌های کانال و افزودن posts_count، views_count و پست‌ها به stats
+        
+        فقط پیام‌های بعد از last_message_id کانال (حداکثر posts_fetch_limit) دریافت می‌شوند و
+        بازدید views_refresh_posts پست آخر با GetMessagesViewsRequest (حداکثر 100 پیام در هر
+        درخواست) به‌روز می‌شود؛ پس هزینه هر دور به پیام‌های جدید بستگی دارد نه به تاریخچه کانال.
+        views_count مجموع بازدید همین پست‌های آخر است. اگر دریافت ناموفق باشد stats تغییر
+        نمی‌کند و مقادیر نمونه قبلی تکرار می‌شوند.
+        """
+        if not stats.get('telegram_id') or stats.get('access_hash') is None:
+            return
+        peer = InputPeerChannel(stats['telegram_id'], stats['access_hash'])
+        last_message_id = channel.get('last_message_id') or 0
+        now = time.time()
+        try:
+            history = await self.rpc(GetHistoryRequest(
+                peer=peer, offset_id=0, offset_date=None, add_offset=0,
+                limit=self.posts_fetch_limit, max_id=0, min_id=last_message_id, hash=0
+            ))
+            # message_id -> (message_id, posted_at, views, bucket, next_refresh_at)
+            posts = {}
+            for message in history.messages:
+                last_message_id = max(last_message_id, message.id)
+                # پیام‌های سرویس (پین، تغییر عنوان و ...) بازدید ندارند
+                if getattr(message, 'views', None) is not None:
+                    posts[message.id] = self.post_sample(message.id, int(message.date.timestamp()),
+                                                         message.views, now)
             
-            stats = await self.get_channel_stats(channel_identifier, channel_id)
+            # پست‌های قبلی که هنوز جزو پست‌های آخر هستند فقط بازدیدشان به‌روز می‌شود
+            # (پیام‌های جدید همه از پست‌های قبلی جدیدترند)
+            refresh_count = self.views_refresh_posts - len(posts)
+            known = []
+            if refresh_count > 0:
+                known = [post for post in await self.adb.get_recent_posts(channel['id'], refresh_count)
+                         if post['message_id'] not in posts]
+            views = await self.get_message_views(peer, [post['message_id'] for post in known])
+            for post, post_views in zip(known, views):
+                if post_views is None:
+                    # پیام حذف شده: دنبال کردن بازدید آن متوقف می‌شود
+                    posts[post['message_id']] = (post['message_id'], post['posted_at'], post['views'], None, None)
+                else:
+                    posts[post['message_id']] = self.post_sample(post['message_id'], post['posted_at'],
+                                                                 post_views, now)
+        except RateLimitedError:
+            print(f"⏭️ پست‌های کانال {channel.get('username')} به دلیل FloodWait در این دور دریافت نشد")
+            return
+        except Exception as e:
+            print(f"⚠️ خطا در دریافت پست‌های کانال {channel.get('username')}: {e}")
+            return
+        
+        # پیام‌های حذف شده (bucket خالی) در views_count حساب نمی‌شوند
+        recent = sorted((post for post in posts.values() if post[3] is not None),
+                        reverse=True)[:self.views_refresh_posts]
+        stats['views_count'] = sum(post[2] for post in recent)
+        stats['views_posts'] = len(recent)
+        # count در پاسخ‌های برش‌خورده تعداد کل پیام‌های کانال است؛ در پاسخ کامل همه پیام‌ها آمده‌اند
+        total = getattr(history, 'count', None)
+        if total is None and not channel.get('last_message_id'):
+            total = len(history.messages)
+        stats['posts_count'] = total
+        stats['posts'] = list(posts.values())
+        stats['last_message_id'] = last_message_id
+    
+    async def refresh_post_views(self) -> int:
+        """به‌روزرسانی بازدید پست‌هایی که زمانشان رسیده - برمی‌گرداند تعداد پست‌های برداشته شده
+        
+        حداکثر post_refresh_batch پست در هر نوبت برداشته می‌شود؛ پست‌های هر کانال با حساب
+        همان کانال و GetMessagesViewsRequest دسته‌ای (100 پیام در هر درخواست) به‌روز می‌شوند.
+        پست‌هایی که به‌روز نشدند (FloodWait یا خطا) post_refresh_min_interval ثانیه عقب می‌افتند.
+        """
+        if not self.posts_enabled or not self.leases.accounts:
+            return 0
+        now = time.time()
+        due = await self.adb.get_due_posts(now, sorted(self.leases.accounts), self.default_account.name,
+                                           self.post_policy.batch_limit)
+        if not due:
+            return 0
+        
+        by_channel = {}
+        for post in due:
+            by_channel.setdefault(post['channel_id'], []).append(post)
+        by_account = {}
+        for posts in by_channel.values():
+            by_account.setdefault(posts[0]['account'] or self.default_account.name, []).append(posts)
+        
+        updates = []
+        retry_at = int(now + self.post_policy.min_interval)
+        
+        async def refresh_account(account_name, account_channels):
+            with self.using_account(account_name):
+                for posts in account_channels:
+                    peer = InputPeerChannel(posts[0]['telegram_id'], posts[0]['access_hash'])
+                    try:
+                        await self.ensure_connected()
+                        views = await self.get_message_views(peer, [post['message_id'] for post in posts])
+                    except Exception as e:
+                        if not isinstance(e, RateLimitedError):
+                            print(f"⚠️ خطا در به‌روزرسانی بازدید پست‌های کانال {posts[0]['username']}: {e}")
+                        # بدون ثبت نمونه، فقط زمان به‌روزرسانی بعدی عقب می‌افتد
+                        views = [None] * len(posts)
+                        next_refresh_at = retry_at
+                    else:
+                        # پیام حذف شده دیگر دنبال نمی‌شود
+                        next_refresh_at = None
+                    samples = []
+                    for post, post_views in zip(posts, views):
+                        if post_views is None:
+                            samples.append((post['message_id'], post['posted_at'], post['views'], None, next_refresh_at))
+                        else:
+                            samples.append(self.post_sample(post['message_id'], post['posted_at'], post_views, now))
+                    updates.append((posts[0]['channel_id'], samples))
+        
+        await asyncio.gather(*(refresh_account(name, chs) for name, chs in by_account.items()))
+        saved = await self.adb.save_post_views(updates)
+        print(f"👁️ بازدید {len(due)} پست از {len(by_channel)} کانال بررسی شد ({saved} ثبت شد)")
+        return len(due)
+    
+    async def write_stats(self, results: asyncio.Queue, cycles: dict = None) -> int:
+        """نویسنده واحد دیتابیس: ثبت نتایج workerها تا رسیدن None - برمی‌گرداند تعداد ثبت شده"""
+        # آمار در حافظه جمع می‌شود و به صورت دسته‌ای (یک تراکنش) ثبت می‌شود
+        pending_samples = []
+        pending_posts = []
+        flush_size = int(self.config.get('stats_flush_size', 100))
+        successful_checks = 0
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            channel, stats = item
+            channel_id = channel['id']
+            if cycles:
+                # پیشرفت دور همراه با ثبت دسته‌ای بعدی آمار ذخیره می‌شود
+                cycle = cycles.get(channel.get('account') or self.default_account.name)
+                if cycle:
+                    cycle.complete(channel_id)
+            invite_link = channel.get('invite_link')
+            display_name = invite_link if invite_link else f"@{channel['username']}"
             
             if stats:
-                # اطمینان از اینکه is_member = 1 است (اگر توانستیم آمار بگیریم یعنی عضو هستیم)
-                self.db.set_channel_member_status(channel_id, True)
+                # is_member در get_active_channels از قبل 1 است، پس نیازی به نوشتن دوباره نیست
+                
+                # آمار موفق وضعیت شکست (backoff و قرنطینه) کانال را پاک می‌کند
+                if channel.get('failure_attempts'):
+                    await self.adb.clear_channel_failures([channel_id])
+                    channel['failure_attempts'] = None
                 
                 # به‌روزرسانی عنوان در صورت تغییر
                 if stats['title'] and stats['title'] != channel.get('title'):
-                    conn = self.db.get_connection()
-                    cursor = conn.cursor()
-                    cursor.execute('UPDATE channels SET title = ? WHERE id = ?', 
-                                 (stats['title'], channel_id))
-                    conn.commit()
-                    conn.close()
+                    await self.adb.update_channel_title(channel_id, stats['title'])
+                    channel['title'] = stats['title']
                 
-                # به‌روزرسانی telegram_id اگر موجود باشد
-                if 'telegram_id' in stats and stats['telegram_id']:
-                    self.db.update_channel_telegram_id(channel_id, stats['telegram_id'])
+                # به‌روزرسانی telegram_id/access_hash فقط اگر تغییر کرده باشد
+                if stats.get('telegram_id') and (stats['telegram_id'] != channel.get('telegram_id')
+                                                 or stats.get('access_hash') != channel.get('access_hash')):
+                    await self.adb.update_channel_peer(channel_id, stats['telegram_id'], stats.get('access_hash'))
+                    # dict کانال در scheduler نگه داشته می‌شود و دور بعد از peer جدید استفاده می‌کند
+                    channel['telegram_id'] = stats['telegram_id']
+                    channel['access_hash'] = stats.get('access_hash')
                 
-                # ثبت آمار
-                success = self.db.add_stats(
-                    channel_id=channel_id,
-                    member_count=stats['member_count'],
-                    views_count=stats['views_count'],
-                    posts_count=stats['posts_count']
-                )
-                
-                if success:
-                    successful_checks += 1
-                    last_stats = self.db.get_last_stats(channel_id)
-                    print(f"✅ آمار ثبت شد:")
-                    print(f"   - اعضا: {stats['member_count']:,}")
-                    if last_stats and last_stats.get('member_change'):
-                        change = last_stats['member_change']
-                        sign = "+" if change > 0 else ""
-                        print(f"   - تغییر: {sign}{change:,}")
+                pending_samples.append((
+                    channel_id,
+                    stats['member_count'],
+                    stats['views_count'],
+                    stats['posts_count']
+                ))
+                if 'posts' in stats:
+                    pending_posts.append((channel_id, stats['last_message_id'], stats['posts']))
+                    channel['last_message_id'] = stats['last_message_id']
+                self.scheduler.observe(channel_id, stats['member_count'])
+                if stats['views_count'] is not None:
+                    print(f"✅ آمار {display_name} دریافت شد - اعضا: {stats['member_count']:,}، "
+                          f"بازدید {stats['views_posts']} پست آخر: {stats['views_count']:,}")
                 else:
-                    print(f"❌ خطا در ثبت آمار")
+                    print(f"✅ آمار {display_name} دریافت شد - اعضا: {stats['member_count']:,}")
+                
+                if len(pending_samples) >= flush_size:
+                    successful_checks += await self.flush_stats(pending_samples, pending_posts)
+                    await self.checkpoint_cycles(cycles)
             else:
                 # اگر نتوانستیم آمار بگیریم، ممکن است عضو نباشیم یا کانال نامعتبر باشد
                 print(f"⚠️ نتوانستیم آمار کانال {display_name} را دریافت کنیم")
                 # اگر کانال یک ربات است یا نامعتبر است، is_member را 0 می‌کنیم
                 # (اما is_active را نگه می‌داریم تا کاربر بتواند آن را ببیند)
-                self.db.set_channel_member_status(channel_id, False)
-            
-            # تاخیر کوتاه بین درخواست‌ها
-            await asyncio.sleep(2)
+                await self.adb.set_channel_member_status(channel_id, False)
+                self.scheduler.remove(channel_id)
         
-        # بررسی کانال‌های غیرفعال برای خروج
-        await self.leave_inactive_channels()
+        successful_checks += await self.flush_stats(pending_samples, pending_posts)
+        await self.checkpoint_cycles(cycles)
+        return successful_checks
+    
+    async def flush_stats(self, pending_samples: list, pending_posts: list = None) -> int:
+        """ثبت آمار (و پست‌ها و cursor پیام) جمع‌شده و خالی کردن بافرها - برمی‌گرداند تعداد ثبت شده"""
+        if pending_posts:
+            await self.adb.save_channel_posts(list(pending_posts), self.views_refresh_posts)
+            pending_posts.clear()
+        if not pending_samples:
+            return 0
         
-        # ایجاد فایل notification بعد از اتمام بررسی
-        end_time = datetime.now()
-        print(f"\n📝 در حال ایجاد notification برای user_id={triggered_by_user_id}...")
-        self.create_notification(triggered_by_user_id, start_time, successful_checks, True)
-        print(f"✅ Notification ایجاد شد برای user_id={triggered_by_user_id}, channels={successful_checks}")
+        saved = await self.adb.add_stats_bulk(pending_samples)
+        if saved:
+            print(f"💾 آمار {saved} کانال ثبت شد")
+        else:
+            print(f"❌ خطا در ثبت آمار {len(pending_samples)} کانال")
+        pending_samples.clear()
+        return saved
     
     async def leave_inactive_channels(self):
-        """خروج از کانال‌های غیرفعال"""
-        # اطمینان از اتصال قبل از استفاده
-        await self.ensure_connected()
-        
-        channels_to_leave = self.db.get_channels_to_leave()
+        """خروج از کانال‌های غیرفعال (هر کانال با حساب خودش)"""
+        channels_to_leave = await self.adb.get_channels_to_leave()
         
         if not channels_to_leave:
             return
@@ -526,138 +1183,171 @@ class ChannelMonitor:
         print(f"\n🚪 بررسی {len(channels_to_leave)} کانال غیرفعال برای خروج...")
         
         for channel in channels_to_leave:
-            telegram_id = channel.get('telegram_id')
-            username = channel['username']
-            channel_id = channel['id']
-            invite_link = channel.get('invite_link')
+            if not self.owns(channel.get('account')):
+                continue
+            with self.using_account(channel.get('account')):
+                # اطمینان از اتصال قبل از استفاده
+                await self.ensure_connected()
+                await self.leave_inactive_channel(channel)
+    
+    async def leave_inactive_channel(self, channel: dict):
+        """خروج از یک کانال غیرفعال با حساب فعلی"""
+        telegram_id = channel.get('telegram_id')
+        username = channel['username']
+        channel_id = channel['id']
+        invite_link = channel.get('invite_link')
+        
+        try:
+            # ابتدا نمایه گفتگوها، سپس telegram_id
+            entity = await self.find_dialog_entity(telegram_id, username)
             
-            try:
-                entity = None
-                
-                # تلاش برای دریافت entity
-                if telegram_id:
-                    try:
-                        entity = await self.client.get_entity(telegram_id)
-                    except:
-                        pass
-                
-                # اگر با telegram_id نشد، از username یا invite_link استفاده می‌کنیم
-                if not entity:
-                    if invite_link and (invite_link.startswith('http') or invite_link.startswith('t.me/+') or invite_link.startswith('+')):
-                        # این یک invite link است
-                        try:
-                            # استخراج hash از لینک با استفاده از تابع کمکی
-                            hash_part = self.extract_invite_hash(invite_link)
-                            print(f"🔍 Hash استخراج شده از لینک: {hash_part}")
-                            
-                            # چک کردن invite برای دریافت entity
-                            from telethon.tl.functions.messages import CheckChatInviteRequest
-                            invite = await self.client(CheckChatInviteRequest(hash_part))
-                            from telethon.tl.types import ChatInviteAlready
-                            if isinstance(invite, ChatInviteAlready):
-                                entity = invite.chat
-                        except Exception as e:
-                            print(f"⚠️ خطا در دریافت entity با invite link {invite_link}: {e}")
-                            pass
-                    elif username and not username.startswith('http') and not username.startswith('+'):
-                        try:
-                            entity = await self.client.get_entity(username)
-                        except Exception as e:
-                            print(f"⚠️ خطا در دریافت entity با username {username}: {e}")
-                            pass
-                
-                if entity:
-                    try:
-                        await self.client(LeaveChannelRequest(entity))
-                        print(f"✅ از کانال {username} (ID: {telegram_id if telegram_id else 'N/A'}) خارج شدیم")
-                        # علامت‌گذاری که از کانال خارج شدیم (is_member = 0)
-                        self.db.set_channel_member_status(channel_id, False)
-                    except Exception as leave_error:
-                        print(f"❌ خطا در خروج از کانال {username}: {leave_error}")
-                        # حتی در صورت خطا، is_member = 0 می‌کنیم (مثلاً کانال حذف شده)
-                        self.db.set_channel_member_status(channel_id, False)
-                else:
-                    print(f"⚠️ نتوانستیم entity کانال {username} را پیدا کنیم")
-                    # اگر entity پیدا نشد، باز هم is_member = 0 می‌کنیم
-                    self.db.set_channel_member_status(channel_id, False)
-            except Exception as e:
-                print(f"❌ خطا در خروج از کانال {username}: {e}")
-                # حتی در صورت خطا، is_member = 0 می‌کنیم
-                self.db.set_channel_member_status(channel_id, False)
-    
-    def check_trigger_flag(self) -> tuple:
-        """بررسی وجود فایل flag برای بررسی فوری - برمی‌گرداند (exists, user_id)"""
-        flag_path = self.trigger_flag_file
-        if os.path.exists(flag_path):
-            try:
-                # خواندن user_id از فایل flag (اگر وجود دارد)
-                user_id = None
+            # تلاش برای دریافت entity
+            if not entity and telegram_id:
                 try:
-                    with open(flag_path, 'r') as f:
-                        content = f.read().strip()
-                        if content.isdigit():
-                            user_id = int(content)
+                    entity = await self.get_entity(telegram_id)
                 except:
                     pass
-                
-                os.remove(flag_path)
-                return (True, user_id)
-            except Exception as e:
-                print(f"⚠️ خطا در حذف فایل flag: {e}")
-                return (False, None)
-        return (False, None)
-    
-    def check_join_flag(self) -> dict:
-        """بررسی وجود فایل flag برای join کردن کانال - برمی‌گرداند dict یا None"""
-        flag_path = self.join_flag_file
-        if os.path.exists(flag_path):
-            try:
-                print(f"📂 فایل join flag پیدا شد: {flag_path}")
-                with open(flag_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                print(f"📄 محتوای فایل join flag: {data}")
-                
-                # حذف فایل flag
-                os.remove(flag_path)
-                print(f"🗑️ فایل join flag حذف شد")
-                return data
-            except Exception as e:
-                print(f"⚠️ خطا در خواندن فایل join flag: {e}")
-                import traceback
-                traceback.print_exc()
-                # حذف فایل نامعتبر
+            
+            # اگر با telegram_id نشد، از username یا invite_link استفاده می‌کنیم
+            if not entity:
+                if invite_link and (invite_link.startswith('http') or invite_link.startswith('t.me/+') or invite_link.startswith('+')):
+                    # این یک invite link است
+                    try:
+                        # چک کردن invite برای دریافت entity (نتیجه از کش invite_cache اگر معتبر باشد)
+                        status, chat = await self.check_invite(invite_link)
+                        if status == INVITE_MEMBER:
+                            entity = chat
+                    except Exception as e:
+                        print(f"⚠️ خطا در دریافت entity با invite link {invite_link}: {e}")
+                        pass
+                elif username and not username.startswith('http') and not username.startswith('+'):
+                    try:
+                        entity = await self.get_entity(username)
+                    except Exception as e:
+                        print(f"⚠️ خطا در دریافت entity با username {username}: {e}")
+                        pass
+            
+            if entity:
                 try:
-                    os.remove(flag_path)
-                except:
-                    pass
-                return None
-        return None
+                    await self.rpc(LeaveChannelRequest(entity))
+                    await self.forget_membership(entity_id(entity))
+                    print(f"✅ از کانال {username} (ID: {telegram_id if telegram_id else 'N/A'}) خارج شدیم")
+                    # علامت‌گذاری که از کانال خارج شدیم (is_member = 0)
+                    await self.adb.set_channel_member_status(channel_id, False)
+                except Exception as leave_error:
+                    print(f"❌ خطا در خروج از کانال {username}: {leave_error}")
+                    # حتی در صورت خطا، is_member = 0 می‌کنیم (مثلاً کانال حذف شده)
+                    await self.adb.set_channel_member_status(channel_id, False)
+            else:
+                print(f"⚠️ نتوانستیم entity کانال {username} را پیدا کنیم")
+                # اگر entity پیدا نشد، باز هم is_member = 0 می‌کنیم
+                await self.adb.set_channel_member_status(channel_id, False)
+        except Exception as e:
+            print(f"❌ خطا در خروج از کانال {username}: {e}")
+            # حتی در صورت خطا، is_member = 0 می‌کنیم
+            await self.adb.set_channel_member_status(channel_id, False)
     
-    def check_leave_flag(self) -> dict:
-        """بررسی وجود فایل flag برای leave کردن کانال - برمی‌گرداند dict یا None"""
-        flag_path = self.leave_flag_file
-        if os.path.exists(flag_path):
+    async def process_commands(self) -> int:
+        """اجرای همه دستورات در انتظار صف commands به ترتیب FIFO - برمی‌گرداند تعداد اجرا شده"""
+        processed = 0
+        while True:
+            # هر worker فقط دستورات حساب‌های خودش را برمی‌دارد؛ دستورات بدون حساب مال هماهنگ‌کننده است
+            command = await self.adb.claim_next_command(
+                sorted(self.leases.accounts), self.leases.is_coordinator, self.leases.worker_id)
+            if not command:
+                return processed
+            processed += 1
+            success = False
             try:
-                print(f"📂 فایل leave flag پیدا شد: {flag_path}")
-                with open(flag_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                print(f"📄 محتوای فایل leave flag: {data}")
-                
-                # حذف فایل flag
-                os.remove(flag_path)
-                print(f"🗑️ فایل leave flag حذف شد")
-                return data
+                success = await self.execute_command(command['command'], command['payload'])
             except Exception as e:
-                print(f"⚠️ خطا در خواندن فایل leave flag: {e}")
+                print(f"❌ خطا در اجرای دستور {command['command']} (id={command['id']}): {e}")
                 import traceback
                 traceback.print_exc()
-                # حذف فایل نامعتبر
+            await self.adb.finish_command(command['id'], bool(success))
+    
+    async def delegate_command(self, name: str, payload: dict, account: str) -> bool:
+        """ثبت دوباره دستور برای workerی که lease حساب account را دارد"""
+        command_id = await self.adb.enqueue_command(name, dict(payload, account=account))
+        if command_id:
+            print(f"↪️ دستور {name} به worker حساب {account} سپرده شد (id={command_id})")
+        return bool(command_id)
+    
+    async def execute_command(self, name: str, payload: dict) -> bool:
+        """اجرای یک دستور صف: leave، join یا check
+        
+        دستوری که به حساب worker دیگری مربوط است با account در payload دوباره در صف
+        قرار می‌گیرد تا همان worker آن را اجرا کند.
+        """
+        if name == 'leave':
+            channel_id = payload.get('channel_id')
+            username = payload.get('username')
+            if not channel_id:
+                print(f"⚠️ دستور leave بدون channel_id: {payload}")
+                return False
+            print(f"\n🚪 درخواست خروج فوری از کانال: {username} (ID: {channel_id})")
+            channel = await self.adb.get_channel_by_id(channel_id)
+            account = channel.get('account') if channel else None
+            if not self.owns(account):
+                return await self.delegate_command(name, payload, account)
+            # خروج با حسابی که عضو کانال است
+            with self.using_account(account):
+                result = await self.process_leave_channel(channel_id, username)
+            self.scheduler.remove(channel_id)
+            if result:
+                print(f"✅ خروج از کانال {username} با موفقیت انجام شد")
+            else:
+                print(f"❌ خروج از کانال {username} ناموفق بود")
+            return bool(result)
+        
+        if name == 'join':
+            channel_id = payload.get('channel_id')
+            channel_identifier = payload.get('channel_identifier')
+            if not (channel_id and channel_identifier):
+                print(f"⚠️ دستور join ناقص: {payload}")
+                return False
+            print(f"\n➕ درخواست پیوستن به کانال: {channel_identifier} (ID: {channel_id})")
+            # کانال جدید ابتدا به حسابی با کمترین بار داده می‌شود
+            if self.leases.is_coordinator:
+                await self.assign_accounts()
+            channel = await self.adb.get_channel_by_id(channel_id)
+            if not channel or not channel.get('account'):
+                print(f"⚠️ حسابی برای کانال {channel_identifier} در دسترس نیست")
+                return False
+            if not self.owns(channel['account']):
+                return await self.delegate_command(name, payload, channel['account'])
+            with self.using_account(channel['account']):
                 try:
-                    os.remove(flag_path)
-                except:
-                    pass
-                return None
-        return None
+                    if not await self.process_join_channel(channel_id, channel_identifier):
+                        return False
+                except RateLimitedError as e:
+                    # کانال عضو نیست و در همگام‌سازی بعدی دوباره join می‌شود
+                    print(f"⏭️ پیوستن به کانال {channel_identifier} به دلیل FloodWait انجام نشد: {e}")
+                    return False
+            # کانال جدید بدون انتظار برای همگام‌سازی بعدی در صف زمان‌بندی قرار می‌گیرد
+            channel = await self.adb.get_channel_by_id(channel_id)
+            if channel and channel.get('is_active') and channel.get('is_member'):
+                self.scheduler.add(channel)
+            return True
+        
+        if name == 'check':
+            user_id = payload.get('user_id')
+            account = payload.get('account')
+            print(f"\n⚡ بررسی فوری درخواست شده! (user_id: {user_id}, حساب: {account or 'همه'})")
+            if not account:
+                # حساب‌های workerهای دیگر جداگانه بررسی و اطلاع‌رسانی می‌شوند
+                for other in self.accounts:
+                    if not self.owns(other):
+                        await self.delegate_command(name, payload, other)
+                if not self.leases.accounts:
+                    return True
+            await self.monitor_channels(triggered_by_user_id=user_id, account=account)
+            # بررسی فوری شامل همگام‌سازی کانال‌هاست، پس تایمر همگام‌سازی ریست می‌شود
+            self.next_check_at = asyncio.get_running_loop().time() + self.normal_interval
+            return True
+        
+        print(f"⚠️ دستور ناشناخته: {name}")
+        return False
     
     async def process_leave_channel(self, channel_id: int, username: str):
         """خروج از کانال به صورت فوری"""
@@ -666,7 +1356,7 @@ class ChannelMonitor:
             await self.ensure_connected()
             
             # دریافت اطلاعات کانال از دیتابیس
-            channel_info = self.db.get_channel_by_id(channel_id)
+            channel_info = await self.adb.get_channel_by_id(channel_id)
             if not channel_info:
                 print(f"⚠️ کانال با ID {channel_id} پیدا نشد")
                 return False
@@ -677,45 +1367,31 @@ class ChannelMonitor:
             
             print(f"🔍 تلاش برای خروج از کانال: username={actual_username}, telegram_id={telegram_id}, invite_link={invite_link}")
             
-            entity = None
+            # روش 1: نمایه گفتگوهای حساب (کانال‌هایی که عضو هستیم، بدون درخواست اضافه)
+            entity = await self.find_dialog_entity(telegram_id, actual_username)
+            if entity:
+                print(f"✅ Entity کانال در نمایه گفتگوها پیدا شد")
             
-            # روش 1: استفاده از telegram_id (بهترین روش)
-            if telegram_id:
+            # روش 2: استفاده از telegram_id
+            if not entity and telegram_id:
                 try:
                     # تلاش با ID مستقیم
-                    entity = await self.client.get_entity(telegram_id)
+                    entity = await self.get_entity(telegram_id)
                     print(f"✅ Entity کانال با telegram_id {telegram_id} پیدا شد")
                 except Exception as e:
                     print(f"⚠️ نتوانستیم entity را با telegram_id {telegram_id} پیدا کنیم: {e}")
                     # تلاش با PeerChannel
                     try:
                         from telethon.tl.types import PeerChannel
-                        entity = await self.client.get_entity(PeerChannel(telegram_id))
+                        entity = await self.get_entity(PeerChannel(telegram_id))
                         print(f"✅ Entity کانال با PeerChannel {telegram_id} پیدا شد")
                     except Exception as e2:
                         print(f"⚠️ نتوانستیم entity را با PeerChannel {telegram_id} پیدا کنیم: {e2}")
             
-            # روش 2: جستجو در dialogs (کانال‌هایی که عضو هستیم)
-            if not entity:
-                try:
-                    print(f"🔍 جستجو در dialogs برای پیدا کردن کانال...")
-                    async for dialog in self.client.iter_dialogs():
-                        if hasattr(dialog.entity, 'id') and dialog.entity.id == telegram_id:
-                            entity = dialog.entity
-                            print(f"✅ Entity کانال در dialogs پیدا شد: {dialog.name}")
-                            break
-                        elif hasattr(dialog.entity, 'username') and dialog.entity.username:
-                            if dialog.entity.username == actual_username.lstrip('@'):
-                                entity = dialog.entity
-                                print(f"✅ Entity کانال در dialogs با username پیدا شد: {dialog.name}")
-                                break
-                except Exception as e:
-                    print(f"⚠️ خطا در جستجوی dialogs: {e}")
-            
             # روش 3: استفاده از username
             if not entity and actual_username and not actual_username.startswith('http') and not actual_username.startswith('+'):
                 try:
-                    entity = await self.client.get_entity(actual_username.lstrip('@'))
+                    entity = await self.get_entity(actual_username.lstrip('@'))
                     print(f"✅ Entity کانال با username {actual_username} پیدا شد")
                 except Exception as e:
                     print(f"⚠️ خطا در دریافت entity با username {actual_username}: {e}")
@@ -723,38 +1399,33 @@ class ChannelMonitor:
             # روش 4: استفاده از invite_link (آخرین راه)
             if not entity and invite_link and (invite_link.startswith('http') or invite_link.startswith('t.me/+') or invite_link.startswith('+')):
                 try:
-                    # استخراج hash از لینک با استفاده از تابع کمکی
-                    hash_part = self.extract_invite_hash(invite_link)
-                    print(f"🔍 Hash استخراج شده از لینک: {hash_part}")
-                    
-                    # چک کردن invite برای دریافت entity
-                    from telethon.tl.functions.messages import CheckChatInviteRequest
-                    invite = await self.client(CheckChatInviteRequest(hash_part))
-                    from telethon.tl.types import ChatInviteAlready
-                    if isinstance(invite, ChatInviteAlready):
-                        entity = invite.chat
+                    # چک کردن invite برای دریافت entity (نتیجه از کش invite_cache اگر معتبر باشد)
+                    status, chat = await self.check_invite(invite_link)
+                    if status == INVITE_MEMBER:
+                        entity = chat
                         print(f"✅ Entity کانال با invite link پیدا شد")
                 except Exception as e:
                     print(f"⚠️ خطا در دریافت entity با invite link: {e}")
             
             if entity:
                 try:
-                    await self.client(LeaveChannelRequest(entity))
+                    await self.rpc(LeaveChannelRequest(entity))
+                    await self.forget_membership(entity_id(entity))
                     print(f"✅ از کانال {actual_username} (ID: {telegram_id if telegram_id else 'N/A'}) خارج شدیم (خروج فوری)")
-                    self.db.set_channel_member_status(channel_id, False)
+                    await self.adb.set_channel_member_status(channel_id, False)
                     return True
                 except Exception as e:
                     print(f"❌ خطا در خروج از کانال {actual_username}: {e}")
                     import traceback
                     traceback.print_exc()
                     # حتی در صورت خطا، is_member = 0 می‌کنیم
-                    self.db.set_channel_member_status(channel_id, False)
+                    await self.adb.set_channel_member_status(channel_id, False)
                     return False
             else:
                 print(f"❌ نتوانستیم entity کانال {actual_username} را پیدا کنیم")
                 print(f"   telegram_id: {telegram_id}, invite_link: {invite_link}")
                 # حتی اگر entity پیدا نشد، is_member = 0 می‌کنیم
-                self.db.set_channel_member_status(channel_id, False)
+                await self.adb.set_channel_member_status(channel_id, False)
                 return False
         except Exception as e:
             print(f"❌ خطا در process_leave_channel: {e}")
@@ -762,7 +1433,7 @@ class ChannelMonitor:
             traceback.print_exc()
             # حتی در صورت خطا، is_member = 0 می‌کنیم
             try:
-                self.db.set_channel_member_status(channel_id, False)
+                await self.adb.set_channel_member_status(channel_id, False)
             except:
                 pass
             return False
@@ -773,129 +1444,172 @@ class ChannelMonitor:
             # اطمینان از اتصال قبل از استفاده
             await self.ensure_connected()
             
+            _last_failure.set(None)
             success, entity, telegram_id = await self.join_channel(channel_identifier)
             
             if success and entity:
-                # به‌روزرسانی دیتابیس
-                conn = self.db.get_connection()
-                cursor = conn.cursor()
-                
-                # به‌روزرسانی is_member و telegram_id
-                cursor.execute('''
-                    UPDATE channels 
-                    SET is_member = 1, 
-                        telegram_id = ?,
-                        title = COALESCE(?, title)
-                    WHERE id = ?
-                ''', (telegram_id, entity.title if hasattr(entity, 'title') else None, channel_id))
-                
-                conn.commit()
-                conn.close()
-                
-                # به‌روزرسانی telegram_id اگر تغییر کرده
-                if telegram_id:
-                    self.db.update_channel_telegram_id(channel_id, telegram_id)
+                # به‌روزرسانی is_member، telegram_id و عنوان در یک تراکنش
+                await self.adb.mark_channel_joined(
+                    channel_id,
+                    telegram_id=telegram_id,
+                    title=entity.title if hasattr(entity, 'title') else None,
+                    access_hash=getattr(entity, 'access_hash', None)
+                )
                 
                 print(f"✅ با موفقیت به کانال {channel_identifier} پیوستیم!")
                 return True
             else:
-                # اگر نتوانستیم بپیوندیم، is_member = 0 می‌ماند
+                # اگر نتوانستیم بپیوندیم، is_member = 0 می‌ماند و تا زمان تلاش بعدی join تکرار نمی‌شود
                 print(f"❌ نتوانستیم به کانال {channel_identifier} بپیوندیم")
+                await self.record_failure(channel_id, 'join', channel_identifier)
                 return False
+        except RateLimitedError:
+            raise
         except Exception as e:
             print(f"❌ خطا در process_join_channel: {e}")
             import traceback
             traceback.print_exc()
+            self.note_failure(e)
+            await self.record_failure(channel_id, 'join', channel_identifier)
             return False
     
-    def create_notification(self, user_id, start_time, channels_count, success):
-        """ایجاد فایل notification برای اطلاع‌رسانی به کاربر"""
+    async def notify_check_finished(self, user_id, start_time, channels_count, success):
+        """ثبت اطلاع‌رسانی پایان بررسی در صندوق خروجی notifications و بیدار کردن ربات مدیریتی"""
+        if not user_id:
+            # بررسی‌های دوره‌ای درخواست‌کننده ندارند
+            return
         try:
-            notification_data = {
-                'user_id': user_id,
-                'timestamp': datetime.now().isoformat(),
+            notification_id = await self.adb.add_notification(user_id, 'check_finished', {
                 'start_time': start_time.isoformat(),
                 'channels_count': channels_count,
-                'success': success
-            }
-            notification_path = os.path.join(os.getcwd(), self.notification_file)
-            with open(notification_path, 'w', encoding='utf-8') as f:
-                json.dump(notification_data, f, ensure_ascii=False, indent=2)
-            print(f"📩 فایل notification ایجاد شد در: {notification_path}")
-            print(f"   user_id={user_id}, channels={channels_count}, success={success}")
+                'success': success,
+                # زمان آخرین آپدیت (epoch ثانیه) تا ربات مدیریتی برای نمایش آن به دیتابیس مراجعه نکند
+                'last_update': int(time.time())
+            })
+            if not notification_id:
+                return
+            print(f"📩 notification {notification_id} ثبت شد: user_id={user_id}, channels={channels_count}, success={success}")
+            host, port = get_wakeup_address(self.config, 'admin_wakeup_host', 'admin_wakeup_port',
+                                            'ADMIN_WAKEUP', '127.0.0.1', DEFAULT_ADMIN_PORT)
+            # اگر بسته نرسد، ربات مدیریتی در poll بعدی (یا هنگام شروع) آن را تحویل می‌دهد
+            send_wakeup(host, port, {'notification_id': notification_id})
         except Exception as e:
-            print(f"⚠️ خطا در ایجاد فایل notification: {e}")
+            print(f"⚠️ خطا در ثبت notification: {e}")
             import traceback
             traceback.print_exc()
     
+    async def rebalance_leases(self):
+        """تمدید lease‌ها و گرفتن یا رها کردن حساب‌ها تا سهم عادلانه این worker"""
+        acquired, lost = await self.adb.call(self.leases.rebalance, list(self.accounts))
+        await self.apply_lease_changes(acquired, lost)
+        self.next_rebalance_at = asyncio.get_running_loop().time() + self.leases.renew_interval
+        if self.leases.is_coordinator:
+            # دستورات workerهایی که lease زنده ندارند به صف برمی‌گردند
+            requeued = await self.adb.requeue_running_commands()
+            if requeued:
+                print(f"🔁 {requeued} دستور نیمه‌کاره worker از کار افتاده به صف برگشت")
+    
+    async def apply_lease_changes(self, acquired: set, lost: set):
+        """قطع کلاینت حساب‌های از دست رفته و اتصال کلاینت حساب‌های تازه گرفته شده"""
+        for name in lost:
+            print(f"🔓 lease حساب {name} دیگر در اختیار این worker ({self.leases.worker_id}) نیست")
+            for channel_id, entry in list(self.scheduler.entries.items()):
+                if (entry['channel'].get('account') or self.default_account.name) == name:
+                    self.scheduler.remove(channel_id)
+            account = self.accounts.get(name)
+            if account and account.client:
+                await account.client.disconnect()
+                account.client = None
+        for name in acquired:
+            print(f"🔐 lease حساب {name} به worker {self.leases.worker_id} رسید")
+            with self.using_account(name):
+                await self.setup_account_client()
+        if acquired:
+            # کانال‌های حساب‌های تازه در همگام‌سازی بعدی (همین حالا) به زمان‌بندی اضافه می‌شوند
+            self.next_check_at = 0.0
+    
+    async def keep_leases(self):
+        """تمدید lease‌ها در پس‌زمینه تا بررسی‌های طولانی باعث انقضای آن‌ها نشوند"""
+        while True:
+            await asyncio.sleep(self.leases.renew_interval)
+            try:
+                lost = await self.adb.call(self.leases.renew)
+                if lost:
+                    await self.apply_lease_changes(set(), lost)
+            except Exception as e:
+                print(f"⚠️ خطا در تمدید lease‌ها: {e}")
+    
     async def run(self):
         """اجرای اصلی ربات"""
+        lease_keeper = None
         try:
-            # تنظیم کلاینت
+            # گرفتن lease حساب‌ها و تنظیم کلاینت همان حساب‌ها
+            acquired, _ = await self.adb.call(self.leases.rebalance, list(self.accounts))
+            self.next_rebalance_at = asyncio.get_running_loop().time() + self.leases.renew_interval
+            print(f"🔐 worker {self.leases.worker_id}: حساب‌ها {sorted(acquired) or '-'}"
+                  f"{' (هماهنگ‌کننده)' if self.leases.is_coordinator else ''}")
             await self.setup_client()
+            lease_keeper = asyncio.create_task(self.keep_leases())
             
             print("\n=== ربات رصد کانال شروع به کار کرد ===")
-            print("هر 30 دقیقه کانال‌ها بررسی خواهند شد")
-            print("برای بررسی فوری، فایل trigger_check.flag ایجاد کنید")
+            print(f"فاصله بررسی هر کانال بین {int(self.scheduler.min_interval) // 60} و "
+                  f"{int(self.scheduler.max_interval) // 60} دقیقه بر اساس میزان تغییر آن تنظیم می‌شود")
+            print("دستورات ربات مدیریتی (بررسی فوری، join، leave) از جدول commands اجرا می‌شوند")
             print("برای توقف ربات، Ctrl+C را فشار دهید\n")
             
-            # اولین بررسی فوری
-            await self.monitor_channels()
+            # دستوراتی که قبل از ری‌استارت نیمه‌کاره مانده‌اند دوباره اجرا می‌شوند
+            requeued = await self.adb.requeue_running_commands(self.leases.worker_id)
+            if requeued:
+                print(f"🔁 {requeued} دستور نیمه‌کاره به صف برگشت")
+            await self.wakeup.start()
             
-            # حلقه بررسی دوره‌ای
-            check_interval = 10  # چک کردن هر 10 ثانیه
-            normal_interval = 1800  # 30 دقیقه = 1800 ثانیه
-            time_until_next_check = 0  # زمان باقی‌مانده تا بررسی عادی
+            loop = asyncio.get_running_loop()
+            
+            # اولین بررسی فوری (دور نیمه‌کاره قبل از ری‌استارت از cursor ذخیره شده ادامه پیدا می‌کند)
+            await self.monitor_channels()
+            self.next_check_at = loop.time() + self.normal_interval
             
             while True:
-                # چک کردن فایل flag برای leave کردن کانال (اولویت بالاتر)
-                leave_flag_data = self.check_leave_flag()
-                if leave_flag_data:
-                    channel_id = leave_flag_data.get('channel_id')
-                    username = leave_flag_data.get('username')
-                    if channel_id:
-                        print(f"\n🚪 درخواست خروج فوری از کانال: {username} (ID: {channel_id})")
-                        result = await self.process_leave_channel(channel_id, username)
-                        if result:
-                            print(f"✅ خروج از کانال {username} با موفقیت انجام شد")
-                        else:
-                            print(f"❌ خروج از کانال {username} ناموفق بود")
-                    else:
-                        print(f"⚠️ فایل leave flag پیدا شد اما channel_id موجود نیست: {leave_flag_data}")
+                # تقسیم دوباره حساب‌ها بین workerها (worker جدید یا worker از کار افتاده)
+                if loop.time() >= self.next_rebalance_at:
+                    await self.rebalance_leases()
                 
-                # چک کردن فایل flag برای join کردن کانال
-                join_flag_data = self.check_join_flag()
-                if join_flag_data:
-                    channel_id = join_flag_data.get('channel_id')
-                    channel_identifier = join_flag_data.get('channel_identifier')
-                    if channel_id and channel_identifier:
-                        print(f"\n➕ درخواست پیوستن به کانال: {channel_identifier} (ID: {channel_id})")
-                        await self.process_join_channel(channel_id, channel_identifier)
+                # دستورات صف به ترتیب ثبت (FIFO) اجرا می‌شوند
+                await self.process_commands()
                 
-                # چک کردن فایل flag برای بررسی فوری
-                flag_exists, user_id = self.check_trigger_flag()
-                if flag_exists:
-                    print(f"\n⚡ بررسی فوری درخواست شده! (user_id: {user_id})")
-                    await self.monitor_channels(triggered_by_user_id=user_id)
-                    print(f"✅ بررسی تمام شد، notification برای user_id={user_id} ایجاد می‌شود...")
-                    time_until_next_check = normal_interval  # ریست کردن تایمر
+                # همگام‌سازی دوره‌ای لیست کانال‌ها (join کانال‌های جدید، خروج از کانال‌های حذف شده)
+                if loop.time() >= self.next_check_at:
+                    print(f"\n⏰ همگام‌سازی کانال‌ها (هر {self.normal_interval // 60} دقیقه) - "
+                          f"زمان‌بندی: {self.scheduler.status()}")
+                    await self.sync_channels()
+                    await self.leave_inactive_channels()
+                    self.next_check_at = loop.time() + self.normal_interval
+                
+                # کانال‌هایی که زمانشان رسیده به صورت پیوسته بررسی می‌شوند
+                if await self.check_due_channels():
                     continue
                 
-                # بررسی اینکه آیا زمان بررسی عادی رسیده است
-                if time_until_next_check <= 0:
-                    print(f"\n⏰ بررسی دوره‌ای (هر 30 دقیقه)")
-                    await self.monitor_channels()
-                    time_until_next_check = normal_interval
-                else:
-                    # چاپ پیام هر 5 دقیقه
-                    if time_until_next_check % 300 == 0 or time_until_next_check == normal_interval:
-                        minutes_left = time_until_next_check // 60
-                        print(f"\n⏳ بررسی بعدی در {minutes_left} دقیقه... (یا بررسی فوری با ایجاد trigger_check.flag)")
+                # بازدید پست‌هایی که زمان به‌روزرسانی آن‌ها رسیده (سری زمانی post_stats)
+                if await self.refresh_post_views():
+                    continue
                 
-                # انتظار 10 ثانیه
-                await asyncio.sleep(check_interval)
-                time_until_next_check -= check_interval
+                # نگهداری دیتابیس در زمان بیکاری (حداکثر هر maintenance_interval ثانیه، فقط هماهنگ‌کننده)
+                if self.leases.is_coordinator:
+                    await self.adb.call(self.maintenance.run_if_due)
                 
+                # انتظار تا رسیدن wakeup، poll پشتیبان، بررسی کانال بعدی، همگام‌سازی یا تقسیم بعدی حساب‌ها
+                timeout = min(self.command_poll_interval, self.next_check_at - loop.time(),
+                              self.next_rebalance_at - loop.time())
+                time_until_next_channel = self.scheduler.seconds_until_next()
+                if time_until_next_channel is not None:
+                    timeout = min(timeout, time_until_next_channel)
+                if self.posts_enabled and self.leases.accounts:
+                    next_post_refresh = await self.adb.get_next_post_refresh_at(
+                        sorted(self.leases.accounts), self.default_account.name)
+                    if next_post_refresh is not None:
+                        timeout = min(timeout, max(0, next_post_refresh - time.time()))
+                await self.wakeup.wait(timeout)
+        
         except KeyboardInterrupt:
             print("\n\n🛑 ربات متوقف شد")
         except Exception as e:
@@ -903,8 +1617,17 @@ class ChannelMonitor:
             import traceback
             traceback.print_exc()
         finally:
-            if self.client:
-                await self.client.disconnect()
+            self.wakeup.close()
+            if lease_keeper:
+                lease_keeper.cancel()
+            # lease‌ها آزاد می‌شوند تا workerهای دیگر بدون انتظار ttl حساب‌ها را بگیرند
+            try:
+                await self.adb.call(self.leases.release_all)
+            except Exception as e:
+                print(f"⚠️ خطا در آزاد کردن lease‌ها: {e}")
+            for account in self.accounts.values():
+                if account.client:
+                    await account.client.disconnect()
 
 
 async def main():
@@ -0,0 +1,36 @@
+"""
+پیشرفت دورهای بررسی کامل کانال‌ها (monitor_channels) برای ادامه بعد از ری‌استارت
+
+هر دور بررسی کامل برای هر حساب یک ردیف در جدول monitor_cycles دارد: شناسه دور، تعداد
+کانال‌های انجام شده و cursor (بزرگ‌ترین شناسه کانالی که همه کانال‌های قبل از آن در این
+دور بررسی شده‌اند). کانال‌ها به ترتیب شناسه بررسی می‌شوند و پیشرفت بعد از هر ثبت
+دسته‌ای آمار در دیتابیس ذخیره می‌شود. اگر ربات رصد وسط دور ری‌استارت شود، دور باز
+حساب (اگر در cycle_resume_window ثانیه اخیر شروع شده باشد) ادامه پیدا می‌کند و
+کانال‌های قبل از cursor و کانال‌هایی که بعد از شروع دور آمارشان ثبت شده رد می‌شوند.
+"""
+from typing import Iterable, List
+
+
+class CycleCheckpoint:
+    """پیشرفت یک دور بررسی کامل کانال‌های یک حساب"""
+    
+    def __init__(self, cycle: dict, channel_ids: Iterable[int]):
+        self.id = cycle['id']
+        self.done = cycle.get('done') or 0
+        self.cursor = cycle.get('cursor') or 0
+        # کانال‌های باقی‌مانده این دور به ترتیب شناسه؛ cursor تا اولین کانال انجام نشده جلو می‌رود
+        self.order: List[int] = sorted(channel_ids)
+        self.position = 0
+        self.completed = set()
+        self.dirty = False
+    
+    def complete(self, channel_id: int):
+        """ثبت بررسی کانال در این دور (موفق یا ناموفق)"""
+        if channel_id in self.completed:
+            return
+        self.completed.add(channel_id)
+        self.done += 1
+        while self.position < len(self.order) and self.order[self.position] in self.completed:
+            self.cursor = self.order[self.position]
+            self.position += 1
+        self.dirty = True
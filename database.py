@@ -1,375 +1,526 @@
 """
 مدیریت دیتابیس SQLite برای کانال‌ها و آمار
 """
+import os
+import asyncio
+import functools
 import sqlite3
 import json
-from datetime import datetime, timedelta
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
 from typing import List, Dict, Optional, Tuple
+from migrations import apply_migrations, get_schema_version, rebuild_channel_latest
 
 
-class Database:
-    def __init__(self, db_path='theleton.db'):
+# ستون‌هایی که به صورت epoch ثانیه (UTC) ذخیره می‌شوند و ستون کلید روز (epoch روز)
+TIMESTAMP_COLUMNS = ('recorded_at', 'first_at', 'last_at')
+DAY_COLUMNS = ('day',)
+EPOCH_DATE = date(1970, 1, 1)
+
+
+def to_epoch(dt: datetime) -> int:
+    """تبدیل datetime (UTC بدون tzinfo) به epoch ثانیه"""
+    return int((dt - datetime(1970, 1, 1)).total_seconds())
+
+
+def decode_stats_row(row) -> Dict:
+    """تبدیل یک سطر آمار به dict با recorded_at/first_at/last_at به صورت datetime (UTC) و day به صورت date"""
+    data = dict(row)
+    for key in TIMESTAMP_COLUMNS:
+        if isinstance(data.get(key), int):
+            data[key] = datetime(1970, 1, 1) + timedelta(seconds=data[key])
+    for key in DAY_COLUMNS:
+        if isinstance(data.get(key), int):
+            data[key] = EPOCH_DATE + timedelta(days=data[key])
+    return data
+
+
+class ConnectionManager:
+    """نگهداری اتصال‌های ماندگار SQLite (یک اتصال برای هر process/thread)
+    
+    به جای باز و بسته کردن اتصال در هر متد، هر thread یک اتصال ثابت دارد
+    که تا پایان عمر برنامه باز می‌ماند. تراکنش‌ها به صورت صریح با
+    transaction() مدیریت می‌شوند (اتصال در حالت autocommit است).
+    """
+    
+    def __init__(self, db_path: str, timeout: float = 30.0):
         self.db_path = db_path
-        self.init_database()
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
     
-    def get_connection(self):
-        """ایجاد اتصال به دیتابیس"""
-        conn = sqlite3.connect(self.db_path)
+    def _open(self) -> sqlite3.Connection:
+        """باز کردن یک اتصال جدید با تنظیمات ثابت"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
         conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {int(self.timeout * 1000)}')
+        with self._lock:
+            self._connections.append(conn)
         return conn
     
-    def init_database(self):
-        """ایجاد جداول دیتابیس"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # جدول کانال‌ها
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS channels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                title TEXT,
-                invite_link TEXT,
-                category TEXT,
-                telegram_id INTEGER,
-                previous_telegram_id INTEGER,
-                is_member BOOLEAN DEFAULT 0,
-                added_by INTEGER,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1
-            )
-        ''')
-        
-        # اضافه کردن ستون‌های جدید به جدول موجود (اگر وجود ندارد)
-        try:
-            cursor.execute('ALTER TABLE channels ADD COLUMN invite_link TEXT')
-        except sqlite3.OperationalError:
-            pass  # ستون قبلاً وجود دارد
-        
+    def get(self) -> sqlite3.Connection:
+        """دریافت اتصال thread فعلی (در صورت نیاز ایجاد می‌شود)"""
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, 'conn', None) is None or local.pid != pid:
+            # بعد از fork اتصال والد قابل استفاده نیست
+            local.conn = self._open()
+            local.pid = pid
+            local.depth = 0
+        return local.conn
+    
+    @contextmanager
+    def cursor(self):
+        """cursor برای خواندن (بدون شروع تراکنش)"""
+        cursor = self.get().cursor()
         try:
-            cursor.execute('ALTER TABLE channels ADD COLUMN category TEXT')
-        except sqlite3.OperationalError:
-            pass  # ستون قبلاً وجود دارد
+            yield cursor
+        finally:
+            cursor.close()
+    
+    @contextmanager
+    def transaction(self, immediate: bool = True):
+        """تراکنش با commit خودکار و rollback در صورت خطا
         
-        try:
-            cursor.execute('ALTER TABLE channels ADD COLUMN telegram_id INTEGER')
-        except sqlite3.OperationalError:
-            pass  # ستون قبلاً وجود دارد
+        تراکنش‌های تو در تو با SAVEPOINT پیاده‌سازی می‌شوند، پس متدهایی که
+        خودشان تراکنش باز می‌کنند را می‌توان داخل یک تراکنش بزرگ‌تر صدا زد.
+        """
+        conn = self.get()
+        local = self._local
+        cursor = conn.cursor()
         
-        try:
-            cursor.execute('ALTER TABLE channels ADD COLUMN previous_telegram_id INTEGER')
-        except sqlite3.OperationalError:
-            pass  # ستون قبلاً وجود دارد
+        if local.depth > 0:
+            savepoint = f'sp_{local.depth}'
+            conn.execute(f'SAVEPOINT {savepoint}')
+            local.depth += 1
+            try:
+                yield cursor
+            except BaseException:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+                raise
+            else:
+                conn.execute(f'RELEASE {savepoint}')
+            finally:
+                local.depth -= 1
+                cursor.close()
+            return
         
+        # IMMEDIATE: قفل نوشتن از ابتدا گرفته می‌شود تا بین دو سرویس deadlock پیش نیاید
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        local.depth = 1
         try:
-            cursor.execute('ALTER TABLE channels ADD COLUMN is_member BOOLEAN DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass  # ستون قبلاً وجود دارد
+            yield cursor
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            local.depth = 0
+            cursor.close()
+    
+    def close_all(self):
+        """بستن همه اتصال‌های باز (هنگام خروج برنامه)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+
+class Database:
+    def __init__(self, db_path='theleton.db'):
+        self.db_path = db_path
+        self.connections = ConnectionManager(db_path)
+        self.init_database()
+    
+    def get_connection(self) -> sqlite3.Connection:
+        """اتصال ماندگار thread فعلی (نباید بسته شود)"""
+        return self.connections.get()
+    
+    def cursor(self):
+        """cursor برای خواندن از اتصال ماندگار"""
+        return self.connections.cursor()
+    
+    def transaction(self, immediate: bool = True):
+        """تراکنش روی اتصال ماندگار - با with استفاده شود"""
+        return self.connections.transaction(immediate)
+    
+    def close(self):
+        """بستن اتصال‌های دیتابیس"""
+        self.connections.close_all()
+    
+    def init_database(self):
+        """ایجاد/به‌روزرسانی جداول دیتابیس با اجرای مهاجرت‌های معوق"""
+        conn = self.get_connection()
+        if conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+            # auto_vacuum فقط قبل از ایجاد اولین جدول تنظیم می‌شود (برای incremental_vacuum)
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
         
-        # جدول تاریخچه آمار
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS channel_stats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id INTEGER NOT NULL,
-                recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                member_count INTEGER DEFAULT 0,
-                views_count INTEGER DEFAULT 0,
-                posts_count INTEGER DEFAULT 0,
-                member_change INTEGER DEFAULT 0,
-                views_change INTEGER DEFAULT 0,
-                posts_change INTEGER DEFAULT 0,
-                positive_change INTEGER DEFAULT 0,
-                FOREIGN KEY (channel_id) REFERENCES channels(id)
-            )
-        ''')
-        
-        # جدول ادمین‌ها
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE NOT NULL,
-                username TEXT,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # جدول دسته‌بندی‌ها
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        applied = apply_migrations(self.connections)
+        if applied:
+            print(f"🗄️ مهاجرت‌های دیتابیس اجرا شد: {applied}")
+    
+    def get_schema_version(self) -> int:
+        """نسخه فعلی schema دیتابیس"""
+        with self.cursor() as cursor:
+            return get_schema_version(cursor)
+    
+    # پرس‌وجوهای پرتکرار: نام ثابت SQL همان متد و ایندکسی که باید از آن استفاده کند
+    # (check_query_plans همان SQL اجرا شده توسط متدها را بررسی می‌کند، نه یک نسخه کپی شده)
+    HOT_QUERIES = {
+        'get_last_stats': ('LAST_STATS_SQL', 'INTEGER PRIMARY KEY'),
+        'get_first_stats': ('FIRST_STATS_SQL', 'idx_channel_stats_channel_recorded'),
+        'get_yesterday_stats': ('YESTERDAY_STATS_SQL', 'idx_channel_stats_channel_day'),
+        'reset_channel_stats': ('RESET_CHANNEL_STATS_SQL', 'idx_channel_stats_channel_recorded'),
+        'downsample_raw_stats': ('DOWNSAMPLE_RAW_STATS_SQL', 'idx_channel_stats_channel_recorded'),
+        'get_active_channels': ('ACTIVE_CHANNELS_SQL', 'idx_channels_active_member'),
+        'get_channel_activity': ('CHANNEL_ACTIVITY_SQL', 'idx_channel_stats_channel_recorded'),
+        'get_due_posts': ('DUE_POSTS_SQL', 'idx_posts_next_refresh'),
+        'get_recent_posts': ('RECENT_POSTS_SQL', 'PRIMARY KEY'),
+    }
+    
+    def check_query_plans(self) -> Dict[str, str]:
+        """بررسی EXPLAIN QUERY PLAN پرس‌وجوهای پرتکرار
         
-        conn.commit()
-        conn.close()
+        Returns:
+            دیکشنری {نام پرس‌وجو: plan} برای پرس‌وجوهایی که از ایندکس مورد انتظار
+            استفاده نمی‌کنند یا جدول موقت مرتب‌سازی می‌سازند (خالی یعنی همه درست هستند)
+        """
+        problems = {}
+        with self.cursor() as cursor:
+            for name, (sql_name, index_name) in self.HOT_QUERIES.items():
+                sql = getattr(self, sql_name)
+                # پارامترهای نام‌دار (:name) یا ? با NULL پر می‌شوند؛ plan به مقدار آن‌ها بستگی ندارد
+                named = set(re.findall(r':(\w+)', sql))
+                params = dict.fromkeys(named) if named else (None,) * sql.count('?')
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = ' | '.join(row['detail'] for row in cursor.fetchall())
+                if index_name not in plan or 'TEMP B-TREE' in plan:
+                    problems[name] = plan
+        return problems
     
     def add_channel(self, username_or_link: str, title: str = "", added_by: int = None, invite_link: str = None, category: str = None) -> bool:
         """افزودن کانال جدید (پشتیبانی از username و invite link)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # افزودن دسته‌بندی به جدول categories (اگر وجود دارد)
-            if category:
-                try:
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO categories (name)
-                        VALUES (?)
-                    ''', (category,))
-                except Exception as e:
-                    print(f"خطا در افزودن دسته‌بندی '{category}' به جدول categories: {e}")
-                    # ادامه می‌دهیم حتی اگر خطا داد
-            
-            # تشخیص اینکه آیا invite link است یا username
-            is_invite_link = username_or_link.startswith('http') or username_or_link.startswith('t.me/+') or username_or_link.startswith('+')
-            
-            if is_invite_link:
-                # برای invite link، از خود لینک به عنوان username استفاده می‌کنیم
-                username = username_or_link
-                if not invite_link:
-                    invite_link = username_or_link
-            else:
-                username = username_or_link.lstrip('@')
-            
-            # چک کردن اینکه آیا کانال قبلاً وجود داشته (حتی اگر غیرفعال باشد)
-            cursor.execute('SELECT id, is_active FROM channels WHERE username = ?', (username,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # اگر کانال وجود دارد و غیرفعال است، آن را فعال می‌کنیم
-                channel_id = dict(existing)['id']
-                is_active = dict(existing)['is_active']
+            with self.transaction() as cursor:
+                # افزودن دسته‌بندی به جدول categories (اگر وجود دارد)
+                if category:
+                    try:
+                        cursor.execute('''
+                            INSERT OR IGNORE INTO categories (name)
+                            VALUES (?)
+                        ''', (category,))
+                    except Exception as e:
+                        print(f"خطا در افزودن دسته‌بندی '{category}' به جدول categories: {e}")
+                        # ادامه می‌دهیم حتی اگر خطا داد
                 
-                if not is_active:
-                    cursor.execute('''
-                        UPDATE channels 
-                        SET is_active = 1, 
-                            title = COALESCE(?, title), 
-                            invite_link = COALESCE(?, invite_link),
-                            category = COALESCE(?, category),
-                            added_by = COALESCE(?, added_by)
-                        WHERE id = ?
-                    ''', (title if title else None, invite_link, category, added_by, channel_id))
-                    conn.commit()
-                    conn.close()
-                    return True
+                # تشخیص اینکه آیا invite link است یا username
+                is_invite_link = username_or_link.startswith('http') or username_or_link.startswith('t.me/+') or username_or_link.startswith('+')
+                
+                if is_invite_link:
+                    # برای invite link، از خود لینک به عنوان username استفاده می‌کنیم
+                    username = username_or_link
+                    if not invite_link:
+                        invite_link = username_or_link
                 else:
-                    # کانال قبلاً فعال است
-                    conn.close()
-                    return False  # کانال قبلاً اضافه شده
-            else:
-                # کانال جدید است
-                cursor.execute('''
-                    INSERT INTO channels (username, title, invite_link, category, added_by)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (username, title, invite_link, category, added_by))
+                    username = username_or_link.lstrip('@')
                 
-                conn.commit()
-                success = cursor.rowcount > 0
-                conn.close()
-                return success
+                # چک کردن اینکه آیا کانال قبلاً وجود داشته (حتی اگر غیرفعال باشد)
+                cursor.execute('SELECT id, is_active FROM channels WHERE username = ?', (username,))
+                existing = cursor.fetchone()
+                
+                if existing:
+                    # اگر کانال وجود دارد و غیرفعال است، آن را فعال می‌کنیم
+                    channel_id = dict(existing)['id']
+                    is_active = dict(existing)['is_active']
+                    
+                    if not is_active:
+                        cursor.execute('''
+                            UPDATE channels
+                            SET is_active = 1,
+                                title = COALESCE(?, title),
+                                invite_link = COALESCE(?, invite_link),
+                                category = COALESCE(?, category),
+                                added_by = COALESCE(?, added_by)
+                            WHERE id = ?
+                        ''', (title if title else None, invite_link, category, added_by, channel_id))
+                        # کانال دوباره اضافه شده است؛ backoff و قرنطینه قبلی از نو شروع می‌شود
+                        cursor.execute('DELETE FROM channel_failures WHERE channel_id = ?', (channel_id,))
+                        return True
+                    else:
+                        # کانال قبلاً فعال است
+                        return False  # کانال قبلاً اضافه شده
+                else:
+                    # کانال جدید است
+                    cursor.execute('''
+                        INSERT INTO channels (username, title, invite_link, category, added_by)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (username, title, invite_link, category, added_by))
+                    
+                    return cursor.rowcount > 0
         except Exception as e:
             print(f"خطا در افزودن کانال: {e}")
-            conn.close()
             return False
     
     def remove_channel(self, username: str) -> bool:
         """حذف کانال (is_active = 0، is_member بدون تغییر باقی می‌ماند تا بعد از leave تنظیم شود)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         username = username.lstrip('@')
-        # فقط is_active را 0 می‌کنیم، is_member را نگه می‌داریم تا بعد از leave تنظیم شود
-        cursor.execute('UPDATE channels SET is_active = 0 WHERE username = ?', (username,))
-        conn.commit()
-        success = cursor.rowcount > 0
-        conn.close()
-        return success
+        with self.transaction() as cursor:
+            # فقط is_active را 0 می‌کنیم، is_member را نگه می‌داریم تا بعد از leave تنظیم شود
+            cursor.execute('UPDATE channels SET is_active = 0 WHERE username = ?', (username,))
+            return cursor.rowcount > 0
+    
+    ACTIVE_CHANNELS_SQL = '''
+        SELECT c.id, c.username, c.title, c.invite_link, c.telegram_id, c.access_hash, c.is_member,
+               c.account, c.last_message_id, f.attempts AS failure_attempts
+        FROM channels c
+        LEFT JOIN channel_failures f ON f.channel_id = c.id
+        WHERE c.is_active = 1 AND c.is_member = 1
+        ORDER BY c.added_at DESC
+    '''
     
     def get_active_channels(self) -> List[Dict]:
         """دریافت لیست کانال‌های فعال که عضو هستیم (برای بررسی آمار)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, title, invite_link, telegram_id, is_member 
-            FROM channels 
-            WHERE is_active = 1 AND is_member = 1
-            ORDER BY added_at DESC
-        ''')
+        with self.cursor() as cursor:
+            cursor.execute(self.ACTIVE_CHANNELS_SQL)
+            
+            return [dict(row) for row in cursor.fetchall()]
+    
+    # تغییرات بین نمونه‌های داخل بازه (member_change اولین نمونه به نمونه قبل از بازه مربوط است)
+    # نمونه قبلی هر نمونه با جستجو در ایندکس (channel_id, recorded_at) پیدا می‌شود و کانال‌ها به
+    # ترتیب channel_latest پیمایش می‌شوند، پس نه تابع پنجره‌ای و نه GROUP BY جدول موقت لازم ندارند
+    CHANNEL_ACTIVITY_SQL = '''
+        SELECT cl.channel_id,
+               COUNT(*) AS samples,
+               COALESCE(SUM(ABS(cs.member_count - (
+                   SELECT p.member_count FROM channel_stats p
+                   WHERE p.channel_id = cs.channel_id AND p.recorded_at >= :since
+                     AND (p.recorded_at, p.id) < (cs.recorded_at, cs.id)
+                   ORDER BY p.recorded_at DESC, p.id DESC
+                   LIMIT 1
+               ))), 0) AS total_change,
+               MIN(cs.recorded_at) AS first_at,
+               MAX(cs.recorded_at) AS last_at,
+               MAX(CASE WHEN cs.id = cl.stats_id THEN cs.member_count END) AS member_count
+        FROM channel_latest cl
+        CROSS JOIN channel_stats cs ON cs.channel_id = cl.channel_id AND cs.recorded_at >= :since
+        GROUP BY cl.channel_id
+    '''
+    
+    def get_channel_activity(self, since: int) -> Dict[int, Dict]:
+        """نوسان تعداد اعضای هر کانال از زمان since (epoch ثانیه) - برای زمان‌بندی تطبیقی
         
-        channels = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return channels
+        Returns:
+            {channel_id: {'samples', 'total_change', 'first_at', 'last_at', 'member_count'}}
+            که total_change مجموع قدر مطلق member_change نمونه‌ها و member_count آخرین تعداد اعضاست
+        """
+        with self.cursor() as cursor:
+            cursor.execute(self.CHANNEL_ACTIVITY_SQL, {'since': since})
+            
+            return {row['channel_id']: dict(row) for row in cursor.fetchall()}
     
     def get_all_active_channels(self) -> List[Dict]:
-        """دریافت لیست همه کانال‌های فعال (برای نمایش در لیست)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """دریافت لیست همه کانال‌های فعال (برای نمایش در لیست)
         
-        cursor.execute('''
-            SELECT id, username, title, invite_link, telegram_id, is_member, category 
-            FROM channels 
-            WHERE is_active = 1
-            ORDER BY added_at DESC
-        ''')
-        
-        channels = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return channels
+        failure، failure_attempts، retry_at و quarantined وضعیت شکست join/آمار کانال از
+        جدول channel_failures است (None برای کانال‌های بدون خطا).
+        """
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT c.id, c.username, c.title, c.invite_link, c.telegram_id, c.is_member, c.category,
+                       c.account, f.failure, f.attempts AS failure_attempts, f.next_retry_at AS retry_at,
+                       f.quarantined
+                FROM channels c
+                LEFT JOIN channel_failures f ON f.channel_id = c.id
+                WHERE c.is_active = 1
+                ORDER BY c.added_at DESC
+            ''')
+            
+            return [dict(row) for row in cursor.fetchall()]
     
     def get_channels_to_leave(self) -> List[Dict]:
         """دریافت لیست کانال‌های غیرفعال که باید از آن‌ها خارج شد (is_active = 0 و is_member = 1)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, title, invite_link, telegram_id 
-            FROM channels 
-            WHERE is_active = 0 AND is_member = 1
-            ORDER BY added_at DESC
-        ''')
-        
-        channels = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return channels
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT id, username, title, invite_link, telegram_id, account
+                FROM channels
+                WHERE is_active = 0 AND is_member = 1
+                ORDER BY added_at DESC
+            ''')
+            
+            return [dict(row) for row in cursor.fetchall()]
     
     def set_channel_member_status(self, channel_id: int, is_member: bool) -> bool:
         """تنظیم وضعیت عضویت کانال"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('''
-                UPDATE channels 
-                SET is_member = ? 
-                WHERE id = ?
-            ''', (1 if is_member else 0, channel_id))
-            
-            conn.commit()
-            success = cursor.rowcount > 0
-            conn.close()
-            return success
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    UPDATE channels
+                    SET is_member = ?
+                    WHERE id = ?
+                ''', (1 if is_member else 0, channel_id))
+                
+                return cursor.rowcount > 0
         except Exception as e:
             print(f"خطا در تنظیم وضعیت عضویت: {e}")
-            conn.close()
             return False
     
     def mark_channel_left(self, channel_id: int):
         """علامت‌گذاری کانال که از آن خارج شدیم (حذف telegram_id)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('UPDATE channels SET telegram_id = NULL WHERE id = ?', (channel_id,))
-            conn.commit()
+            with self.transaction() as cursor:
+                cursor.execute('UPDATE channels SET telegram_id = NULL WHERE id = ?', (channel_id,))
         except Exception as e:
             print(f"خطا در علامت‌گذاری کانال: {e}")
-        finally:
-            conn.close()
+    
+    def mark_channel_joined(self, channel_id: int, telegram_id: int = None, title: str = None,
+                            access_hash: int = None):
+        """ثبت عضویت موفق در کانال (is_member، telegram_id، access_hash و عنوان) در یک تراکنش
+        
+        اگر هر کدام از نوشتن‌ها خطا بدهد هیچ‌کدام ثبت نمی‌شود و کانال عضو نشده باقی می‌ماند.
+        """
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('UPDATE channels SET is_member = 1 WHERE id = ?', (channel_id,))
+                if title:
+                    cursor.execute('UPDATE channels SET title = ? WHERE id = ?', (title, channel_id))
+                if telegram_id:
+                    self._write_channel_telegram_id(cursor, channel_id, telegram_id)
+                    cursor.execute('UPDATE channels SET access_hash = ? WHERE id = ?', (access_hash, channel_id))
+        except Exception as e:
+            print(f"خطا در ثبت عضویت کانال: {e}")
+    
+    def update_channel_title(self, channel_id: int, title: str):
+        """به‌روزرسانی عنوان کانال"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('UPDATE channels SET title = ? WHERE id = ?', (title, channel_id))
+        except Exception as e:
+            print(f"خطا در به‌روزرسانی عنوان کانال: {e}")
+    
+    def _write_channel_telegram_id(self, cursor, channel_id: int, telegram_id: int):
+        """ثبت telegram_id کانال و ذخیره ID قبلی اگر تغییر کرده (خطا به تراکنش فراخواننده می‌رسد)"""
+        # سمت راست SET مقدارهای قبل از UPDATE را می‌بیند
+        cursor.execute('''
+            UPDATE channels
+            SET previous_telegram_id = CASE
+                    WHEN telegram_id IS NOT NULL AND telegram_id != :telegram_id THEN telegram_id
+                    ELSE previous_telegram_id
+                END,
+                telegram_id = :telegram_id
+            WHERE id = :channel_id
+        ''', {'channel_id': channel_id, 'telegram_id': telegram_id})
     
     def update_channel_telegram_id(self, channel_id: int, telegram_id: int):
         """به‌روزرسانی telegram_id کانال و ذخیره ID قبلی اگر تغییر کرده"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # دریافت telegram_id فعلی
-            cursor.execute('SELECT telegram_id FROM channels WHERE id = ?', (channel_id,))
-            current_id = cursor.fetchone()
-            
-            if current_id and current_id[0] and current_id[0] != telegram_id:
-                # ID تغییر کرده، ذخیره ID قبلی
-                cursor.execute('''
-                    UPDATE channels 
-                    SET telegram_id = ?, previous_telegram_id = ? 
-                    WHERE id = ?
-                ''', (telegram_id, current_id[0], channel_id))
-            else:
-                # اولین بار است یا تغییر نکرده
-                cursor.execute('''
-                    UPDATE channels 
-                    SET telegram_id = ? 
-                    WHERE id = ?
-                ''', (telegram_id, channel_id))
-            
-            conn.commit()
+            with self.transaction() as cursor:
+                self._write_channel_telegram_id(cursor, channel_id, telegram_id)
         except Exception as e:
             print(f"خطا در به‌روزرسانی telegram_id: {e}")
-        finally:
-            conn.close()
+    
+    def update_channel_peer(self, channel_id: int, telegram_id: int, access_hash: int = None):
+        """ذخیره telegram_id و access_hash کانال (برای ساخت InputPeerChannel بدون resolve)
+        
+        هر دو در یک تراکنش نوشته می‌شوند تا access_hash هیچ‌وقت کنار telegram_id قدیمی ثبت نشود.
+        """
+        try:
+            with self.transaction() as cursor:
+                self._write_channel_telegram_id(cursor, channel_id, telegram_id)
+                cursor.execute('UPDATE channels SET access_hash = ? WHERE id = ?', (access_hash, channel_id))
+        except Exception as e:
+            print(f"خطا در به‌روزرسانی access_hash: {e}")
+    
+    def clear_channel_access_hash(self, channel_id: int):
+        """حذف access_hash نامعتبر تا در دور بعد کانال دوباره resolve شود"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('UPDATE channels SET access_hash = NULL WHERE id = ?', (channel_id,))
+        except Exception as e:
+            print(f"خطا در حذف access_hash: {e}")
+    
+    def assign_channel_accounts(self, assignments: List[Tuple[int, str, bool]]) -> int:
+        """ثبت حساب کانال‌ها در یک تراکنش - برمی‌گرداند تعداد کانال‌های به‌روز شده
+        
+        Args:
+            assignments: لیست (channel_id, account, reset_membership)؛ اگر reset_membership
+                True باشد (کانال از حساب دیگری منتقل شده) is_member و access_hash پاک می‌شوند
+                چون عضویت و access_hash به حساب قبلی تعلق داشتند
+        """
+        if not assignments:
+            return 0
+        try:
+            with self.transaction() as cursor:
+                for channel_id, account, reset_membership in assignments:
+                    if reset_membership:
+                        cursor.execute('''
+                            UPDATE channels SET account = ?, is_member = 0, access_hash = NULL
+                            WHERE id = ?
+                        ''', (account, channel_id))
+                    else:
+                        cursor.execute('UPDATE channels SET account = ? WHERE id = ?', (account, channel_id))
+            return len(assignments)
+        except Exception as e:
+            print(f"خطا در ثبت حساب کانال‌ها: {e}")
+            return 0
+    
+    # صفر کردن تغییرات آخرین رکورد یک کانال
+    RESET_CHANNEL_STATS_SQL = '''
+        UPDATE channel_stats
+        SET member_change = 0,
+            views_change = 0,
+            posts_change = 0,
+            positive_change = 0
+        WHERE id = (
+            SELECT id FROM channel_stats
+            WHERE channel_id = ?
+            ORDER BY recorded_at DESC, id DESC
+            LIMIT 1
+        )
+    '''
     
     def reset_channel_stats(self, channel_id: int = None) -> bool:
         """صفر کردن آمار شمارش کانال(ها) - حفظ title, is_active, member_count فعلی"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            if channel_id:
-                # صفر کردن آمار یک کانال خاص
-                # دریافت آخرین member_count
-                cursor.execute('''
-                    SELECT member_count FROM channel_stats 
-                    WHERE channel_id = ? 
-                    ORDER BY recorded_at DESC 
-                    LIMIT 1
-                ''', (channel_id,))
-                result = cursor.fetchone()
-                current_member_count = result[0] if result else 0
-                
-                # صفر کردن تغییرات در آخرین رکورد
-                cursor.execute('''
-                    UPDATE channel_stats 
-                    SET member_change = 0,
-                        views_change = 0,
-                        posts_change = 0,
-                        positive_change = 0
-                    WHERE id = (
-                        SELECT id FROM channel_stats 
-                        WHERE channel_id = ? 
-                        ORDER BY recorded_at DESC 
-                        LIMIT 1
-                    )
-                ''', (channel_id,))
-                
-                conn.commit()
-                conn.close()
-                return True
-            else:
-                # صفر کردن آمار همه کانال‌ها
-                cursor.execute('''
-                    UPDATE channel_stats 
-                    SET member_change = 0,
-                        views_change = 0,
-                        posts_change = 0,
-                        positive_change = 0
-                ''')
-                
-                conn.commit()
-                conn.close()
+            with self.transaction() as cursor:
+                if channel_id:
+                    # صفر کردن آمار یک کانال خاص
+                    # صفر کردن تغییرات در آخرین رکورد
+                    cursor.execute(self.RESET_CHANNEL_STATS_SQL, (channel_id,))
+                else:
+                    # صفر کردن آمار همه کانال‌ها
+                    cursor.execute('''
+                        UPDATE channel_stats
+                        SET member_change = 0,
+                            views_change = 0,
+                            posts_change = 0,
+                            positive_change = 0
+                    ''')
                 return True
         except Exception as e:
             print(f"خطا در Reset آمار: {e}")
-            conn.close()
             return False
     
     def get_all_categories(self) -> List[str]:
         """دریافت لیست تمام دسته‌بندی‌های موجود (فقط از جدول categories)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT name 
-            FROM categories 
-            ORDER BY name
-        ''')
-        
-        categories = [row[0] for row in cursor.fetchall()]
-        
-        conn.close()
-        return categories
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT name
+                FROM categories
+                ORDER BY name
+            ''')
+            
+            return [row[0] for row in cursor.fetchall()]
     
     def sync_categories_from_channels(self) -> int:
         """همگام‌سازی دسته‌بندی‌های موجود در channels با جدول categories
@@ -380,42 +531,37 @@ class Database:
         Returns:
             تعداد دسته‌بندی‌های جدیدی که اضافه شدند
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # دریافت همه دسته‌بندی‌های منحصر به فرد از channels
-            cursor.execute('''
-                SELECT DISTINCT category 
-                FROM channels 
-                WHERE category IS NOT NULL AND category != ''
-            ''')
-            
-            categories_from_channels = [row[0] for row in cursor.fetchall()]
-            
-            # دریافت دسته‌بندی‌های موجود در جدول categories
-            cursor.execute('SELECT name FROM categories')
-            existing_categories = {row[0] for row in cursor.fetchall()}
-            
-            # افزودن دسته‌بندی‌های جدید
-            added_count = 0
-            for category in categories_from_channels:
-                if category not in existing_categories:
-                    try:
-                        cursor.execute('''
-                            INSERT OR IGNORE INTO categories (name)
-                            VALUES (?)
-                        ''', (category,))
-                        added_count += 1
-                    except Exception as e:
-                        print(f"خطا در افزودن دسته‌بندی '{category}': {e}")
-            
-            conn.commit()
-            conn.close()
-            return added_count
+            with self.transaction() as cursor:
+                # دریافت همه دسته‌بندی‌های منحصر به فرد از channels
+                cursor.execute('''
+                    SELECT DISTINCT category
+                    FROM channels
+                    WHERE category IS NOT NULL AND category != ''
+                ''')
+                
+                categories_from_channels = [row[0] for row in cursor.fetchall()]
+                
+                # دریافت دسته‌بندی‌های موجود در جدول categories
+                cursor.execute('SELECT name FROM categories')
+                existing_categories = {row[0] for row in cursor.fetchall()}
+                
+                # افزودن دسته‌بندی‌های جدید
+                added_count = 0
+                for category in categories_from_channels:
+                    if category not in existing_categories:
+                        try:
+                            cursor.execute('''
+                                INSERT OR IGNORE INTO categories (name)
+                                VALUES (?)
+                            ''', (category,))
+                            added_count += 1
+                        except Exception as e:
+                            print(f"خطا در افزودن دسته‌بندی '{category}': {e}")
+                
+                return added_count
         except Exception as e:
             print(f"خطا در همگام‌سازی دسته‌بندی‌ها: {e}")
-            conn.close()
             return 0
     
     def cleanup_orphaned_categories(self) -> int:
@@ -424,142 +570,108 @@ class Database:
         Returns:
             تعداد دسته‌بندی‌های حذف شده
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # دریافت همه دسته‌بندی‌ها
-            cursor.execute('SELECT name FROM categories')
-            all_categories = [row[0] for row in cursor.fetchall()]
-            
-            # دریافت دسته‌بندی‌هایی که حداقل یک کانال فعال دارند
-            cursor.execute('''
-                SELECT DISTINCT category 
-                FROM channels 
-                WHERE is_active = 1 
-                AND category IS NOT NULL 
-                AND category != ''
-            ''')
-            categories_with_channels = {row[0] for row in cursor.fetchall()}
-            
-            # حذف دسته‌بندی‌های بدون کانال فعال
-            removed_count = 0
-            for category in all_categories:
-                if category not in categories_with_channels:
-                    try:
-                        cursor.execute('DELETE FROM categories WHERE name = ?', (category,))
-                        removed_count += 1
-                    except Exception as e:
-                        print(f"خطا در حذف دسته‌بندی '{category}': {e}")
-            
-            conn.commit()
-            conn.close()
-            return removed_count
+            with self.transaction() as cursor:
+                # دریافت همه دسته‌بندی‌ها
+                cursor.execute('SELECT name FROM categories')
+                all_categories = [row[0] for row in cursor.fetchall()]
+                
+                # دریافت دسته‌بندی‌هایی که حداقل یک کانال فعال دارند
+                cursor.execute('''
+                    SELECT DISTINCT category
+                    FROM channels
+                    WHERE is_active = 1
+                    AND category IS NOT NULL
+                    AND category != ''
+                ''')
+                categories_with_channels = {row[0] for row in cursor.fetchall()}
+                
+                # حذف دسته‌بندی‌های بدون کانال فعال
+                removed_count = 0
+                for category in all_categories:
+                    if category not in categories_with_channels:
+                        try:
+                            cursor.execute('DELETE FROM categories WHERE name = ?', (category,))
+                            removed_count += 1
+                        except Exception as e:
+                            print(f"خطا در حذف دسته‌بندی '{category}': {e}")
+                
+                return removed_count
         except Exception as e:
             print(f"خطا در پاکسازی دسته‌بندی‌های بدون استفاده: {e}")
-            conn.close()
             return 0
     
     def get_categories_with_active_channels(self) -> List[str]:
         """دریافت لیست دسته‌بندی‌هایی که حداقل یک کانال فعال دارند"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # دریافت دسته‌بندی‌های کانال‌های فعال
-        cursor.execute('''
-            SELECT DISTINCT category 
-            FROM channels 
-            WHERE is_active = 1 
-            AND category IS NOT NULL 
-            AND category != ''
-            ORDER BY category
-        ''')
-        
-        categories = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return categories
+        with self.cursor() as cursor:
+            # دریافت دسته‌بندی‌های کانال‌های فعال
+            cursor.execute('''
+                SELECT DISTINCT category
+                FROM channels
+                WHERE is_active = 1
+                AND category IS NOT NULL
+                AND category != ''
+                ORDER BY category
+            ''')
+            
+            return [row[0] for row in cursor.fetchall()]
     
     def add_category(self, category_name: str) -> bool:
         """افزودن دسته‌بندی جدید به جدول categories"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO categories (name)
-                VALUES (?)
-            ''', (category_name,))
-            
-            conn.commit()
-            success = cursor.rowcount > 0
-            conn.close()
-            return success
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO categories (name)
+                    VALUES (?)
+                ''', (category_name,))
+                
+                return cursor.rowcount > 0
         except Exception as e:
             print(f"خطا در افزودن دسته‌بندی: {e}")
-            conn.close()
             return False
     
     def delete_category_from_table(self, category_name: str) -> bool:
         """حذف دسته‌بندی از جدول categories"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('DELETE FROM categories WHERE name = ?', (category_name,))
-            conn.commit()
-            success = cursor.rowcount > 0
-            conn.close()
-            return success
+            with self.transaction() as cursor:
+                cursor.execute('DELETE FROM categories WHERE name = ?', (category_name,))
+                return cursor.rowcount > 0
         except Exception as e:
             print(f"خطا در حذف دسته‌بندی: {e}")
-            conn.close()
             return False
     
     def get_channels_count_by_category(self, category: str) -> int:
         """شمارش تعداد کانال‌های یک دسته‌بندی"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) 
-            FROM channels 
-            WHERE category = ? AND is_active = 1
-        ''', (category,))
-        
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT COUNT(*)
+                FROM channels
+                WHERE category = ? AND is_active = 1
+            ''', (category,))
+            
+            return cursor.fetchone()[0]
     
     def delete_category(self, category: str) -> bool:
         """حذف دسته‌بندی (تبدیل همه کانال‌های آن به NULL و حذف از جدول categories)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # تبدیل category کانال‌ها به NULL
-            cursor.execute('''
-                UPDATE channels 
-                SET category = NULL 
-                WHERE category = ?
-            ''', (category,))
-            
-            # حذف از جدول categories
-            cursor.execute('DELETE FROM categories WHERE name = ?', (category,))
-            
-            conn.commit()
-            success = cursor.rowcount > 0
-            conn.close()
-            return success
+            with self.transaction() as cursor:
+                # تبدیل category کانال‌ها به NULL
+                cursor.execute('''
+                    UPDATE channels
+                    SET category = NULL
+                    WHERE category = ?
+                ''', (category,))
+                
+                # حذف از جدول categories
+                cursor.execute('DELETE FROM categories WHERE name = ?', (category,))
+                
+                return cursor.rowcount > 0
         except Exception as e:
             print(f"خطا در حذف دسته‌بندی: {e}")
-            conn.close()
             return False
     
     def get_channel_by_username(self, username: str) -> Optional[Dict]:
         """دریافت اطلاعات کانال با یوزرنیم یا invite link"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         # برای username معمولی، @ را حذف می‌کنیم
         # برای invite link، بدون تغییر استفاده می‌کنیم
         if username.startswith('http') or username.startswith('t.me/+') or username.startswith('+'):
@@ -569,217 +681,936 @@ class Database:
             # این یک username است، @ را حذف می‌کنیم
             search_username = username.lstrip('@')
         
-        cursor.execute('SELECT * FROM channels WHERE username = ?', (search_username,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute('SELECT * FROM channels WHERE username = ?', (search_username,))
+            row = cursor.fetchone()
         
         return dict(row) if row else None
     
     def get_channel_by_id(self, channel_id: int) -> Optional[Dict]:
         """دریافت اطلاعات کانال با ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM channels WHERE id = ?', (channel_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute('SELECT * FROM channels WHERE id = ?', (channel_id,))
+            row = cursor.fetchone()
         
         return dict(row) if row else None
     
+    LAST_STATS_SQL = '''
+        SELECT cs.* FROM channel_latest cl
+        JOIN channel_stats cs ON cs.id = cl.stats_id
+        WHERE cl.channel_id = ?
+    '''
+    # روز با کلید عددی day مقایسه می‌شود و ایندکس (channel_id, day, recorded_at) استفاده می‌شود
+    YESTERDAY_STATS_SQL = '''
+        SELECT cs.* FROM channel_latest cl
+        JOIN channel_stats t ON t.id = cl.stats_id
+        JOIN channel_stats cs ON cs.channel_id = cl.channel_id
+            AND cs.day = t.day - 1
+        WHERE cl.channel_id = ?
+        ORDER BY cs.recorded_at DESC, cs.id DESC
+        LIMIT 1
+    '''
+    FIRST_STATS_SQL = '''
+        SELECT * FROM channel_stats
+        WHERE channel_id = ?
+        ORDER BY recorded_at ASC, id ASC
+        LIMIT 1
+    '''
+    
     def get_last_stats(self, channel_id: int) -> Optional[Dict]:
-        """دریافت آخرین آمار ثبت شده برای یک کانال"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM channel_stats 
-            WHERE channel_id = ? 
-            ORDER BY recorded_at DESC 
-            LIMIT 1
-        ''', (channel_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        """دریافت آخرین آمار ثبت شده برای یک کانال (از طریق channel_latest)"""
+        with self.cursor() as cursor:
+            cursor.execute(self.LAST_STATS_SQL, (channel_id,))
+            
+            row = cursor.fetchone()
+        return decode_stats_row(row) if row else None
     
     def get_yesterday_stats(self, channel_id: int) -> Optional[Dict]:
-        """دریافت آمار دیروز برای یک کانال"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """دریافت آخرین آمار روز قبل از آخرین آمار ثبت شده یک کانال"""
+        with self.cursor() as cursor:
+            cursor.execute(self.YESTERDAY_STATS_SQL, (channel_id,))
+            
+            row = cursor.fetchone()
+        return decode_stats_row(row) if row else None
+    
+    def get_first_stats(self, channel_id: int) -> Optional[Dict]:
+        """دریافت اولین آمار ثبت شده برای یک کانال"""
+        with self.cursor() as cursor:
+            cursor.execute(self.FIRST_STATS_SQL, (channel_id,))
+            
+            row = cursor.fetchone()
+        return decode_stats_row(row) if row else None
+    
+    # ثبت یک نمونه آمار؛ تغییرات نسبت به آخرین رکورد همان کانال در خود SQL محاسبه می‌شود
+    # views_count/posts_count خالی (این دور دریافت نشده) همان مقدار نمونه قبلی را می‌گیرد
+    INSERT_STATS_SQL = '''
+        INSERT INTO channel_stats
+        (channel_id, recorded_at, day, member_count, views_count, posts_count,
+         member_change, views_change, posts_change, positive_change)
+        SELECT
+            s.channel_id, s.recorded_at, s.recorded_at / 86400,
+            s.member_count,
+            COALESCE(s.views_count, prev.views_count, 0),
+            COALESCE(s.posts_count, prev.posts_count, 0),
+            s.member_count - COALESCE(prev.member_count, 0),
+            COALESCE(s.views_count, prev.views_count, 0) - COALESCE(prev.views_count, 0),
+            COALESCE(s.posts_count, prev.posts_count, 0) - COALESCE(prev.posts_count, 0),
+            CASE WHEN s.member_count > COALESCE(prev.member_count, 0)
+                   OR COALESCE(s.views_count, prev.views_count, 0) > COALESCE(prev.views_count, 0)
+                 THEN 1 ELSE 0 END
+        FROM (SELECT ? AS channel_id, ? AS member_count, ? AS views_count, ? AS posts_count,
+                     CAST(strftime('%s', 'now') AS INTEGER) AS recorded_at) s
+        LEFT JOIN channel_latest pl ON pl.channel_id = s.channel_id
+        LEFT JOIN channel_stats prev ON prev.id = pl.stats_id
+    '''
+    
+    def add_stats(self, channel_id: int, member_count: int = 0, views_count: int = 0, 
+                  posts_count: int = 0) -> bool:
+        """افزودن آمار جدید برای کانال"""
+        return self.add_stats_bulk([(channel_id, member_count, views_count, posts_count)]) > 0
+    
+    def add_stats_bulk(self, samples: List[Tuple[int, int, int, int]]) -> int:
+        """ثبت گروهی آمار چند کانال در یک تراکنش (یک commit برای کل دسته)
         
-        # دریافت آخرین آمار امروز
-        cursor.execute('''
-            SELECT * FROM channel_stats 
-            WHERE channel_id = ? 
-            ORDER BY recorded_at DESC 
-            LIMIT 1
-        ''', (channel_id,))
+        Args:
+            samples: لیست (channel_id, member_count, views_count, posts_count)؛
+                views_count/posts_count برابر None یعنی مقدار نمونه قبلی تکرار شود
         
-        today_stat = cursor.fetchone()
-        if not today_stat:
-            conn.close()
-            return None
+        Returns:
+            تعداد رکوردهای ثبت شده (0 در صورت خطا)
+        """
+        if not samples:
+            return 0
         
-        today_stat = dict(today_stat)
-        today_date = today_stat['recorded_at']
+        rows = [
+            (channel_id, member_count or 0, views_count, posts_count)
+            for channel_id, member_count, views_count, posts_count in samples
+        ]
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany(self.INSERT_STATS_SQL, rows)
+            return len(rows)
+        except Exception as e:
+            print(f"خطا در ثبت آمار: {e}")
+            return 0
+    
+    RECENT_POSTS_SQL = '''
+        SELECT message_id, posted_at, views
+        FROM posts
+        WHERE channel_id = ?
+        ORDER BY message_id DESC
+        LIMIT ?
+    '''
+    
+    def get_recent_posts(self, channel_id: int, limit: int) -> List[Dict]:
+        """آخرین پست‌های ذخیره شده کانال (جدیدترین اول) برای به‌روزرسانی بازدیدها"""
+        with self.cursor() as cursor:
+            cursor.execute(self.RECENT_POSTS_SQL, (channel_id, limit))
+            
+            return [dict(row) for row in cursor.fetchall()]
+    
+    # ثبت بازدید یک پست و نمونه bucket سن آن در post_stats
+    UPSERT_POST_SQL = '''
+        INSERT INTO posts (channel_id, message_id, posted_at, views, updated_at, next_refresh_at)
+        VALUES (?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER), ?)
+        ON CONFLICT (channel_id, message_id) DO UPDATE SET
+            views = MAX(posts.views, excluded.views),
+            updated_at = excluded.updated_at,
+            next_refresh_at = excluded.next_refresh_at
+    '''
+    UPSERT_POST_STATS_SQL = '''
+        INSERT INTO post_stats (channel_id, message_id, bucket, views, recorded_at)
+        VALUES (?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT (channel_id, message_id, bucket) DO UPDATE SET
+            views = MAX(post_stats.views, excluded.views),
+            recorded_at = excluded.recorded_at
+    '''
+    
+    def _write_post_views(self, cursor, channel_id: int, posts: List[Tuple]):
+        """ثبت ردیف‌های (message_id, posted_at, views, bucket, next_refresh_at) یک کانال"""
+        cursor.executemany(self.UPSERT_POST_SQL, [
+            (channel_id, message_id, posted_at, views, next_refresh_at)
+            for message_id, posted_at, views, bucket, next_refresh_at in posts
+        ])
+        # bucket خالی یعنی بازدید تازه‌ای دریافت نشده و فقط زمان به‌روزرسانی بعدی تغییر می‌کند
+        cursor.executemany(self.UPSERT_POST_STATS_SQL, [
+            (channel_id, message_id, bucket, views)
+            for message_id, posted_at, views, bucket, next_refresh_at in posts
+            if bucket is not None
+        ])
+    
+    def save_channel_posts(self, updates: List[Tuple[int, int, List[Tuple]]], keep: int) -> int:
+        """ثبت پست‌ها و cursor پیام چند کانال در یک تراکنش - برمی‌گرداند تعداد کانال‌ها
         
-        # تبدیل تاریخ امروز به datetime
+        Args:
+            updates: لیست (channel_id, last_message_id, [(message_id, posted_at, views, bucket,
+                next_refresh_at), ...])
+            keep: تعداد آخرین پست‌هایی که برای هر کانال نگه داشته می‌شوند؛ پست‌های قدیمی‌تر
+                فقط تا پایان دنبال کردن بازدیدشان (next_refresh_at خالی) باقی می‌مانند
+        """
+        if not updates:
+            return 0
         try:
-            if isinstance(today_date, str):
-                today_dt = datetime.fromisoformat(today_date.replace('Z', '+00:00'))
-            else:
-                today_dt = today_date
-            yesterday_dt = today_dt - timedelta(days=1)
-            yesterday_date = yesterday_dt.strftime('%Y-%m-%d')
-        except:
-            conn.close()
-            return None
+            with self.transaction() as cursor:
+                for channel_id, last_message_id, posts in updates:
+                    self._write_post_views(cursor, channel_id, posts)
+                    cursor.execute('''
+                        DELETE FROM posts
+                        WHERE channel_id = ? AND next_refresh_at IS NULL AND message_id < (
+                            SELECT message_id FROM posts WHERE channel_id = ?
+                            ORDER BY message_id DESC LIMIT 1 OFFSET ?
+                        )
+                    ''', (channel_id, channel_id, max(1, keep) - 1))
+                    cursor.execute('''
+                        UPDATE channels SET last_message_id = ?
+                        WHERE id = ? AND last_message_id < ?
+                    ''', (last_message_id, channel_id, last_message_id))
+            return len(updates)
+        except Exception as e:
+            print(f"خطا در ثبت پست‌ها: {e}")
+            return 0
+    
+    def save_post_views(self, updates: List[Tuple[int, List[Tuple]]]) -> int:
+        """ثبت بازدید به‌روز شده پست‌های چند کانال در یک تراکنش - برمی‌گرداند تعداد پست‌ها
         
-        # دریافت آمار دیروز
-        cursor.execute('''
-            SELECT * FROM channel_stats 
-            WHERE channel_id = ? 
-            AND date(recorded_at) = date(?)
-            ORDER BY recorded_at DESC 
-            LIMIT 1
-        ''', (channel_id, yesterday_date))
+        Args:
+            updates: لیست (channel_id, [(message_id, posted_at, views, bucket, next_refresh_at), ...])
+        """
+        if not updates:
+            return 0
+        try:
+            with self.transaction() as cursor:
+                for channel_id, posts in updates:
+                    self._write_post_views(cursor, channel_id, posts)
+            return sum(len(posts) for _, posts in updates)
+        except Exception as e:
+            print(f"خطا در ثبت بازدید پست‌ها: {e}")
+            return 0
+    
+    # پست‌هایی که زمان به‌روزرسانی بازدیدشان رسیده، فقط برای کانال‌های حساب‌های داده شده
+    # (CROSS JOIN ترتیب را ثابت می‌کند تا posts به ترتیب idx_posts_next_refresh خوانده شود)
+    DUE_POSTS_SQL = '''
+        SELECT p.channel_id, p.message_id, p.posted_at, p.views, p.next_refresh_at,
+               c.username, c.telegram_id, c.access_hash, c.account
+        FROM posts p
+        CROSS JOIN channels c ON c.id = p.channel_id
+        WHERE p.next_refresh_at IS NOT NULL AND p.next_refresh_at <= ?
+          AND c.is_active = 1 AND c.is_member = 1 AND c.access_hash IS NOT NULL
+          AND COALESCE(c.account, ?) IN (SELECT value FROM json_each(?))
+        ORDER BY p.next_refresh_at
+        LIMIT ?
+    '''
+    
+    def get_due_posts(self, now: int, accounts: List[str], default_account: str, limit: int) -> List[Dict]:
+        """پست‌هایی که next_refresh_at آن‌ها رسیده (قدیمی‌ترین زمان اول)
         
-        row = cursor.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        Args:
+            accounts: فقط پست‌های کانال‌های این حساب‌ها (account خالی یعنی default_account)
+        """
+        with self.cursor() as cursor:
+            cursor.execute(self.DUE_POSTS_SQL, (int(now), default_account, json.dumps(accounts), limit))
+            return [dict(row) for row in cursor.fetchall()]
     
-    def get_first_stats(self, channel_id: int) -> Optional[Dict]:
-        """دریافت اولین آمار ثبت شده برای یک کانال"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def get_next_post_refresh_at(self, accounts: List[str], default_account: str) -> Optional[int]:
+        """نزدیک‌ترین زمان به‌روزرسانی بازدید پست‌های کانال‌های این حساب‌ها (None اگر پستی نیست)"""
+        rows = self.get_due_posts(2 ** 62, accounts, default_account, 1)
+        return rows[0]['next_refresh_at'] if rows else None
+    
+    # بازدید هر پست در سن hours ساعت با درون‌یابی خطی بین نزدیک‌ترین نمونه‌های قبل و بعد
+    # (فقط نمونه‌های کانال‌های channel_ids که بعد از since ثبت شده‌اند از کلید اصلی خوانده می‌شوند؛
+    # نمونه پست‌هایی که بعد از since منتشر شده‌اند همه بعد از since ثبت شده‌اند)
+    VIEWS_AFTER_HOURS_SQL = '''
+        WITH spans AS (
+            SELECT channel_id, message_id,
+                   MAX(CASE WHEN bucket <= :hours THEN bucket END) AS lo,
+                   MIN(CASE WHEN bucket >= :hours THEN bucket END) AS hi,
+                   MIN(recorded_at - bucket * 3600) AS posted_at
+            FROM post_stats
+            WHERE channel_id IN (SELECT value FROM json_each(:channel_ids))
+                AND recorded_at >= :since
+            GROUP BY channel_id, message_id
+            HAVING lo IS NOT NULL AND hi IS NOT NULL AND posted_at >= :since
+        )
+        SELECT s.channel_id, s.message_id, s.posted_at,
+               CASE WHEN s.lo = s.hi THEN h.views
+                    ELSE CAST(ROUND(l.views + (h.views - l.views) * (:hours - s.lo) * 1.0 / (s.hi - s.lo))
+                              AS INTEGER)
+               END AS views
+        FROM spans s
+        JOIN post_stats l ON l.channel_id = s.channel_id AND l.message_id = s.message_id AND l.bucket = s.lo
+        JOIN post_stats h ON h.channel_id = s.channel_id AND h.message_id = s.message_id AND h.bucket = s.hi
+    '''
+    
+    def get_post_views_after_hours(self, channel_id: int, hours: int, limit: int = 50) -> List[Dict]:
+        """بازدید آخرین پست‌های کانال در hours ساعت بعد از انتشار (جدیدترین اول)
         
-        cursor.execute('''
-            SELECT * FROM channel_stats 
-            WHERE channel_id = ? 
-            ORDER BY recorded_at ASC 
-            LIMIT 1
-        ''', (channel_id,))
+        فقط پست‌هایی برگردانده می‌شوند که نمونه‌ای قبل و بعد از hours ساعت دارند.
         
-        row = cursor.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        Returns:
+            لیست {'message_id', 'posted_at', 'views'}
+        """
+        with self.cursor() as cursor:
+            cursor.execute(f'''
+                SELECT message_id, posted_at, views
+                FROM ({self.VIEWS_AFTER_HOURS_SQL})
+                ORDER BY message_id DESC
+                LIMIT :limit
+            ''', {'channel_ids': json.dumps([channel_id]), 'hours': hours, 'since': 0, 'limit': limit})
+            return [dict(row) for row in cursor.fetchall()]
     
-    def add_stats(self, channel_id: int, member_count: int = 0, views_count: int = 0, 
-                  posts_count: int = 0) -> bool:
-        """افزودن آمار جدید برای کانال"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def get_views_after_hours(self, hours: int, channel_ids: List[int], days: int = 30) -> Dict[int, Dict]:
+        """میانگین بازدید پست‌های هر کانال در hours ساعت بعد از انتشار
+        
+        Args:
+            channel_ids: کانال‌هایی که میانگینشان لازم است
+            days: فقط پست‌هایی که در این تعداد روز اخیر منتشر شده‌اند
         
-        # دریافت آخرین آمار
-        last_stats = self.get_last_stats(channel_id)
+        Returns:
+            {channel_id: {'posts', 'avg_views', 'min_views', 'max_views'}}
+        """
+        if not channel_ids:
+            return {}
+        since = to_epoch(datetime.utcnow() - timedelta(days=days))
+        with self.cursor() as cursor:
+            cursor.execute(f'''
+                SELECT channel_id,
+                       COUNT(*) AS posts,
+                       CAST(ROUND(AVG(views)) AS INTEGER) AS avg_views,
+                       MIN(views) AS min_views,
+                       MAX(views) AS max_views
+                FROM ({self.VIEWS_AFTER_HOURS_SQL})
+                GROUP BY channel_id
+            ''', {'channel_ids': json.dumps(list(channel_ids)), 'hours': hours, 'since': since})
+            return {row['channel_id']: dict(row) for row in cursor.fetchall()}
+    
+    def get_all_stats(self, channel_id: int = None, limit: int = 100) -> List[Dict]:
+        """دریافت آمار کانال‌ها"""
+        with self.cursor() as cursor:
+            if channel_id:
+                cursor.execute('''
+                    SELECT
+                        c.id,
+                        c.username,
+                        c.title,
+                        cs.recorded_at,
+                        cs.member_count,
+                        cs.views_count,
+                        cs.member_change,
+                        cs.views_change,
+                        cs.positive_change
+                    FROM channel_stats cs
+                    JOIN channels c ON cs.channel_id = c.id
+                    WHERE c.id = ? AND c.is_active = 1
+                    ORDER BY cs.recorded_at DESC
+                    LIMIT ?
+                ''', (channel_id, limit))
+            else:
+                # آخرین آمار هر کانال
+                cursor.execute('''
+                    SELECT
+                        c.id,
+                        c.username,
+                        c.title,
+                        c.category,
+                        c.telegram_id,
+                        c.previous_telegram_id,
+                        cs.recorded_at,
+                        COALESCE(cs.member_count, 0) as member_count,
+                        COALESCE(cs.views_count, 0) as views_count,
+                        COALESCE(cs.member_change, 0) as member_change,
+                        COALESCE(cs.views_change, 0) as views_change,
+                        COALESCE(cs.positive_change, 0) as positive_change
+                    FROM channels c
+                    LEFT JOIN channel_latest cl ON cl.channel_id = c.id
+                    LEFT JOIN channel_stats cs ON cs.id = cl.stats_id
+                    WHERE c.is_active = 1
+                    ORDER BY COALESCE(c.category, ''),
+                             COALESCE(cs.recorded_at, CAST(strftime('%s', c.added_at) AS INTEGER)) DESC
+                ''')
+            
+            return [decode_stats_row(row) for row in cursor.fetchall()]
+    
+    def get_stats_with_baselines(self, category: str = None, views_hours: int = 24) -> List[Dict]:
+        """آخرین آمار همه کانال‌های فعال (یا یک دسته‌بندی) همراه با تعداد اعضای دیروز و روز اول
         
-        # محاسبه تغییرات
-        member_change = member_count - (last_stats['member_count'] if last_stats else 0)
-        views_change = views_count - (last_stats['views_count'] if last_stats else 0)
-        posts_change = posts_count - (last_stats['posts_count'] if last_stats else 0)
-        positive_change = 1 if member_change > 0 or views_change > 0 else 0
+        همه چیز در یک پرس‌وجو محاسبه می‌شود: آخرین آمار از channel_latest و مبناهای
+        دیروز (close روز قبل از آخرین آمار) و روز اول (open اولین روز) از خلاصه
+        روزانه channel_daily، که بعد از downsample شدن نمونه‌های خام هم معتبر می‌مانند.
+        خروجی همان ستون‌های get_all_stats به اضافه yesterday_member_count و
+        first_member_count است (None اگر وجود نداشته باشد)؛ recorded_at یک datetime (UTC) است.
+        avg_views_after_hours و views_after_hours_posts میانگین بازدید پست‌های ۳۰ روز اخیر
+        کانال در views_hours ساعت بعد از انتشار و تعداد آن پست‌ها هستند (None و 0 اگر پستی نیست).
+        """
+        with self.cursor() as cursor:
+            cursor.execute('''
+                WITH latest AS (
+                    SELECT
+                        c.id,
+                        c.username,
+                        c.title,
+                        c.category,
+                        c.telegram_id,
+                        c.previous_telegram_id,
+                        c.added_at,
+                        cs.recorded_at,
+                        cs.day,
+                        COALESCE(cs.member_count, 0) as member_count,
+                        COALESCE(cs.views_count, 0) as views_count,
+                        COALESCE(cs.member_change, 0) as member_change,
+                        COALESCE(cs.views_change, 0) as views_change,
+                        COALESCE(cs.positive_change, 0) as positive_change
+                    FROM channels c
+                    LEFT JOIN channel_latest cl ON cl.channel_id = c.id
+                    LEFT JOIN channel_stats cs ON cs.id = cl.stats_id
+                    WHERE c.is_active = 1
+                    AND (:category IS NULL OR c.category = :category)
+                )
+                SELECT
+                    l.id,
+                    l.username,
+                    l.title,
+                    l.category,
+                    l.telegram_id,
+                    l.previous_telegram_id,
+                    l.recorded_at,
+                    l.member_count,
+                    l.views_count,
+                    l.member_change,
+                    l.views_change,
+                    l.positive_change,
+                    y.close_count as yesterday_member_count,
+                    (
+                        SELECT f.open_count FROM channel_daily f
+                        WHERE f.channel_id = l.id
+                        ORDER BY f.day ASC
+                        LIMIT 1
+                    ) as first_member_count
+                FROM latest l
+                LEFT JOIN channel_daily y ON y.channel_id = l.id
+                    AND y.day = l.day - 1
+                ORDER BY COALESCE(l.category, ''),
+                         COALESCE(l.recorded_at, CAST(strftime('%s', l.added_at) AS INTEGER)) DESC
+            ''', {'category': category})
+            stats = [decode_stats_row(row) for row in cursor.fetchall()]
         
+        views = self.get_views_after_hours(views_hours, [stat['id'] for stat in stats])
+        for stat in stats:
+            channel_views = views.get(stat['id']) or {}
+            stat['avg_views_after_hours'] = channel_views.get('avg_views')
+            stat['views_after_hours_posts'] = channel_views.get('posts', 0)
+        return stats
+    
+    def enqueue_command(self, command: str, payload: Dict = None) -> Optional[int]:
+        """افزودن دستور به صف commands - برمی‌گرداند id دستور (None در صورت خطا)"""
         try:
+            with self.transaction() as cursor:
+                cursor.execute(
+                    'INSERT INTO commands (command, payload) VALUES (?, ?)',
+                    (command, json.dumps(payload or {}, ensure_ascii=False))
+                )
+                return cursor.lastrowid
+        except Exception as e:
+            print(f"خطا در ثبت دستور {command}: {e}")
+            return None
+    
+    def claim_next_command(self, accounts: List[str] = None, coordinator: bool = True,
+                           worker_id: str = None) -> Optional[Dict]:
+        """برداشتن قدیمی‌ترین دستور در انتظار (FIFO) و علامت‌گذاری آن به عنوان running
+        
+        Args:
+            accounts: اگر داده شود فقط دستوراتی برداشته می‌شوند که account آن‌ها در این لیست
+                است، یا account ندارند و coordinator=True است
+        """
+        with self.transaction() as cursor:
+            if accounts is None:
+                cursor.execute('''
+                    SELECT id, command, payload, created_at FROM commands
+                    WHERE status = 'pending'
+                    ORDER BY id
+                    LIMIT 1
+                ''')
+            else:
+                cursor.execute('''
+                    SELECT id, command, payload, created_at FROM commands
+                    WHERE status = 'pending'
+                      AND CASE WHEN json_extract(payload, '$.account') IS NULL THEN ?
+                               ELSE json_extract(payload, '$.account') IN (SELECT value FROM json_each(?))
+                          END
+                    ORDER BY id
+                    LIMIT 1
+                ''', (1 if coordinator else 0, json.dumps(accounts)))
+            row = cursor.fetchone()
+            if not row:
+                return None
             cursor.execute('''
-                INSERT INTO channel_stats 
-                (channel_id, member_count, views_count, posts_count, 
-                 member_change, views_change, posts_change, positive_change)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (channel_id, member_count, views_count, posts_count,
-                  member_change, views_change, posts_change, positive_change))
-            
-            conn.commit()
-            conn.close()
+                UPDATE commands
+                SET status = 'running', started_at = CAST(strftime('%s', 'now') AS INTEGER), worker_id = ?
+                WHERE id = ?
+            ''', (worker_id, row['id']))
+        command = dict(row)
+        command['payload'] = json.loads(command['payload'] or '{}')
+        return command
+    
+    def finish_command(self, command_id: int, success: bool):
+        """ثبت پایان اجرای دستور (done یا failed)"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE commands
+                SET status = ?, finished_at = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE id = ?
+            ''', ('done' if success else 'failed', command_id))
+    
+    def requeue_running_commands(self, worker_id: str = None) -> int:
+        """برگرداندن دستورات نیمه‌کاره به صف - برمی‌گرداند تعداد
+        
+        دستوراتی برمی‌گردند که worker آن‌ها دیگر lease زنده (worker:<id>) ندارد، یا
+        worker_id آن‌ها همین worker است (دستورات اجرای قبلی همین worker بعد از ری‌استارت).
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE commands SET status = 'pending', started_at = NULL, worker_id = NULL
+                WHERE status = 'running'
+                  AND (worker_id IS NULL OR worker_id = ? OR worker_id NOT IN (
+                      SELECT worker_id FROM worker_leases
+                      WHERE name = 'worker:' || worker_id
+                        AND expires_at >= CAST(strftime('%s', 'now') AS INTEGER)
+                  ))
+            ''', (worker_id,))
+            return cursor.rowcount
+    
+    def acquire_lease(self, name: str, worker_id: str, ttl: int) -> bool:
+        """گرفتن یا تمدید lease تا ttl ثانیه بعد - برمی‌گرداند True اگر lease در اختیار worker_id است
+        
+        lease فقط وقتی به worker دیگر می‌رسد که منقضی شده باشد.
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO worker_leases (name, worker_id, acquired_at, expires_at)
+                VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER) + ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    worker_id = excluded.worker_id,
+                    acquired_at = CASE WHEN worker_leases.worker_id = excluded.worker_id
+                                       THEN worker_leases.acquired_at ELSE excluded.acquired_at END,
+                    expires_at = excluded.expires_at
+                WHERE worker_leases.worker_id = excluded.worker_id
+                   OR worker_leases.expires_at < excluded.acquired_at
+            ''', (name, worker_id, ttl))
+            cursor.execute('SELECT worker_id FROM worker_leases WHERE name = ?', (name,))
+            row = cursor.fetchone()
+            return bool(row) and row['worker_id'] == worker_id
+    
+    def release_lease(self, name: str, worker_id: str):
+        """آزاد کردن lease (فقط اگر در اختیار worker_id باشد)"""
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM worker_leases WHERE name = ? AND worker_id = ?', (name, worker_id))
+    
+    def get_leases(self, prefix: str = '') -> List[Dict]:
+        """lease‌های معتبر (منقضی نشده) که نامشان با prefix شروع می‌شود"""
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT name, worker_id, acquired_at, expires_at FROM worker_leases
+                WHERE substr(name, 1, length(?)) = ?
+                  AND expires_at >= CAST(strftime('%s', 'now') AS INTEGER)
+                ORDER BY name
+            ''', (prefix, prefix))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def add_notification(self, user_id: int, kind: str, payload: Dict = None) -> Optional[int]:
+        """افزودن اطلاع‌رسانی به صندوق خروجی - برمی‌گرداند id (None در صورت خطا)"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(
+                    'INSERT INTO notifications (user_id, kind, payload) VALUES (?, ?, ?)',
+                    (user_id, kind, json.dumps(payload or {}, ensure_ascii=False))
+                )
+                return cursor.lastrowid
+        except Exception as e:
+            print(f"خطا در ثبت notification برای {user_id}: {e}")
+            return None
+    
+    def get_pending_notifications(self, limit: int = 50) -> List[Dict]:
+        """اطلاع‌رسانی‌های تحویل نشده به ترتیب ثبت"""
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT id, user_id, kind, payload, attempts, created_at FROM notifications
+                WHERE status = 'pending'
+                ORDER BY id
+                LIMIT ?
+            ''', (limit,))
+            notifications = []
+            for row in cursor.fetchall():
+                notification = dict(row)
+                notification['payload'] = json.loads(notification['payload'] or '{}')
+                notifications.append(notification)
+            return notifications
+    
+    def mark_notification_delivered(self, notification_id: int):
+        """ثبت تحویل موفق اطلاع‌رسانی"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE notifications
+                SET status = 'delivered', delivered_at = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE id = ?
+            ''', (notification_id,))
+    
+    def mark_notification_failed(self, notification_id: int, max_attempts: int) -> bool:
+        """ثبت تلاش ناموفق؛ بعد از max_attempts تلاش کنار گذاشته می‌شود - برمی‌گرداند True اگر کنار گذاشته شد"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE notifications
+                SET attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+                WHERE id = ?
+            ''', (max_attempts, notification_id))
+            cursor.execute('SELECT status FROM notifications WHERE id = ?', (notification_id,))
+            row = cursor.fetchone()
+            return bool(row) and row['status'] == 'failed'
+    
+    def get_invite_cache(self, invite_hash: str, account: str) -> Optional[Dict]:
+        """نتیجه معتبر (منقضی نشده) کش لینک invite برای حساب (None اگر نباشد)"""
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT status, chat_id, access_hash, checked_at, expires_at
+                FROM invite_cache
+                WHERE invite_hash = ? AND account = ?
+                  AND expires_at > CAST(strftime('%s', 'now') AS INTEGER)
+            ''', (invite_hash, account))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    def set_invite_cache(self, invite_hash: str, account: str, status: str, chat_id: int = None,
+                         access_hash: int = None, ttl: int = 86400):
+        """ثبت نتیجه CheckChatInviteRequest برای ttl ثانیه"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO invite_cache
+                    (invite_hash, account, status, chat_id, access_hash, checked_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER),
+                            CAST(strftime('%s', 'now') AS INTEGER) + ?)
+                ''', (invite_hash, account, status, chat_id, access_hash, int(ttl)))
+        except Exception as e:
+            print(f"خطا در ثبت کش invite: {e}")
+    
+    def forget_invite_chat(self, chat_id: int, account: str):
+        """حذف نتیجه‌های کش شده کانال chat_id برای حساب (بعد از خروج یا peer نامعتبر)"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('DELETE FROM invite_cache WHERE chat_id = ? AND account = ?', (chat_id, account))
+        except Exception as e:
+            print(f"خطا در حذف کش invite: {e}")
+    
+    def get_channel_failure_attempts(self, channel_id: int) -> int:
+        """تعداد شکست‌های پشت سر هم ثبت شده برای کانال (0 اگر شکستی ثبت نشده)"""
+        with self.cursor() as cursor:
+            cursor.execute('SELECT attempts FROM channel_failures WHERE channel_id = ?', (channel_id,))
+            row = cursor.fetchone()
+            return row['attempts'] if row else 0
+    
+    def record_channel_failure(self, channel_id: int, operation: str, failure: str, error: str,
+                               attempts: int, next_retry_at: int, quarantined: bool, now: float) -> bool:
+        """ثبت شکست join یا دریافت آمار کانال و زمان تلاش بعدی
+        
+        Args:
+            operation: 'join' یا 'stats'
+            failure: دسته خطا (channel_failures.classify_error)
+            attempts: تعداد شکست‌های پشت سر هم با احتساب همین شکست
+            next_retry_at: زمان تلاش بعدی (epoch ثانیه)
+            quarantined: کانال قرنطینه است
+        """
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO channel_failures
+                    (channel_id, operation, failure, error, attempts, first_failed_at, last_failed_at,
+                     next_retry_at, quarantined)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(channel_id) DO UPDATE SET
+                        operation = excluded.operation,
+                        failure = excluded.failure,
+                        error = excluded.error,
+                        attempts = excluded.attempts,
+                        last_failed_at = excluded.last_failed_at,
+                        next_retry_at = excluded.next_retry_at,
+                        quarantined = excluded.quarantined
+                ''', (channel_id, operation, failure, (error or '')[:500], attempts, int(now), int(now),
+                      int(next_retry_at), 1 if quarantined else 0))
             return True
         except Exception as e:
-            print(f"خطا در ثبت آمار: {e}")
-            conn.close()
+            print(f"خطا در ثبت شکست کانال: {e}")
             return False
     
-    def get_all_stats(self, channel_id: int = None, limit: int = 100) -> List[Dict]:
-        """دریافت آمار کانال‌ها"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def clear_channel_failures(self, channel_ids: List[int]) -> int:
+        """پاک کردن وضعیت شکست کانال‌هایی که آمارشان با موفقیت ثبت شد"""
+        if not channel_ids:
+            return 0
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany('DELETE FROM channel_failures WHERE channel_id = ?',
+                                   [(channel_id,) for channel_id in channel_ids])
+                return cursor.rowcount
+        except Exception as e:
+            print(f"خطا در پاک کردن شکست کانال‌ها: {e}")
+            return 0
+    
+    def get_open_monitor_cycle(self, account: str, since: int) -> Optional[Dict]:
+        """آخرین دور بررسی کامل نیمه‌کاره حساب که بعد از since (epoch ثانیه) شروع شده است"""
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT id, account, worker_id, started_at, updated_at, total, done, cursor
+                FROM monitor_cycles
+                WHERE account = ? AND finished_at IS NULL AND started_at >= ?
+                ORDER BY started_at DESC
+                LIMIT 1
+            ''', (account, since))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    def start_monitor_cycle(self, account: str, worker_id: str, total: int) -> Optional[Dict]:
+        """شروع دور بررسی کامل جدید برای حساب (دورهای نیمه‌کاره قبلی بسته می‌شوند)"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    UPDATE monitor_cycles SET finished_at = CAST(strftime('%s', 'now') AS INTEGER)
+                    WHERE account = ? AND finished_at IS NULL
+                ''', (account,))
+                cursor.execute('''
+                    INSERT INTO monitor_cycles (account, worker_id, started_at, updated_at, total)
+                    VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER),
+                            CAST(strftime('%s', 'now') AS INTEGER), ?)
+                ''', (account, worker_id, total))
+                cursor.execute('''
+                    SELECT id, account, worker_id, started_at, updated_at, total, done, cursor
+                    FROM monitor_cycles WHERE id = ?
+                ''', (cursor.lastrowid,))
+                return dict(cursor.fetchone())
+        except Exception as e:
+            print(f"خطا در شروع دور بررسی: {e}")
+            return None
+    
+    def checkpoint_monitor_cycles(self, checkpoints: List[Tuple[int, str, int, int]], finished: bool = False):
+        """ذخیره پیشرفت دورها: لیست (cycle_id, worker_id, done, cursor) در یک تراکنش
         
-        if channel_id:
+        Args:
+            finished: دورها تمام شده‌اند (finished_at ثبت می‌شود)
+        """
+        if not checkpoints:
+            return
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany('''
+                    UPDATE monitor_cycles
+                    SET worker_id = ?, done = ?, cursor = ?,
+                        updated_at = CAST(strftime('%s', 'now') AS INTEGER),
+                        finished_at = CASE WHEN ? THEN CAST(strftime('%s', 'now') AS INTEGER) END
+                    WHERE id = ?
+                ''', [(worker_id, done, cursor_id, int(finished), cycle_id)
+                      for cycle_id, worker_id, done, cursor_id in checkpoints])
+        except Exception as e:
+            print(f"خطا در ذخیره پیشرفت دور بررسی: {e}")
+    
+    def get_channels_sampled_since(self, since: int) -> set:
+        """شناسه کانال‌هایی که آخرین آمارشان بعد از since (epoch ثانیه) ثبت شده است"""
+        with self.cursor() as cursor:
+            cursor.execute('SELECT channel_id FROM channel_latest WHERE recorded_at >= ?', (since,))
+            return {row['channel_id'] for row in cursor.fetchall()}
+    
+    def get_daily_stats(self, channel_id: int, days: int = 30) -> List[Dict]:
+        """خلاصه روزانه یک کانال (جدیدترین روز اول)"""
+        with self.cursor() as cursor:
             cursor.execute('''
-                SELECT 
-                    c.id,
-                    c.username,
-                    c.title,
-                    cs.recorded_at,
-                    cs.member_count,
-                    cs.views_count,
-                    cs.member_change,
-                    cs.views_change,
-                    cs.positive_change
-                FROM channel_stats cs
-                JOIN channels c ON cs.channel_id = c.id
-                WHERE c.id = ? AND c.is_active = 1
-                ORDER BY cs.recorded_at DESC
+                SELECT channel_id, day, open_count, close_count, min_count, max_count,
+                       samples, first_at, last_at
+                FROM channel_daily
+                WHERE channel_id = ?
+                ORDER BY day DESC
                 LIMIT ?
-            ''', (channel_id, limit))
-        else:
-            # آخرین آمار هر کانال
-            cursor.execute('''
-                SELECT 
-                    c.id,
-                    c.username,
-                    c.title,
-                    c.category,
-                    c.telegram_id,
-                    c.previous_telegram_id,
-                    cs.recorded_at,
-                    COALESCE(cs.member_count, 0) as member_count,
-                    COALESCE(cs.views_count, 0) as views_count,
-                    COALESCE(cs.member_change, 0) as member_change,
-                    COALESCE(cs.views_change, 0) as views_change,
-                    COALESCE(cs.positive_change, 0) as positive_change
-                FROM channels c
-                LEFT JOIN (
-                    SELECT 
-                        channel_id,
-                        MAX(recorded_at) as max_date
-                    FROM channel_stats
-                    GROUP BY channel_id
-                ) latest ON c.id = latest.channel_id
-                LEFT JOIN channel_stats cs ON cs.channel_id = c.id 
-                    AND cs.recorded_at = latest.max_date
-                WHERE c.is_active = 1
-                ORDER BY COALESCE(c.category, ''), COALESCE(cs.recorded_at, c.added_at) DESC
-            ''')
+            ''', (channel_id, days))
+            
+            return [decode_stats_row(row) for row in cursor.fetchall()]
+    
+    # نمونه‌های خام قدیمی‌تر از cutoff به جز آخرین نمونه هر کانال (LIMIT برای حذف دسته‌ای)
+    # پیمایش به ازای هر کانال تا ایندکس (channel_id, recorded_at) استفاده شود
+    DOWNSAMPLE_RAW_STATS_SQL = '''
+        DELETE FROM channel_stats
+        WHERE id IN (
+            SELECT cs.id
+            FROM channel_latest cl
+            JOIN channel_stats cs ON cs.channel_id = cl.channel_id
+                AND cs.recorded_at < ?
+            WHERE cs.id != cl.stats_id
+            LIMIT ?
+        )
+    '''
+    
+    def downsample_raw_stats(self, keep_days: int, batch_size: int = 5000) -> int:
+        """حذف نمونه‌های خام قدیمی‌تر از keep_days روز (خلاصه روزانه آن‌ها باقی می‌ماند)
         
-        stats = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return stats
+        آخرین نمونه هر کانال هرگز حذف نمی‌شود. حذف در دسته‌های کوچک و هر دسته در
+        تراکنش جداگانه انجام می‌شود تا قفل نوشتن مدت طولانی نگه داشته نشود.
+        حداقل 2 روز نگه داشته می‌شود تا محاسبه تغییرات دیروز خراب نشود.
+        
+        Returns:
+            تعداد رکوردهای حذف شده
+        """
+        keep_days = max(int(keep_days), 2)
+        cutoff = to_epoch(datetime.utcnow() - timedelta(days=keep_days))
+        
+        return self.delete_in_batches(self.DOWNSAMPLE_RAW_STATS_SQL, (cutoff,), batch_size)
     
-    def add_admin(self, user_id: int, username: str = "") -> bool:
-        """افزودن ادمین"""
+    def delete_in_batches(self, sql: str, params: tuple = (), batch_size: int = 5000,
+                          max_batches: int = None) -> int:
+        """اجرای یک DELETE محدود (آخرین پارامتر آن LIMIT است) در دسته‌های جداگانه
+        
+        هر دسته در تراکنش خودش اجرا می‌شود تا قفل نوشتن بین دسته‌ها آزاد شود.
+        
+        Returns:
+            تعداد کل رکوردهای حذف شده
+        """
+        removed = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            with self.transaction() as cursor:
+                cursor.execute(sql, tuple(params) + (batch_size,))
+                deleted = cursor.rowcount
+            removed += deleted
+            batches += 1
+            if deleted < batch_size:
+                break
+        return removed
+    
+    def get_vacuum_status(self) -> Dict:
+        """وضعیت auto_vacuum و صفحات آزاد فایل دیتابیس"""
         conn = self.get_connection()
-        cursor = conn.cursor()
+        return {
+            'auto_vacuum': conn.execute('PRAGMA auto_vacuum').fetchone()[0],
+            'page_size': conn.execute('PRAGMA page_size').fetchone()[0],
+            'page_count': conn.execute('PRAGMA page_count').fetchone()[0],
+            'freelist_count': conn.execute('PRAGMA freelist_count').fetchone()[0],
+        }
+    
+    def incremental_vacuum(self, max_pages: int) -> int:
+        """آزاد کردن حداکثر max_pages صفحه خالی از انتهای فایل (فقط در حالت INCREMENTAL)
+        
+        Returns:
+            تعداد صفحات آزاد شده
+        """
+        conn = self.get_connection()
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if before == 0:
+            return 0
+        # execute فقط یک گام از pragma را اجرا می‌کند (یک صفحه)؛ executescript تا انتها اجرا می‌کند
+        conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)});')
+        after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return before - after
+    
+    def enable_incremental_vacuum(self):
+        """تغییر دیتابیس موجود به auto_vacuum=INCREMENTAL (نیاز به VACUUM کامل و یک‌باره دارد)"""
+        conn = self.get_connection()
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    
+    def rebuild_channel_latest(self) -> int:
+        """بازسازی جدول channel_latest از کل تاریخچه (برای دیتابیس‌های قدیمی یا ناسازگار)
         
+        Returns:
+            تعداد کانال‌هایی که آخرین آمارشان ثبت شد
+        """
+        with self.transaction() as cursor:
+            return rebuild_channel_latest(cursor)
+    
+    def add_admin(self, user_id: int, username: str = "") -> bool:
+        """افزودن ادمین"""
         try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO admins (user_id, username)
-                VALUES (?, ?)
-            ''', (user_id, username))
-            
-            conn.commit()
-            success = cursor.rowcount > 0
-            conn.close()
-            return success
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO admins (user_id, username)
+                    VALUES (?, ?)
+                ''', (user_id, username))
+                
+                return cursor.rowcount > 0
         except Exception as e:
             print(f"خطا در افزودن ادمین: {e}")
-            conn.close()
             return False
     
     def is_admin(self, user_id: int) -> bool:
         """بررسی ادمین بودن کاربر"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM admins WHERE user_id = ?', (user_id,))
+            return cursor.fetchone() is not None
+
+
+class AsyncDatabase:
+    """نسخه async از Database برای سرویس‌های asyncio (ربات رصد و ربات مدیریتی)
+    
+    همه فراخوانی‌ها روی یک thread اختصاصی دیتابیس اجرا می‌شوند تا event loop
+    (keepalive تلگرام و سایر آپدیت‌ها) منتظر پرس‌وجو یا commit نماند. هر متد
+    Database به صورت awaitable در دسترس است: await adb.get_active_channels()
+    
+    thread اختصاصی اتصال ماندگار خودش را از ConnectionManager می‌گیرد و چون
+    فقط یک thread است، نوشتن‌ها به ترتیب ارسال اجرا می‌شوند.
+    """
+    
+    def __init__(self, db: 'Database' = None, max_workers: int = 1):
+        self.db = db or Database()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+    
+    async def call(self, func, *args, **kwargs):
+        """اجرای یک تابع دلخواه (مثلاً چند فراخوانی پشت سر هم) روی thread دیتابیس"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+    
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
         
-        cursor.execute('SELECT 1 FROM admins WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone() is not None
-        conn.close()
-        return result
+        async def wrapper(*args, **kwargs):
+            return await self.call(attr, *args, **kwargs)
+        
+        wrapper.__name__ = name
+        wrapper.__doc__ = attr.__doc__
+        return wrapper
+    
+    async def close(self):
+        """بستن اتصال thread دیتابیس و توقف executor"""
+        await self.call(self.db.close)
+        self._executor.shutdown(wait=True)
+
+
+def main():
+    """دستورات نگهداری دیتابیس از خط فرمان"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='ابزار نگهداری دیتابیس theleton')
+    parser.add_argument('command', choices=['migrate', 'rebuild-latest', 'check-plans', 'downsample'],
+                        help='migrate: اجرای مهاجرت‌ها، rebuild-latest: بازسازی channel_latest، '
+                             'check-plans: بررسی استفاده پرس‌وجوها از ایندکس، '
+                             'downsample: حذف نمونه‌های خام قدیمی (خلاصه روزانه حفظ می‌شود)')
+    parser.add_argument('--db', default='theleton.db', help='مسیر فایل دیتابیس')
+    parser.add_argument('--days', type=int, default=30, help='تعداد روزهای نگهداری نمونه‌های خام (downsample)')
+    args = parser.parse_args()
+    
+    # سازنده Database مهاجرت‌های معوق را اجرا می‌کند
+    db = Database(args.db)
+    
+    if args.command == 'migrate':
+        print(f"✅ نسخه schema: {db.get_schema_version()}")
+    elif args.command == 'rebuild-latest':
+        count = db.rebuild_channel_latest()
+        print(f"✅ آخرین آمار {count} کانال بازسازی شد")
+    elif args.command == 'check-plans':
+        problems = db.check_query_plans()
+        if not problems:
+            print("✅ همه پرس‌وجوهای پرتکرار از ایندکس استفاده می‌کنند")
+        for name, plan in problems.items():
+            print(f"⚠️ {name}: {plan}")
+    elif args.command == 'downsample':
+        removed = db.downsample_raw_stats(args.days)
+        print(f"✅ {removed} نمونه خام قدیمی‌تر از {args.days} روز حذف شد")
+    
+    db.close()
+
 
+if __name__ == "__main__":
+    main()
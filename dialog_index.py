@@ -0,0 +1,103 @@
+"""
+نمایه گفتگوهای (dialogs) یک حساب تلگرام بر اساس telegram_id و username
+
+به جای پیمایش کامل client.iter_dialogs() برای هر خروج یا join، لیست گفتگوها یک‌بار
+دریافت و در حافظه نگه داشته می‌شود. نمایه با join و leave خود ربات و با
+به‌روزرسانی‌های UpdateChannel تلگرام به‌روز می‌ماند و فقط وقتی کهنه‌تر از
+dialog_index_refresh ثانیه باشد (و کانالی در آن پیدا نشود) دوباره ساخته می‌شود.
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+from telethon import events
+from telethon.tl.types import UpdateChannel, PeerChannel, ChannelForbidden
+
+
+class DialogIndex:
+    """entity کانال‌ها و گروه‌هایی که حساب عضو آن‌هاست (با access_hash معتبر همان حساب)"""
+    
+    def __init__(self, refresh_interval: float = 6 * 3600):
+        self.refresh_interval = float(refresh_interval)
+        self.by_id: Dict[int, object] = {}
+        self.by_username: Dict[str, object] = {}
+        self.built_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._client = None
+        self._limiter = None
+    
+    def __len__(self):
+        return len(self.by_id)
+    
+    @property
+    def is_stale(self) -> bool:
+        """آیا نمایه هنوز ساخته نشده یا کهنه است"""
+        return self.built_at is None or time.monotonic() - self.built_at >= self.refresh_interval
+    
+    @staticmethod
+    def normalize_username(username: str) -> Optional[str]:
+        """username بدون @ و با حروف کوچک (None برای لینک‌ها و شناسه‌های private_)"""
+        if not username or username.startswith(('http', '+', 't.me/', 'private_')):
+            return None
+        return username.lstrip('@').lower()
+    
+    def add(self, entity):
+        """افزودن یا جایگزینی entity در نمایه"""
+        telegram_id = getattr(entity, 'id', None)
+        if telegram_id is None:
+            return
+        self.remove(telegram_id)
+        self.by_id[telegram_id] = entity
+        usernames = [getattr(entity, 'username', None)]
+        usernames += [getattr(u, 'username', None) for u in getattr(entity, 'usernames', None) or []]
+        for username in usernames:
+            if username:
+                self.by_username[username.lower()] = entity
+    
+    def remove(self, telegram_id: int):
+        """حذف entity (مثلاً بعد از خروج از کانال)"""
+        entity = self.by_id.pop(telegram_id, None)
+        if entity is not None:
+            for username, indexed in list(self.by_username.items()):
+                if indexed is entity:
+                    del self.by_username[username]
+    
+    def get(self, telegram_id: int = None, username: str = None):
+        """جستجوی entity با telegram_id یا username (None اگر نباشد)"""
+        if telegram_id and telegram_id in self.by_id:
+            return self.by_id[telegram_id]
+        username = self.normalize_username(username)
+        if username:
+            return self.by_username.get(username)
+        return None
+    
+    async def build(self, client, limiter):
+        """ساخت دوباره نمایه از لیست کامل گفتگوها (یک بار برای همه جستجوهای همزمان)"""
+        async with self._lock:
+            if not self.is_stale:
+                return
+            dialogs = await limiter.run('GetDialogs', client.get_dialogs, limit=None)
+            self.by_id = {}
+            self.by_username = {}
+            for dialog in dialogs:
+                self.add(dialog.entity)
+            self.built_at = time.monotonic()
+            print(f"📇 نمایه گفتگوها ساخته شد: {len(self)} گفتگو")
+    
+    def attach(self, client, limiter):
+        """ثبت handler به‌روزرسانی‌های UpdateChannel روی کلاینت (بعد از ساخت هر کلاینت)"""
+        self._client = client
+        self._limiter = limiter
+        client.add_event_handler(self._on_update, events.Raw(types=[UpdateChannel]))
+    
+    async def _on_update(self, update):
+        # UpdateChannel بعد از تغییر عضویت، عنوان یا username کانال ارسال می‌شود
+        if self.built_at is None:
+            return
+        try:
+            entity = await self._limiter.run('GetEntity', self._client.get_entity, PeerChannel(update.channel_id))
+        except Exception:
+            entity = None
+        if entity is None or isinstance(entity, ChannelForbidden) or getattr(entity, 'left', False):
+            self.remove(update.channel_id)
+        else:
+            self.add(entity)
@@ -0,0 +1,103 @@
+"""
+تقسیم کار بین چند worker ربات رصد (چند process یا container روی یک theleton.db) با lease
+
+هر حساب تلگرام یک lease دارد (account:<name>) و فقط workerی که آن را در اختیار
+دارد کلاینت آن حساب را وصل می‌کند و join، leave و جمع‌آوری آمار کانال‌هایش را
+انجام می‌دهد؛ پس هیچ نمونه‌ای دو بار ثبت نمی‌شود و session یک حساب همزمان در دو
+process باز نمی‌شود. هر worker یک lease زنده‌بودن (worker:<id>) هم دارد تا سهم
+عادلانه حساب‌ها محاسبه شود، و یک worker lease هماهنگ‌کننده (coordinator) را برای
+کارهای سراسری (انتساب کانال‌ها به حساب‌ها و توزیع دستورات ربات مدیریتی) می‌گیرد.
+lease‌ها هر ttl/3 ثانیه تمدید می‌شوند و lease منقضی شده را worker دیگری برمی‌دارد.
+"""
+import math
+import os
+import socket
+from typing import Dict, Iterable, Set
+from database import Database
+
+
+COORDINATOR_LEASE = 'coordinator'
+ACCOUNT_LEASE_PREFIX = 'account:'
+WORKER_LEASE_PREFIX = 'worker:'
+
+
+def default_worker_id(config: Dict) -> str:
+    """شناسه worker از متغیر محیطی WORKER_ID، کلید worker_id یا hostname:pid"""
+    return os.environ.get('WORKER_ID') or config.get('worker_id') or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseManager:
+    """نگهداری lease‌های یک worker (متدها همگام هستند و روی thread دیتابیس اجرا می‌شوند)"""
+    
+    def __init__(self, db: Database, worker_id: str, ttl: int = 120):
+        self.db = db
+        self.worker_id = worker_id
+        self.ttl = max(10, int(ttl))
+        # حساب‌هایی که lease آن‌ها در اختیار این worker است
+        self.accounts: Set[str] = set()
+        self.is_coordinator = False
+    
+    @property
+    def renew_interval(self) -> float:
+        return self.ttl / 3
+    
+    def _acquire(self, name: str) -> bool:
+        return self.db.acquire_lease(name, self.worker_id, self.ttl)
+    
+    def renew(self) -> Set[str]:
+        """تمدید lease‌های فعلی - برمی‌گرداند حساب‌هایی که lease آن‌ها از دست رفته است"""
+        self._acquire(WORKER_LEASE_PREFIX + self.worker_id)
+        self.is_coordinator = self._acquire(COORDINATOR_LEASE)
+        lost = {name for name in self.accounts if not self._acquire(ACCOUNT_LEASE_PREFIX + name)}
+        self.accounts -= lost
+        return lost
+    
+    def rebalance(self, account_names: Iterable[str]) -> tuple:
+        """تمدید lease‌ها و گرفتن یا رها کردن حساب‌ها تا سهم عادلانه این worker
+        
+        سهم عادلانه ceil(تعداد حساب‌ها / تعداد workerهای زنده) است. در هر فراخوانی حداکثر
+        یک حساب اضافه رها می‌شود تا workerهای تازه کم‌کم بار را بگیرند.
+        
+        Returns:
+            (حساب‌های تازه گرفته شده، حساب‌های از دست رفته یا رها شده)
+        """
+        account_names = list(account_names)
+        # حساب‌هایی که از تنظیمات حذف شده‌اند رها می‌شوند
+        removed = self.accounts - set(account_names)
+        for name in removed:
+            self.db.release_lease(ACCOUNT_LEASE_PREFIX + name, self.worker_id)
+        self.accounts -= removed
+        lost = self.renew() | removed
+        
+        workers = max(1, len(self.db.get_leases(WORKER_LEASE_PREFIX)))
+        share = math.ceil(len(account_names) / workers)
+        
+        if len(self.accounts) > share:
+            name = sorted(self.accounts)[-1]
+            self.db.release_lease(ACCOUNT_LEASE_PREFIX + name, self.worker_id)
+            self.accounts.discard(name)
+            lost.add(name)
+        
+        acquired = set()
+        if len(self.accounts) < share:
+            taken = {lease['name'][len(ACCOUNT_LEASE_PREFIX):]
+                     for lease in self.db.get_leases(ACCOUNT_LEASE_PREFIX)}
+            for name in account_names:
+                if len(self.accounts) >= share:
+                    break
+                if name in self.accounts or name in taken or name in lost:
+                    continue
+                if self._acquire(ACCOUNT_LEASE_PREFIX + name):
+                    self.accounts.add(name)
+                    acquired.add(name)
+        return acquired, lost
+    
+    def release_all(self):
+        """آزاد کردن همه lease‌ها هنگام توقف تا workerهای دیگر بدون انتظار ttl آن‌ها را بگیرند"""
+        for name in self.accounts:
+            self.db.release_lease(ACCOUNT_LEASE_PREFIX + name, self.worker_id)
+        self.accounts = set()
+        if self.is_coordinator:
+            self.db.release_lease(COORDINATOR_LEASE, self.worker_id)
+            self.is_coordinator = False
+        self.db.release_lease(WORKER_LEASE_PREFIX + self.worker_id, self.worker_id)
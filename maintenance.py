@@ -0,0 +1,215 @@
+"""
+نگهداری دوره‌ای دیتابیس: اعمال قوانین نگهداری (retention) و incremental vacuum
+"""
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+from database import Database, to_epoch
+
+
+# (نام، کلید تنظیمات، روزهای پیش‌فرض، حداقل روز، DELETE محدود با پارامترهای cutoff (epoch ثانیه) و LIMIT)
+# قوانینی که همه تاریخچه کانال‌های حذف شده را پاک می‌کنند پیش‌فرض 0 (غیرفعال) دارند: کانالی که
+# دوباره با add_channel اضافه شود تاریخچه‌اش را دارد مگر اینکه این قوانین صریحاً فعال شده باشند
+RETENTION_RULES = [
+    # نمونه‌های خام همه کانال‌ها؛ خلاصه روزانه و آخرین نمونه هر کانال حفظ می‌شوند (همان SQL downsample)
+    ('channel_stats_raw', 'raw_stats_retention_days', 30, 2, Database.DOWNSAMPLE_RAW_STATS_SQL),
+    # همه نمونه‌های خام کانال‌های حذف شده (is_active = 0) - اختیاری
+    ('inactive_channel_stats', 'inactive_stats_retention_days', 0, 0, '''
+        DELETE FROM channel_stats
+        WHERE id IN (
+            SELECT cs.id
+            FROM channels c
+            JOIN channel_stats cs ON cs.channel_id = c.id
+                AND cs.recorded_at < ?
+            WHERE c.is_active = 0
+            LIMIT ?
+        )
+    '''),
+    # خلاصه روزانه کانال‌های حذف شده - اختیاری
+    ('inactive_channel_daily', 'inactive_daily_retention_days', 0, 0, '''
+        DELETE FROM channel_daily
+        WHERE (channel_id, day) IN (
+            SELECT d.channel_id, d.day
+            FROM channels c
+            JOIN channel_daily d ON d.channel_id = c.id
+                AND d.day < ? / 86400
+            WHERE c.is_active = 0
+            LIMIT ?
+        )
+    '''),
+    # دستورات اجرا شده صف commands
+    ('finished_commands', 'commands_retention_days', 7, 0, '''
+        DELETE FROM commands
+        WHERE id IN (
+            SELECT id
+            FROM commands
+            WHERE status IN ('done', 'failed')
+                AND finished_at < ?
+            LIMIT ?
+        )
+    '''),
+    # اطلاع‌رسانی‌های تحویل شده یا کنار گذاشته شده
+    ('finished_notifications', 'notifications_retention_days', 7, 0, '''
+        DELETE FROM notifications
+        WHERE id IN (
+            SELECT id
+            FROM notifications
+            WHERE status IN ('delivered', 'failed')
+                AND created_at < ?
+            LIMIT ?
+        )
+    '''),
+    # سری زمانی بازدید پست‌ها
+    ('post_stats', 'post_stats_retention_days', 180, 0, '''
+        DELETE FROM post_stats
+        WHERE (channel_id, message_id, bucket) IN (
+            SELECT channel_id, message_id, bucket
+            FROM post_stats
+            WHERE recorded_at < ?
+            LIMIT ?
+        )
+    '''),
+    # نتیجه‌های منقضی شده کش لینک‌های invite
+    ('expired_invite_cache', 'invite_cache_retention_days', 1, 0, '''
+        DELETE FROM invite_cache
+        WHERE (invite_hash, account) IN (
+            SELECT invite_hash, account
+            FROM invite_cache
+            WHERE expires_at < ?
+            LIMIT ?
+        )
+    '''),
+    # دورهای بررسی کامل تمام شده
+    ('finished_monitor_cycles', 'monitor_cycles_retention_days', 7, 0, '''
+        DELETE FROM monitor_cycles
+        WHERE id IN (
+            SELECT id
+            FROM monitor_cycles
+            WHERE finished_at < ?
+            LIMIT ?
+        )
+    '''),
+]
+
+
+class DatabaseMaintenance:
+    """اجرای قوانین نگهداری در دسته‌های کوچک تا قفل نوشتن مدت کوتاهی گرفته شود"""
+    
+    def __init__(self, db: Database, config: Dict = None):
+        self.db = db
+        self.config = config or {}
+        self.interval = self.config.get('maintenance_interval', 3600)
+        self.batch_size = self.config.get('maintenance_batch_size', 2000)
+        # سقف دسته‌ها در هر اجرا؛ باقیمانده در اجرای بعدی حذف می‌شود
+        self.max_batches = self.config.get('maintenance_max_batches', 20)
+        self.vacuum_pages = self.config.get('incremental_vacuum_pages', 500)
+        self.last_run = 0
+        # هشدار auto_vacuum فقط یک‌بار در هر process نمایش داده می‌شود
+        self.vacuum_warned = False
+    
+    def is_due(self) -> bool:
+        """آیا از آخرین اجرا به اندازه maintenance_interval گذشته است (0 یعنی غیرفعال)"""
+        if not self.interval:
+            return False
+        return time.monotonic() - self.last_run >= self.interval
+    
+    def run_if_due(self) -> Dict:
+        """اجرای نگهداری در زمان بیکاری اگر موعد آن رسیده باشد"""
+        if not self.is_due():
+            return None
+        return self.run()
+    
+    def apply_retention(self) -> Dict[str, int]:
+        """اعمال قوانین نگهداری - برمی‌گرداند تعداد رکوردهای حذف شده به ازای هر قانون"""
+        deleted = {}
+        now = datetime.utcnow()
+        for name, config_key, default_days, min_days, sql in RETENTION_RULES:
+            keep_days = self.config.get(config_key, default_days)
+            if not keep_days:
+                continue
+            keep_days = max(int(keep_days), min_days)
+            cutoff = to_epoch(now - timedelta(days=keep_days))
+            try:
+                deleted[name] = self.db.delete_in_batches(
+                    sql, (cutoff,), self.batch_size, self.max_batches)
+            except Exception as e:
+                print(f"⚠️ خطا در اعمال قانون نگهداری {name}: {e}")
+        return deleted
+    
+    def vacuum(self) -> int:
+        """incremental_vacuum در گام‌های محدود - برمی‌گرداند تعداد صفحات آزاد شده"""
+        reclaimed = 0
+        for _ in range(self.max_batches):
+            pages = self.db.incremental_vacuum(self.vacuum_pages)
+            reclaimed += pages
+            if pages < self.vacuum_pages:
+                break
+        return reclaimed
+    
+    def run(self) -> Dict:
+        """یک دور کامل نگهداری و گزارش نتیجه"""
+        self.last_run = time.monotonic()
+        report = {'deleted': {}, 'reclaimed_pages': 0, 'reclaimed_bytes': 0}
+        try:
+            report['deleted'] = self.apply_retention()
+            
+            status = self.db.get_vacuum_status()
+            report['auto_vacuum'] = status['auto_vacuum']
+            if status['auto_vacuum'] == 2:  # INCREMENTAL
+                report['reclaimed_pages'] = self.vacuum()
+                report['reclaimed_bytes'] = report['reclaimed_pages'] * status['page_size']
+            elif not self.vacuum_warned:
+                # دیتابیس‌های قدیمی تا تبدیل یک‌باره (VACUUM کامل) فقط retention را اجرا می‌کنند
+                print("⚠️ auto_vacuum دیتابیس INCREMENTAL نیست و مرحله incremental_vacuum رد می‌شود؛ "
+                      "یک‌بار (ترجیحاً با containerهای متوقف) 'python maintenance.py enable-incremental' را اجرا کنید")
+                self.vacuum_warned = True
+            report['freelist_count'] = self.db.get_vacuum_status()['freelist_count']
+        except Exception as e:
+            print(f"⚠️ خطا در نگهداری دیتابیس: {e}")
+            return report
+        
+        total_deleted = sum(report['deleted'].values())
+        if total_deleted or report['reclaimed_pages']:
+            details = ', '.join(f"{name}={count}" for name, count in report['deleted'].items() if count)
+            print(f"🧹 نگهداری دیتابیس: {total_deleted} رکورد حذف شد ({details or '-'})، "
+                  f"{report['reclaimed_pages']} صفحه ({report['reclaimed_bytes'] // 1024} KB) آزاد شد")
+        return report
+
+
+def main():
+    """اجرای نگهداری دیتابیس از خط فرمان"""
+    import argparse
+    import json
+    import os
+    
+    parser = argparse.ArgumentParser(description='نگهداری دیتابیس theleton')
+    parser.add_argument('command', choices=['run', 'status', 'enable-incremental'],
+                        help='run: اعمال قوانین نگهداری و incremental vacuum، '
+                             'status: وضعیت auto_vacuum و صفحات آزاد، '
+                             'enable-incremental: تغییر یک‌باره دیتابیس موجود به auto_vacuum=INCREMENTAL')
+    parser.add_argument('--db', default='theleton.db', help='مسیر فایل دیتابیس')
+    parser.add_argument('--config', default='config.json', help='فایل تنظیمات (کلیدهای نگهداری)')
+    args = parser.parse_args()
+    
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    
+    db = Database(args.db)
+    
+    if args.command == 'run':
+        report = DatabaseMaintenance(db, config).run()
+        print(f"✅ {report}")
+    elif args.command == 'status':
+        print(f"✅ {db.get_vacuum_status()}")
+    elif args.command == 'enable-incremental':
+        # VACUUM کامل فایل را بازنویسی می‌کند؛ بهتر است هنگام توقف containerها اجرا شود
+        db.enable_incremental_vacuum()
+        print(f"✅ {db.get_vacuum_status()}")
+    
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
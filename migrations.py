@@ -0,0 +1,604 @@
+"""
+مهاجرت‌های نسخه‌دار schema دیتابیس
+
+هر مهاجرت یک شماره نسخه، توضیح و تابعی دارد که روی cursor اجرا می‌شود.
+نسخه فعلی در جدول schema_version نگهداری می‌شود و در هر اجرا فقط
+مهاجرت‌های جدید، همه با هم در یک تراکنش، اجرا می‌شوند. اگر دیتابیس
+به‌روز باشد هیچ دستور DDL اجرا نمی‌شود.
+
+برای افزودن تغییر جدید در schema فقط یک تابع جدید به انتهای MIGRATIONS
+اضافه کنید (هرگز مهاجرت‌های قبلی را تغییر ندهید).
+"""
+from typing import Callable, List, Tuple
+
+
+def _column_exists(cursor, table: str, column: str) -> bool:
+    """بررسی وجود ستون در جدول"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def _add_column(cursor, table: str, column: str, definition: str):
+    """افزودن ستون به جدول (اگر وجود ندارد)"""
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _base_schema(cursor):
+    """جداول اصلی: کانال‌ها، تاریخچه آمار، ادمین‌ها و دسته‌بندی‌ها"""
+    # جدول کانال‌ها
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            title TEXT,
+            invite_link TEXT,
+            category TEXT,
+            telegram_id INTEGER,
+            previous_telegram_id INTEGER,
+            is_member BOOLEAN DEFAULT 0,
+            added_by INTEGER,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1
+        )
+    ''')
+    
+    # جدول تاریخچه آمار
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channel_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER NOT NULL,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            member_count INTEGER DEFAULT 0,
+            views_count INTEGER DEFAULT 0,
+            posts_count INTEGER DEFAULT 0,
+            member_change INTEGER DEFAULT 0,
+            views_change INTEGER DEFAULT 0,
+            posts_change INTEGER DEFAULT 0,
+            positive_change INTEGER DEFAULT 0,
+            FOREIGN KEY (channel_id) REFERENCES channels(id)
+        )
+    ''')
+    
+    # جدول ادمین‌ها
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # جدول دسته‌بندی‌ها
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _channel_columns(cursor):
+    """ستون‌هایی که بعداً به جدول channels اضافه شدند (دیتابیس‌های قدیمی)"""
+    _add_column(cursor, 'channels', 'invite_link', 'TEXT')
+    _add_column(cursor, 'channels', 'category', 'TEXT')
+    _add_column(cursor, 'channels', 'telegram_id', 'INTEGER')
+    _add_column(cursor, 'channels', 'previous_telegram_id', 'INTEGER')
+    _add_column(cursor, 'channels', 'is_member', 'BOOLEAN DEFAULT 0')
+
+
+def _stats_indexes(cursor):
+    """ایندکس‌های پرس‌وجوهای پرتکرار"""
+    # همه پرس‌وجوهای آمار بر اساس channel_id فیلتر و بر اساس recorded_at مرتب می‌شوند؛
+    # rowid (id) به صورت ضمنی انتهای ایندکس است، پس ORDER BY recorded_at, id هم پوشش داده می‌شود
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_channel_stats_channel_recorded
+        ON channel_stats (channel_id, recorded_at)
+    ''')
+    
+    # لیست کانال‌های فعال/عضو (get_active_channels، get_channels_to_leave)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_channels_active_member
+        ON channels (is_active, is_member, added_at)
+    ''')
+    
+    # شمارش کانال‌های هر دسته‌بندی
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_channels_category
+        ON channels (category, is_active)
+    ''')
+
+
+def rebuild_channel_latest(cursor) -> int:
+    """بازسازی کامل channel_latest از روی channel_stats - برمی‌گرداند تعداد کانال‌ها"""
+    cursor.execute('DELETE FROM channel_latest')
+    cursor.execute('''
+        INSERT INTO channel_latest (channel_id, stats_id, recorded_at)
+        SELECT d.channel_id, cs.id, cs.recorded_at
+        FROM (SELECT DISTINCT channel_id FROM channel_stats) d
+        JOIN channel_stats cs ON cs.id = (
+            SELECT id FROM channel_stats
+            WHERE channel_id = d.channel_id
+            ORDER BY recorded_at DESC, id DESC
+            LIMIT 1
+        )
+    ''')
+    return cursor.rowcount
+
+
+def _create_channel_latest_triggers(cursor):
+    """triggerهای نگهداری channel_latest (مستقل از نوع ستون recorded_at)"""
+    # هر INSERT در channel_stats در صورت جدیدتر بودن، اشاره‌گر آخرین آمار را جابه‌جا می‌کند
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_channel_stats_latest_insert
+        AFTER INSERT ON channel_stats
+        BEGIN
+            INSERT INTO channel_latest (channel_id, stats_id, recorded_at)
+            VALUES (NEW.channel_id, NEW.id, NEW.recorded_at)
+            ON CONFLICT(channel_id) DO UPDATE SET
+                stats_id = excluded.stats_id,
+                recorded_at = excluded.recorded_at
+            WHERE excluded.recorded_at > channel_latest.recorded_at
+               OR (excluded.recorded_at = channel_latest.recorded_at
+                   AND excluded.stats_id > channel_latest.stats_id);
+        END
+    ''')
+    
+    # اگر خود آخرین رکورد حذف شد (مثلاً با retention)، رکورد قبلی جایگزین می‌شود
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_channel_stats_latest_delete
+        AFTER DELETE ON channel_stats
+        WHEN OLD.id = (SELECT stats_id FROM channel_latest WHERE channel_id = OLD.channel_id)
+        BEGIN
+            DELETE FROM channel_latest WHERE channel_id = OLD.channel_id;
+            INSERT INTO channel_latest (channel_id, stats_id, recorded_at)
+            SELECT channel_id, id, recorded_at FROM channel_stats
+            WHERE channel_id = OLD.channel_id
+            ORDER BY recorded_at DESC, id DESC
+            LIMIT 1;
+        END
+    ''')
+
+
+def _channel_latest(cursor):
+    """جدول آخرین آمار هر کانال که با trigger روی channel_stats به‌روز می‌ماند"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channel_latest (
+            channel_id INTEGER PRIMARY KEY,
+            stats_id INTEGER NOT NULL,
+            recorded_at TIMESTAMP
+        )
+    ''')
+    
+    _create_channel_latest_triggers(cursor)
+    
+    rebuild_channel_latest(cursor)
+
+
+def _channel_daily(cursor):
+    """جدول خلاصه روزانه (open/close/min/max تعداد اعضا) که با trigger به‌روز می‌ماند"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channel_daily (
+            channel_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            open_count INTEGER NOT NULL,
+            close_count INTEGER NOT NULL,
+            min_count INTEGER NOT NULL,
+            max_count INTEGER NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 0,
+            first_at TIMESTAMP,
+            last_at TIMESTAMP,
+            PRIMARY KEY (channel_id, day)
+        ) WITHOUT ROWID
+    ''')
+    
+    # هر نمونه جدید، خلاصه روز خودش را به‌روز می‌کند (حذف نمونه‌های خام روی خلاصه اثری ندارد)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_channel_stats_daily_insert
+        AFTER INSERT ON channel_stats
+        BEGIN
+            INSERT INTO channel_daily
+            (channel_id, day, open_count, close_count, min_count, max_count, samples, first_at, last_at)
+            VALUES (NEW.channel_id, date(NEW.recorded_at), NEW.member_count, NEW.member_count,
+                    NEW.member_count, NEW.member_count, 1, NEW.recorded_at, NEW.recorded_at)
+            ON CONFLICT(channel_id, day) DO UPDATE SET
+                open_count = CASE WHEN excluded.first_at < channel_daily.first_at
+                                  THEN excluded.open_count ELSE channel_daily.open_count END,
+                close_count = CASE WHEN excluded.last_at >= channel_daily.last_at
+                                   THEN excluded.close_count ELSE channel_daily.close_count END,
+                min_count = MIN(channel_daily.min_count, excluded.min_count),
+                max_count = MAX(channel_daily.max_count, excluded.max_count),
+                samples = channel_daily.samples + 1,
+                first_at = MIN(channel_daily.first_at, excluded.first_at),
+                last_at = MAX(channel_daily.last_at, excluded.last_at);
+        END
+    ''')
+    
+    # پر کردن خلاصه روزانه از تاریخچه موجود
+    cursor.execute('''
+        INSERT OR REPLACE INTO channel_daily
+        (channel_id, day, open_count, close_count, min_count, max_count, samples, first_at, last_at)
+        SELECT
+            g.channel_id,
+            g.day,
+            (SELECT member_count FROM channel_stats
+             WHERE channel_id = g.channel_id AND recorded_at = g.first_at
+             ORDER BY id ASC LIMIT 1),
+            (SELECT member_count FROM channel_stats
+             WHERE channel_id = g.channel_id AND recorded_at = g.last_at
+             ORDER BY id DESC LIMIT 1),
+            g.min_count,
+            g.max_count,
+            g.samples,
+            g.first_at,
+            g.last_at
+        FROM (
+            SELECT
+                channel_id,
+                date(recorded_at) as day,
+                MIN(member_count) as min_count,
+                MAX(member_count) as max_count,
+                COUNT(*) as samples,
+                MIN(recorded_at) as first_at,
+                MAX(recorded_at) as last_at
+            FROM channel_stats
+            GROUP BY channel_id, date(recorded_at)
+        ) g
+    ''')
+
+
+def _integer_timestamps(cursor):
+    """ذخیره recorded_at به صورت epoch ثانیه (INTEGER) و کلید روز عددی (epoch روز، UTC)
+    
+    channel_stats بازسازی می‌شود (SQLite تغییر نوع ستون ندارد). channel_latest و
+    channel_daily هم به همان واحد تبدیل می‌شوند؛ خلاصه روزانه روزهایی که نمونه خام
+    آن‌ها حذف شده هم حفظ می‌شود.
+    """
+    cursor.execute('''
+        CREATE TABLE channel_stats_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER NOT NULL,
+            recorded_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            day INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER) / 86400),
+            member_count INTEGER DEFAULT 0,
+            views_count INTEGER DEFAULT 0,
+            posts_count INTEGER DEFAULT 0,
+            member_change INTEGER DEFAULT 0,
+            views_change INTEGER DEFAULT 0,
+            posts_change INTEGER DEFAULT 0,
+            positive_change INTEGER DEFAULT 0,
+            FOREIGN KEY (channel_id) REFERENCES channels(id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO channel_stats_new
+        (id, channel_id, recorded_at, day, member_count, views_count, posts_count,
+         member_change, views_change, posts_change, positive_change)
+        SELECT id, channel_id, ts, ts / 86400, member_count, views_count, posts_count,
+               member_change, views_change, posts_change, positive_change
+        FROM (
+            SELECT *, CAST(strftime('%s', COALESCE(recorded_at, 'now')) AS INTEGER) AS ts
+            FROM channel_stats
+        )
+    ''')
+    # triggerها و ایندکس‌های جدول قدیمی همراه آن حذف می‌شوند
+    cursor.execute('DROP TABLE channel_stats')
+    cursor.execute('ALTER TABLE channel_stats_new RENAME TO channel_stats')
+    
+    cursor.execute('''
+        CREATE INDEX idx_channel_stats_channel_recorded
+        ON channel_stats (channel_id, recorded_at)
+    ''')
+    # آمار یک روز مشخص (دیروز) بدون date() روی هر رکورد
+    cursor.execute('''
+        CREATE INDEX idx_channel_stats_channel_day
+        ON channel_stats (channel_id, day, recorded_at)
+    ''')
+    
+    cursor.execute('DROP TABLE channel_latest')
+    cursor.execute('''
+        CREATE TABLE channel_latest (
+            channel_id INTEGER PRIMARY KEY,
+            stats_id INTEGER NOT NULL,
+            recorded_at INTEGER
+        )
+    ''')
+    _create_channel_latest_triggers(cursor)
+    rebuild_channel_latest(cursor)
+    
+    cursor.execute('''
+        CREATE TABLE channel_daily_new (
+            channel_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            open_count INTEGER NOT NULL,
+            close_count INTEGER NOT NULL,
+            min_count INTEGER NOT NULL,
+            max_count INTEGER NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 0,
+            first_at INTEGER,
+            last_at INTEGER,
+            PRIMARY KEY (channel_id, day)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO channel_daily_new
+        (channel_id, day, open_count, close_count, min_count, max_count, samples, first_at, last_at)
+        SELECT channel_id, CAST(strftime('%s', day) AS INTEGER) / 86400,
+               open_count, close_count, min_count, max_count, samples,
+               CAST(strftime('%s', first_at) AS INTEGER),
+               CAST(strftime('%s', last_at) AS INTEGER)
+        FROM channel_daily
+    ''')
+    cursor.execute('DROP TABLE channel_daily')
+    cursor.execute('ALTER TABLE channel_daily_new RENAME TO channel_daily')
+    
+    cursor.execute('''
+        CREATE TRIGGER trg_channel_stats_daily_insert
+        AFTER INSERT ON channel_stats
+        BEGIN
+            INSERT INTO channel_daily
+            (channel_id, day, open_count, close_count, min_count, max_count, samples, first_at, last_at)
+            VALUES (NEW.channel_id, NEW.day, NEW.member_count, NEW.member_count,
+                    NEW.member_count, NEW.member_count, 1, NEW.recorded_at, NEW.recorded_at)
+            ON CONFLICT(channel_id, day) DO UPDATE SET
+                open_count = CASE WHEN excluded.first_at < channel_daily.first_at
+                                  THEN excluded.open_count ELSE channel_daily.open_count END,
+                close_count = CASE WHEN excluded.last_at >= channel_daily.last_at
+                                   THEN excluded.close_count ELSE channel_daily.close_count END,
+                min_count = MIN(channel_daily.min_count, excluded.min_count),
+                max_count = MAX(channel_daily.max_count, excluded.max_count),
+                samples = channel_daily.samples + 1,
+                first_at = MIN(channel_daily.first_at, excluded.first_at),
+                last_at = MAX(channel_daily.last_at, excluded.last_at);
+        END
+    ''')
+
+
+def _channel_access_hash(cursor):
+    """access_hash کانال برای ساخت مستقیم InputPeerChannel بدون resolve دوباره"""
+    _add_column(cursor, 'channels', 'access_hash', 'INTEGER')
+
+
+def _commands(cursor):
+    """صف پایدار دستورات ربات مدیریتی برای ربات رصد (جایگزین فایل‌های flag)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            command TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            started_at INTEGER,
+            finished_at INTEGER
+        )
+    ''')
+    # برداشتن قدیمی‌ترین دستور در انتظار (FIFO)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commands_status
+        ON commands (status, id)
+    ''')
+
+
+def _notifications(cursor):
+    """صندوق خروجی اطلاع‌رسانی‌های ربات رصد به کاربران ربات مدیریتی (جایگزین check_notification.json)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            delivered_at INTEGER
+        )
+    ''')
+    # خواندن اطلاع‌رسانی‌های تحویل نشده به ترتیب ثبت
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notifications_status
+        ON notifications (status, id)
+    ''')
+
+
+def _channel_account(cursor):
+    """حساب تلگرامی (session) که کانال به آن تعلق دارد"""
+    _add_column(cursor, 'channels', 'account', 'TEXT')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_channels_account
+        ON channels (account, is_active)
+    ''')
+
+
+def _worker_leases(cursor):
+    """lease‌های انحصاری workerهای ربات رصد (حساب‌ها، هماهنگ‌کننده و heartbeat هر worker)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS worker_leases (
+            name TEXT PRIMARY KEY,
+            worker_id TEXT NOT NULL,
+            acquired_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+    ''')
+    # workerی که دستور را برداشته (برای برگرداندن دستورات workerهای از کار افتاده به صف)
+    _add_column(cursor, 'commands', 'worker_id', 'TEXT')
+
+
+def _posts(cursor):
+    """cursor پیام‌های هر کانال و آخرین پست‌ها برای جمع‌آوری افزایشی تعداد پست و بازدید"""
+    # بزرگ‌ترین message_id دیده شده؛ هر دور فقط پیام‌های بعد از آن دریافت می‌شوند
+    _add_column(cursor, 'channels', 'last_message_id', 'INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS posts (
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            posted_at INTEGER NOT NULL,
+            views INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (channel_id, message_id),
+            FOREIGN KEY (channel_id) REFERENCES channels(id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _post_stats(cursor):
+    """سری زمانی بازدید هر پست بر اساس سن آن و زمان به‌روزرسانی بعدی هر پست"""
+    _add_column(cursor, 'posts', 'next_refresh_at', 'INTEGER')
+    # پست‌های موجود در اولین نوبت به‌روز می‌شوند و زمان بعدی‌شان از سنشان محاسبه می‌شود
+    cursor.execute("UPDATE posts SET next_refresh_at = CAST(strftime('%s', 'now') AS INTEGER)")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_posts_next_refresh
+        ON posts (next_refresh_at)
+        WHERE next_refresh_at IS NOT NULL
+    ''')
+    # bucket: سن پست به ساعت در زمان نمونه‌برداری
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_stats (
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            views INTEGER NOT NULL,
+            recorded_at INTEGER NOT NULL,
+            PRIMARY KEY (channel_id, message_id, bucket),
+            FOREIGN KEY (channel_id) REFERENCES channels(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_post_stats_recorded
+        ON post_stats (recorded_at)
+    ''')
+
+
+def _invite_cache(cursor):
+    """کش نتیجه CheckChatInviteRequest برای هر hash لینک invite و هر حساب"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invite_cache (
+            invite_hash TEXT NOT NULL,
+            account TEXT NOT NULL,
+            status TEXT NOT NULL,
+            chat_id INTEGER,
+            access_hash INTEGER,
+            checked_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            PRIMARY KEY (invite_hash, account)
+        ) WITHOUT ROWID
+    ''')
+    # پاک کردن عضویت بعد از خروج از کانال
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_invite_cache_chat
+        ON invite_cache (chat_id, account)
+    ''')
+
+
+def _channel_failures(cursor):
+    """وضعیت شکست join/آمار هر کانال برای backoff نمایی و قرنطینه"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channel_failures (
+            channel_id INTEGER PRIMARY KEY,
+            operation TEXT NOT NULL,
+            failure TEXT NOT NULL,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            first_failed_at INTEGER NOT NULL,
+            last_failed_at INTEGER NOT NULL,
+            next_retry_at INTEGER NOT NULL,
+            quarantined INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (channel_id) REFERENCES channels(id)
+        )
+    ''')
+
+
+def _monitor_cycles(cursor):
+    """پیشرفت دورهای بررسی کامل کانال‌های هر حساب برای ادامه بعد از ری‌استارت"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monitor_cycles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account TEXT NOT NULL,
+            worker_id TEXT,
+            started_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            finished_at INTEGER,
+            total INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            cursor INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # دور باز هر حساب (finished_at IS NULL) هنگام شروع ربات رصد
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_monitor_cycles_open
+        ON monitor_cycles (account, started_at)
+        WHERE finished_at IS NULL
+    ''')
+
+
+# (نسخه، توضیح، تابع) - فقط به انتها اضافه شود
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, 'base schema', _base_schema),
+    (2, 'channels: invite_link, category, telegram_id, previous_telegram_id, is_member', _channel_columns),
+    (3, 'indexes for channel_stats time-series and channel listings', _stats_indexes),
+    (4, 'channel_latest snapshot table maintained by triggers', _channel_latest),
+    (5, 'channel_daily rollup table maintained by trigger', _channel_daily),
+    (6, 'integer epoch recorded_at and day key for channel_stats/channel_daily', _integer_timestamps),
+    (7, 'channels: access_hash', _channel_access_hash),
+    (8, 'commands queue table', _commands),
+    (9, 'notifications outbox table', _notifications),
+    (10, 'channels: account', _channel_account),
+    (11, 'worker_leases table', _worker_leases),
+    (12, 'channels: last_message_id and posts table', _posts),
+    (13, 'post_stats table and posts.next_refresh_at', _post_stats),
+    (14, 'invite_cache table', _invite_cache),
+    (15, 'channel_failures table', _channel_failures),
+    (16, 'monitor_cycles table', _monitor_cycles),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(cursor) -> int:
+    """نسخه فعلی schema (0 برای دیتابیس بدون جدول schema_version)"""
+    cursor.execute('''
+        SELECT 1 FROM sqlite_master
+        WHERE type = 'table' AND name = 'schema_version'
+    ''')
+    if cursor.fetchone() is None:
+        return 0
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def apply_migrations(connections) -> List[int]:
+    """اجرای مهاجرت‌های معوق در یک تراکنش
+    
+    Args:
+        connections: ConnectionManager دیتابیس
+    
+    Returns:
+        لیست نسخه‌هایی که اجرا شدند (خالی اگر دیتابیس به‌روز بود)
+    """
+    # مسیر سریع: فقط خواندن، بدون قفل نوشتن و بدون DDL
+    with connections.cursor() as cursor:
+        if get_schema_version(cursor) >= LATEST_VERSION:
+            return []
+    
+    applied = []
+    with connections.transaction() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # دوباره داخل تراکنش می‌خوانیم؛ ممکن است سرویس دیگر همزمان مهاجرت را انجام داده باشد
+        current = get_schema_version(cursor)
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            migrate(cursor)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            applied.append(version)
+    return applied
@@ -0,0 +1,43 @@
+"""
+زمان‌بندی به‌روزرسانی بازدید پست‌ها با فاصله‌ای که با سن پست زیاد می‌شود
+
+بازدید هر پست در post_stats با کلید (channel_id, message_id, bucket) ثبت می‌شود که
+bucket سن پست به ساعت در زمان نمونه‌برداری است. فاصله به‌روزرسانی یک پست
+post_refresh_factor برابر سن آن است (بین post_refresh_min_interval و
+post_refresh_max_interval) و بعد از post_tracking_days روز دنبال کردن پست متوقف
+می‌شود؛ پس تعداد درخواست‌های هر پست با لگاریتم سن آن رشد می‌کند و هزینه کل به
+تعداد پست‌های جدید بستگی دارد نه به تعداد کل پست‌ها.
+"""
+from typing import Dict, Optional
+
+
+# GetMessagesViewsRequest حداکثر 100 پیام (از یک کانال) در هر درخواست می‌پذیرد
+VIEWS_BATCH_SIZE = 100
+
+
+class PostRefreshPolicy:
+    """محاسبه bucket سن و زمان به‌روزرسانی بعدی بازدید پست‌ها"""
+    
+    BUCKET_SECONDS = 3600
+    
+    def __init__(self, config: Dict = None):
+        config = config or {}
+        self.factor = float(config.get('post_refresh_factor', 0.25))
+        self.min_interval = float(config.get('post_refresh_min_interval', 3600))
+        self.max_interval = max(self.min_interval, float(config.get('post_refresh_max_interval', 86400)))
+        self.tracking_seconds = int(float(config.get('post_tracking_days', 7)) * 86400)
+        # حداکثر پست‌هایی که در هر نوبت به‌روز می‌شوند (سقف درخواست‌های هر نوبت)
+        self.batch_limit = max(1, int(config.get('post_refresh_batch', 500)))
+    
+    def bucket(self, posted_at: int, now: float) -> int:
+        """سن پست به ساعت (کلید نمونه در post_stats)"""
+        return max(0, int(now - posted_at) // self.BUCKET_SECONDS)
+    
+    def next_refresh_at(self, posted_at: int, now: float) -> Optional[int]:
+        """زمان به‌روزرسانی بعدی بازدید پست (None یعنی دنبال کردن پست تمام شده است)"""
+        age = now - posted_at
+        if age >= self.tracking_seconds:
+            return None
+        interval = min(self.max_interval, max(self.min_interval, age * self.factor))
+        # آخرین نمونه دقیقاً در پایان بازه دنبال کردن گرفته می‌شود
+        return int(min(now + interval, posted_at + self.tracking_seconds))
@@ -0,0 +1,164 @@
+"""
+محدودکننده نرخ درخواست‌های Telethon با bucket جداگانه برای هر نوع درخواست
+
+هر نوع درخواست (GetFullChannelRequest، JoinChannelRequest و ...) یک token bucket
+دارد. نرخ هر bucket با دیدن FloodWaitError نصف می‌شود (و bucket به اندازه
+seconds متوقف می‌شود) و بعد از تعدادی درخواست موفق پشت سر هم، کم‌کم تا سقف
+max_rate بالا می‌رود؛ یعنی تا جایی که تلگرام اجازه می‌دهد سریع کار می‌کنیم.
+"""
+import asyncio
+import time
+from typing import Dict
+from telethon.errors import FloodWaitError
+
+
+# (نرخ اولیه در ثانیه، ظرفیت burst) - قابل تغییر با کلید rate_limits در config.json
+DEFAULT_LIMITS = {
+    'GetFullChannelRequest': (1.0, 5),
+    'GetChannelsRequest': (0.5, 2),
+    'GetHistoryRequest': (1.0, 5),
+    'GetMessagesViewsRequest': (1.0, 5),
+    'CheckChatInviteRequest': (0.2, 2),
+    'JoinChannelRequest': (0.05, 1),
+    'ImportChatInviteRequest': (0.05, 1),
+    'LeaveChannelRequest': (0.2, 2),
+    'ResolveUsername': (0.1, 3),
+    'GetEntity': (2.0, 10),
+    'GetDialogs': (0.2, 2),
+    'default': (1.0, 5),
+}
+
+
+class RateLimitedError(Exception):
+    """FloodWait طولانی‌تر از max_flood_wait؛ درخواست انجام نشد و باید بعداً تکرار شود"""
+    
+    def __init__(self, kind: str, seconds: float):
+        super().__init__(f"{kind} تا {int(seconds)} ثانیه دیگر محدود است")
+        self.kind = kind
+        self.seconds = seconds
+
+
+class TokenBucket:
+    """token bucket با نرخ تطبیقی (کاهش ضربی در FloodWait، افزایش جمعی بعد از موفقیت)"""
+    
+    # بعد از این تعداد موفقیت پشت سر هم، نرخ به اندازه increase_step * base_rate زیاد می‌شود
+    SUCCESS_STREAK = 20
+    INCREASE_STEP = 0.1
+    
+    def __init__(self, kind: str, rate: float, burst: int, max_factor: float = 2.0,
+                 min_factor: float = 0.05):
+        self.kind = kind
+        self.base_rate = rate
+        self.rate = rate
+        self.max_rate = rate * max_factor
+        self.min_rate = rate * min_factor
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.successes = 0
+        self._lock = asyncio.Lock()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    async def acquire(self, max_wait: float = None):
+        """گرفتن یک token (صبر تا آزاد شدن آن)
+        
+        Raises:
+            RateLimitedError: اگر bucket بیشتر از max_wait ثانیه متوقف باشد
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.paused_until > now:
+                    remaining = self.paused_until - now
+                    if max_wait is not None and remaining > max_wait:
+                        raise RateLimitedError(self.kind, remaining)
+                    await asyncio.sleep(remaining)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def on_success(self):
+        """ثبت درخواست موفق؛ بعد از SUCCESS_STREAK موفقیت نرخ کمی بالا می‌رود"""
+        self.successes += 1
+        if self.successes >= self.SUCCESS_STREAK:
+            self.successes = 0
+            self.rate = min(self.max_rate, self.rate + self.base_rate * self.INCREASE_STEP)
+    
+    def on_flood_wait(self, seconds: float):
+        """FloodWait از تلگرام: توقف bucket و نصف کردن نرخ"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.rate = max(self.min_rate, self.rate / 2)
+        # tokenها از پایان توقف پر می‌شوند تا بعد از توقف یک burst کامل فرستاده نشود
+        self.tokens = 0.0
+        self.updated_at = self.paused_until
+        self.successes = 0
+
+
+class RateLimiter:
+    """نقطه عبور مشترک همه درخواست‌های Telethon"""
+    
+    def __init__(self, config: Dict = None):
+        config = config or {}
+        limits = dict(DEFAULT_LIMITS)
+        # سازگاری با تنظیم قبلی نرخ درخواست‌های آمار
+        if 'stats_requests_per_second' in config:
+            limits['GetFullChannelRequest'] = (float(config['stats_requests_per_second']),
+                                               limits['GetFullChannelRequest'][1])
+        for kind, (rate, burst) in config.get('rate_limits', {}).items():
+            limits[kind] = (float(rate), int(burst))
+        
+        max_factor = float(config.get('rate_limit_max_factor', 2.0))
+        self.buckets = {
+            kind: TokenBucket(kind, rate, burst, max_factor=max_factor)
+            for kind, (rate, burst) in limits.items()
+        }
+        # FloodWaitهای کوتاه‌تر از این مقدار صبر می‌شوند؛ طولانی‌ترها RateLimitedError می‌دهند
+        self.max_flood_wait = float(config.get('max_flood_wait', 300))
+        self.max_attempts = int(config.get('rate_limit_max_attempts', 3))
+    
+    def bucket(self, kind: str) -> TokenBucket:
+        return self.buckets.get(kind) or self.buckets['default']
+    
+    async def call(self, client, request, kind: str = None):
+        """ارسال یک درخواست TL با client از طریق bucket نوع آن"""
+        return await self.run(kind or type(request).__name__, client, request)
+    
+    async def run(self, kind: str, func, *args, **kwargs):
+        """اجرای یک coroutine تلگرام (مثلاً client.get_entity) با bucket مشخص
+        
+        FloodWaitهای کوتاه صبر و تکرار می‌شوند.
+        
+        Raises:
+            RateLimitedError: اگر FloodWait طولانی باشد یا تلاش‌ها تمام شوند
+        """
+        bucket = self.bucket(kind)
+        for attempt in range(self.max_attempts):
+            await bucket.acquire(self.max_flood_wait)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                bucket.on_flood_wait(e.seconds)
+                print(f"⏳ FloodWait {e.seconds} ثانیه برای {kind} - نرخ جدید: {bucket.rate:.3f}/s "
+                      f"(تلاش {attempt + 1}/{self.max_attempts})")
+                if e.seconds > self.max_flood_wait:
+                    raise RateLimitedError(kind, e.seconds)
+                continue
+            bucket.on_success()
+            return result
+        raise RateLimitedError(kind, max(0.0, bucket.paused_until - time.monotonic()))
+    
+    def status(self) -> Dict[str, Dict]:
+        """نرخ فعلی و زمان باقی‌مانده توقف هر bucket"""
+        now = time.monotonic()
+        return {
+            kind: {'rate': round(b.rate, 4), 'paused_for': max(0, round(b.paused_until - now))}
+            for kind, b in self.buckets.items()
+        }
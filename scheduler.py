@@ -0,0 +1,164 @@
+"""
+زمان‌بندی تطبیقی بررسی کانال‌ها با صف اولویت (heap) زمان بررسی بعدی
+
+فاصله بررسی هر کانال از نرخ تغییر تعداد اعضای آن (مجموع قدر مطلق تغییرات در
+ثانیه) به دست می‌آید: فاصله طوری انتخاب می‌شود که در هر بررسی حدود
+volatility_target عضو تغییر دیده شود و بین min_check_interval و
+max_check_interval می‌ماند. نرخ اولیه از channel_stats خوانده می‌شود و بعد از هر
+بررسی با میانگین نمایی به‌روز می‌شود؛ کانال‌های ساکن کمتر و کانال‌های پرتغییر
+بیشتر بررسی می‌شوند.
+"""
+import heapq
+import time
+from typing import Dict, List, Optional
+
+
+class ChannelScheduler:
+    """heap از (next_check_at, channel_id) با حذف تنبل ورودی‌های قدیمی"""
+    
+    # وزن مشاهده جدید در میانگین نمایی نرخ تغییر
+    SMOOTHING = 0.3
+    
+    def __init__(self, config: Dict = None):
+        config = config or {}
+        self.base_interval = float(config.get('check_interval', 1800))
+        self.min_interval = float(config.get('min_check_interval', 300))
+        self.max_interval = max(self.min_interval, float(config.get('max_check_interval', 6 * 3600)))
+        self.volatility_target = float(config.get('volatility_target', 10))
+        # بازه‌ای از channel_stats که نرخ اولیه از آن محاسبه می‌شود
+        self.history_window = int(config.get('volatility_window', 86400))
+        self._heap = []
+        # channel_id -> {'channel', 'rate', 'interval', 'next_at', 'last_count', 'last_at'}
+        self.entries: Dict[int, Dict] = {}
+        self._activity: Dict[int, Dict] = {}
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def interval_for(self, rate: Optional[float]) -> float:
+        """فاصله بررسی برای نرخ تغییر rate (عضو در ثانیه)؛ None یعنی نامعلوم"""
+        if rate is None:
+            interval = self.base_interval
+        elif rate <= 0:
+            interval = self.max_interval
+        else:
+            interval = self.volatility_target / rate
+        return min(self.max_interval, max(self.min_interval, interval))
+    
+    def load_activity(self, activity: Dict[int, Dict]):
+        """ثبت خروجی Database.get_channel_activity برای مقداردهی اولیه کانال‌ها"""
+        self._activity = activity or {}
+    
+    def _initial_entry(self, channel: Dict, now: float) -> Dict:
+        activity = self._activity.get(channel['id'])
+        entry = {'channel': channel, 'rate': None, 'last_count': None, 'last_at': None}
+        if activity:
+            span = (activity['last_at'] or 0) - (activity['first_at'] or 0)
+            if activity['samples'] > 1 and span > 0:
+                entry['rate'] = activity['total_change'] / span
+            entry['last_count'] = activity['member_count']
+            entry['last_at'] = activity['last_at']
+        entry['interval'] = self.interval_for(entry['rate'])
+        # کانال بدون سابقه بلافاصله بررسی می‌شود
+        last_at = entry['last_at']
+        entry['next_at'] = max(now, last_at + entry['interval']) if last_at else now
+        return entry
+    
+    def _push(self, channel_id: int, next_at: float):
+        self.entries[channel_id]['next_at'] = next_at
+        heapq.heappush(self._heap, (next_at, channel_id))
+        # ورودی‌های قدیمی (حذف تنبل) نباید heap را بی‌رویه بزرگ کنند
+        if len(self._heap) > 4 * len(self.entries) + 64:
+            self._heap = [(e['next_at'], cid) for cid, e in self.entries.items()]
+            heapq.heapify(self._heap)
+    
+    def _is_current(self, next_at: float, channel_id: int) -> bool:
+        entry = self.entries.get(channel_id)
+        return entry is not None and entry['next_at'] == next_at
+    
+    def sync(self, channels: List[Dict], now: float = None):
+        """هماهنگ کردن با لیست کانال‌های فعال: افزودن کانال‌های جدید و حذف کانال‌های رفته"""
+        now = now or time.time()
+        active_ids = set()
+        for channel in channels:
+            channel_id = channel['id']
+            active_ids.add(channel_id)
+            self.add(channel, now)
+        for channel_id in list(self.entries):
+            if channel_id not in active_ids:
+                self.remove(channel_id)
+    
+    def add(self, channel: Dict, now: float = None):
+        """افزودن کانال به زمان‌بندی (برای کانال موجود فقط dict آن به‌روز می‌شود)"""
+        channel_id = channel['id']
+        if channel_id in self.entries:
+            self.entries[channel_id]['channel'] = channel
+            return
+        entry = self._initial_entry(channel, now or time.time())
+        self.entries[channel_id] = entry
+        self._push(channel_id, entry['next_at'])
+    
+    def remove(self, channel_id: int):
+        """حذف کانال از زمان‌بندی (ورودی heap آن نادیده گرفته می‌شود)"""
+        self.entries.pop(channel_id, None)
+    
+    def pop_due(self, now: float = None, limit: int = None) -> List[Dict]:
+        """برداشتن کانال‌هایی که زمان بررسی آن‌ها رسیده (قدیمی‌ترین اول)
+        
+        هر کانال برداشته شده موقتاً به اندازه فاصله فعلی‌اش جلوتر زمان‌بندی می‌شود تا
+        اگر بررسی آن ناموفق بود (مثلاً FloodWait) از صف گم نشود؛ observe زمان نهایی را تعیین می‌کند.
+        """
+        now = now or time.time()
+        due = []
+        while self._heap and (limit is None or len(due) < limit):
+            next_at, channel_id = self._heap[0]
+            if not self._is_current(next_at, channel_id):
+                heapq.heappop(self._heap)
+                continue
+            if next_at > now:
+                break
+            heapq.heappop(self._heap)
+            entry = self.entries[channel_id]
+            self._push(channel_id, now + entry['interval'])
+            due.append(entry['channel'])
+        return due
+    
+    def observe(self, channel_id: int, member_count: int, now: float = None):
+        """ثبت نتیجه بررسی، به‌روزرسانی نرخ تغییر و زمان‌بندی بررسی بعدی"""
+        entry = self.entries.get(channel_id)
+        if entry is None:
+            return
+        now = now or time.time()
+        if entry['last_count'] is not None and entry['last_at'] and now > entry['last_at']:
+            observed = abs(member_count - entry['last_count']) / (now - entry['last_at'])
+            if entry['rate'] is None:
+                entry['rate'] = observed
+            else:
+                entry['rate'] = self.SMOOTHING * observed + (1 - self.SMOOTHING) * entry['rate']
+        entry['last_count'] = member_count
+        entry['last_at'] = now
+        entry['interval'] = self.interval_for(entry['rate'])
+        self._push(channel_id, now + entry['interval'])
+    
+    def seconds_until_next(self, now: float = None) -> Optional[float]:
+        """ثانیه‌های باقی‌مانده تا نزدیک‌ترین بررسی (None اگر کانالی نیست)"""
+        now = now or time.time()
+        while self._heap and not self._is_current(*self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - now)
+    
+    def status(self) -> Dict:
+        """خلاصه وضعیت زمان‌بندی (تعداد کانال و فاصله‌های بررسی)"""
+        intervals = [e['interval'] for e in self.entries.values()]
+        if not intervals:
+            return {'channels': 0}
+        return {
+            'channels': len(intervals),
+            'min_interval': int(min(intervals)),
+            'avg_interval': int(sum(intervals) / len(intervals)),
+            'max_interval': int(max(intervals)),
+            # تعداد تقریبی بررسی در ساعت با فاصله‌های فعلی
+            'checks_per_hour': round(sum(3600 / i for i in intervals), 1),
+        }
@@ -0,0 +1,54 @@
+"""
+دسته‌بندی خطاهای join/آمار و backoff نمایی کانال‌های ناموفق
+"""
+import pytest
+
+pytest.importorskip('telethon')
+from channel_failures import (FAILURE_BANNED, FAILURE_EXPIRED, FAILURE_FLOOD, FAILURE_INVALID,
+                              FAILURE_TRANSIENT, FailureBackoff, classify_error)
+from rate_limiter import RateLimitedError
+
+
+class UsernameNotOccupiedError(Exception):
+    """هم‌نام خطای Telethon؛ دسته‌بندی بر اساس نام کلاس است"""
+
+
+@pytest.mark.parametrize('error, failure', [
+    (UsernameNotOccupiedError('x'), FAILURE_INVALID),
+    (RateLimitedError('JoinChannelRequest', 900), FAILURE_FLOOD),
+    (Exception('The chat the user tried to join has expired'), FAILURE_EXPIRED),
+    (Exception('CHANNEL_PRIVATE: The channel specified is private'), FAILURE_BANNED),
+    (Exception('Nobody is using this username, or the username is not occupied'), FAILURE_INVALID),
+    (Exception('Too many requests: FLOOD'), FAILURE_FLOOD),
+    (Exception('Server closed the connection'), FAILURE_TRANSIENT),
+])
+def test_classify_error(error, failure):
+    assert classify_error(error) == failure
+
+
+def test_delay_doubles_up_to_max():
+    backoff = FailureBackoff({'failure_retry_base': 600, 'failure_retry_max': 3000})
+    assert [backoff.delay(FAILURE_TRANSIENT, attempts) for attempts in (1, 2, 3, 4)] == [600, 1200, 2400, 3000]
+
+
+def test_permanent_failures_start_from_longer_delay():
+    backoff = FailureBackoff({'failure_retry_base': 600, 'failure_permanent_retry_base': 3600})
+    assert backoff.delay(FAILURE_EXPIRED, 1) == 3600
+    assert backoff.delay(FAILURE_INVALID, 2) == 7200
+
+
+def test_announced_flood_wait_is_a_floor():
+    backoff = FailureBackoff({'failure_retry_base': 600})
+    assert backoff.delay(FAILURE_FLOOD, 1, wait=5000) == 5000
+    assert backoff.delay(FAILURE_FLOOD, 1, wait=10) == 600
+    assert backoff.next_retry_at(FAILURE_FLOOD, 1, 1000.0, wait=5000) == 6000
+
+
+def test_quarantine_after_repeated_permanent_failures():
+    backoff = FailureBackoff({'failure_quarantine_after': 3})
+    assert not backoff.is_quarantined(FAILURE_INVALID, 2)
+    assert backoff.is_quarantined(FAILURE_INVALID, 3)
+    assert backoff.is_quarantined(FAILURE_BANNED, 5)
+    # خطاهای گذرا هر چند بار هم تکرار شوند قرنطینه نمی‌شوند
+    assert not backoff.is_quarantined(FAILURE_TRANSIENT, 10)
+    assert not backoff.is_quarantined(FAILURE_FLOOD, 10)
@@ -0,0 +1,35 @@
+"""
+cursor دور بررسی کامل (CycleCheckpoint): بزرگ‌ترین شناسه‌ای که همه شناسه‌های کوچک‌تر از آن بررسی شده‌اند
+"""
+from cycles import CycleCheckpoint
+
+
+def test_cursor_advances_only_past_contiguous_completed_channels():
+    cycle = CycleCheckpoint({'id': 1}, [9, 3, 7, 5])
+    assert (cycle.cursor, cycle.done, cycle.dirty) == (0, 0, False)
+    
+    cycle.complete(7)
+    assert (cycle.cursor, cycle.done, cycle.dirty) == (0, 1, True)
+    cycle.complete(3)
+    assert cycle.cursor == 3
+    cycle.complete(9)
+    assert cycle.cursor == 3
+    # کانال 5 شکاف را پر می‌کند و cursor تا آخرین کانال پشت سر هم انجام شده جلو می‌رود
+    cycle.complete(5)
+    assert (cycle.cursor, cycle.done) == (9, 4)
+
+
+def test_repeated_completion_is_counted_once():
+    cycle = CycleCheckpoint({'id': 1}, [1, 2])
+    cycle.complete(2)
+    cycle.complete(2)
+    assert (cycle.cursor, cycle.done) == (0, 1)
+
+
+def test_resumed_cycle_keeps_saved_progress():
+    # دور ذخیره شده: 2 کانال تا شناسه 4 انجام شده؛ فقط کانال‌های باقی‌مانده داده می‌شوند
+    cycle = CycleCheckpoint({'id': 7, 'done': 2, 'cursor': 4}, [8, 6])
+    cycle.complete(8)
+    assert (cycle.cursor, cycle.done) == (4, 3)
+    cycle.complete(6)
+    assert (cycle.cursor, cycle.done) == (8, 4)
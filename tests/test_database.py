@@ -0,0 +1,191 @@
+"""
+رفتار متدهای Database روی یک دیتابیس موقت
+"""
+import pytest
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'theleton.db'))
+    yield database
+    database.close()
+
+
+def channel_row(db, channel_id):
+    return dict(db.get_connection().execute(
+        'SELECT is_member, title, telegram_id, access_hash FROM channels WHERE id = ?', (channel_id,)
+    ).fetchone())
+
+
+def test_mark_channel_joined_writes_everything(db):
+    db.add_channel('chan')
+    channel_id = db.get_channel_by_username('chan')['id']
+    db.mark_channel_joined(channel_id, telegram_id=100, title='Chan', access_hash=5)
+    assert channel_row(db, channel_id) == {'is_member': 1, 'title': 'Chan', 'telegram_id': 100, 'access_hash': 5}
+
+
+def test_mark_channel_joined_rolls_back_partial_join(db):
+    db.add_channel('chan')
+    channel_id = db.get_channel_by_username('chan')['id']
+    # آخرین نوشتن (access_hash) شکست می‌خورد؛ is_member و telegram_id هم نباید ثبت شوند
+    db.get_connection().execute('''
+        CREATE TEMP TRIGGER fail_access_hash BEFORE UPDATE OF access_hash ON channels
+        BEGIN SELECT RAISE(ABORT, 'access_hash'); END
+    ''')
+    db.mark_channel_joined(channel_id, telegram_id=100, title='Chan', access_hash=5)
+    assert channel_row(db, channel_id) == {'is_member': 0, 'title': '', 'telegram_id': None, 'access_hash': None}
+
+
+def stats_rows(db, channel_id):
+    return [tuple(row) for row in db.get_connection().execute('''
+        SELECT member_count, views_count, posts_count, member_change, views_change, posts_change, positive_change
+        FROM channel_stats WHERE channel_id = ? ORDER BY id
+    ''', (channel_id,))]
+
+
+def test_add_stats_bulk_computes_changes_from_previous_sample(db):
+    db.add_channel('a')
+    db.add_channel('b')
+    a = db.get_channel_by_username('a')['id']
+    b = db.get_channel_by_username('b')['id']
+    
+    # دو کانال در یک executemany؛ اولین نمونه هر کانال نسبت به صفر حساب می‌شود
+    assert db.add_stats_bulk([(a, 100, 1000, 10), (b, 50, None, None)]) == 2
+    # کاهش اعضا با افزایش بازدید؛ posts_count خالی یعنی مقدار قبلی تکرار شود
+    assert db.add_stats_bulk([(a, 90, 1200, None)]) == 1
+    # دو نمونه یک کانال در یک دسته: دومی نسبت به اولی محاسبه می‌شود
+    assert db.add_stats_bulk([(a, 90, None, 12), (a, 85, 1100, 12)]) == 2
+    
+    assert stats_rows(db, a) == [
+        (100, 1000, 10, 100, 1000, 10, 1),
+        (90, 1200, 10, -10, 200, 0, 1),
+        (90, 1200, 12, 0, 0, 2, 0),
+        (85, 1100, 12, -5, -100, 0, 0),
+    ]
+    assert stats_rows(db, b) == [(50, 0, 0, 50, 0, 0, 1)]
+
+
+def test_deleting_latest_sample_moves_channel_latest_back(db):
+    db.add_channel('a')
+    channel_id = db.get_channel_by_username('a')['id']
+    conn = db.get_connection()
+    ids = [conn.execute('INSERT INTO channel_stats (channel_id, recorded_at, member_count) VALUES (?, ?, ?)',
+                        (channel_id, recorded_at, 10)).lastrowid
+           for recorded_at in (1000, 2000, 3000)]
+    
+    def latest():
+        row = conn.execute('SELECT stats_id, recorded_at FROM channel_latest WHERE channel_id = ?',
+                           (channel_id,)).fetchone()
+        return tuple(row) if row else None
+    
+    assert latest() == (ids[2], 3000)
+    # حذف نمونه قدیمی روی اشاره‌گر اثری ندارد
+    conn.execute('DELETE FROM channel_stats WHERE id = ?', (ids[0],))
+    assert latest() == (ids[2], 3000)
+    # حذف آخرین نمونه (مثلاً با retention) اشاره‌گر را به نمونه قبلی برمی‌گرداند
+    conn.execute('DELETE FROM channel_stats WHERE id = ?', (ids[2],))
+    assert latest() == (ids[1], 2000)
+    conn.execute('DELETE FROM channel_stats WHERE id = ?', (ids[1],))
+    assert latest() is None
+
+
+def test_channel_failures_are_recorded_and_cleared(db):
+    db.add_channel('a')
+    channel_id = db.get_channel_by_username('a')['id']
+    assert db.get_channel_failure_attempts(channel_id) == 0
+    
+    assert db.record_channel_failure(channel_id, 'join', 'invalid', 'not occupied', 1, 2000, False, 1000)
+    assert db.record_channel_failure(channel_id, 'stats', 'banned', 'private', 2, 5000, True, 1500)
+    assert db.get_channel_failure_attempts(channel_id) == 2
+    channel = db.get_all_active_channels()[0]
+    assert (channel['failure'], channel['failure_attempts'], channel['retry_at'], channel['quarantined']) == \
+        ('banned', 2, 5000, 1)
+    
+    assert db.clear_channel_failures([channel_id]) == 1
+    assert db.get_channel_failure_attempts(channel_id) == 0
+    assert db.get_all_active_channels()[0]['failure'] is None
+
+
+def test_commands_are_claimed_in_fifo_order(db):
+    first = db.enqueue_command('check', {'user_id': 1})
+    second = db.enqueue_command('join', {'channel_id': 5, 'account': 'acc2'})
+    third = db.enqueue_command('leave', {'channel_id': 6})
+    
+    command = db.claim_next_command(worker_id='w1')
+    assert (command['id'], command['command'], command['payload']) == (first, 'check', {'user_id': 1})
+    # دستور حساب دیگر برای worker بدون آن حساب برداشته نمی‌شود
+    assert db.claim_next_command(['acc1'], coordinator=True, worker_id='w1')['id'] == third
+    assert db.claim_next_command(['acc1'], coordinator=True, worker_id='w1') is None
+    assert db.claim_next_command(['acc2'], coordinator=False, worker_id='w2')['id'] == second
+    assert db.claim_next_command() is None
+
+
+def test_requeue_only_commands_of_dead_workers(db):
+    for command in ('a', 'b', 'c'):
+        db.enqueue_command(command)
+    db.claim_next_command(worker_id='alive')
+    db.claim_next_command(worker_id='dead')
+    db.claim_next_command(worker_id='me')
+    assert db.acquire_lease('worker:alive', 'alive', 60)
+    assert db.acquire_lease('worker:dead', 'dead', 60)
+    # heartbeat منقضی شده
+    db.get_connection().execute("UPDATE worker_leases SET expires_at = expires_at - 120 WHERE name = 'worker:dead'")
+    
+    # دستورات worker زنده دیگر دست نمی‌خورند؛ دستورات worker مرده و اجرای قبلی خود worker برمی‌گردند
+    assert db.requeue_running_commands('me') == 2
+    rows = db.get_connection().execute('SELECT command, status, worker_id FROM commands ORDER BY id').fetchall()
+    assert [tuple(row) for row in rows] == [('a', 'running', 'alive'), ('b', 'pending', None), ('c', 'pending', None)]
+    assert db.claim_next_command(worker_id='me')['command'] == 'b'
+
+
+def test_notification_attempts_and_give_up(db):
+    notification_id = db.add_notification(42, 'check_finished', {'success': True})
+    pending = db.get_pending_notifications()
+    assert [(n['id'], n['attempts'], n['payload']) for n in pending] == [(notification_id, 0, {'success': True})]
+    
+    # تا max_attempts تلاش ناموفق در صف می‌ماند و بعد کنار گذاشته می‌شود
+    assert db.mark_notification_failed(notification_id, 3) is False
+    assert db.mark_notification_failed(notification_id, 3) is False
+    assert db.get_pending_notifications()[0]['attempts'] == 2
+    assert db.mark_notification_failed(notification_id, 3) is True
+    assert db.get_pending_notifications() == []
+    
+    delivered = db.add_notification(42, 'check_finished')
+    db.mark_notification_delivered(delivered)
+    assert db.get_pending_notifications() == []
+
+
+def lease_row(db, name):
+    return dict(db.get_connection().execute(
+        'SELECT worker_id, acquired_at, expires_at FROM worker_leases WHERE name = ?', (name,)
+    ).fetchone())
+
+
+def test_lease_takeover_only_after_expiry(db):
+    assert db.acquire_lease('account:main', 'w1', 60)
+    # lease زنده به worker دیگر نمی‌رسد و تمدید آن هم نمی‌کند
+    before = lease_row(db, 'account:main')
+    assert not db.acquire_lease('account:main', 'w2', 600)
+    assert lease_row(db, 'account:main') == before
+    
+    # تمدید توسط صاحب lease، acquired_at را حفظ می‌کند
+    db.get_connection().execute("UPDATE worker_leases SET acquired_at = acquired_at - 30 WHERE name = 'account:main'")
+    acquired_at = lease_row(db, 'account:main')['acquired_at']
+    assert db.acquire_lease('account:main', 'w1', 600)
+    renewed = lease_row(db, 'account:main')
+    assert renewed['acquired_at'] == acquired_at
+    assert renewed['expires_at'] >= before['expires_at'] + 500
+    
+    # بعد از انقضا worker دیگر lease را می‌گیرد و صاحب قبلی دیگر نمی‌تواند تمدید کند
+    db.get_connection().execute("UPDATE worker_leases SET expires_at = acquired_at - 1 WHERE name = 'account:main'")
+    assert [lease['name'] for lease in db.get_leases('account:')] == []
+    assert db.acquire_lease('account:main', 'w2', 60)
+    assert lease_row(db, 'account:main')['worker_id'] == 'w2'
+    assert not db.acquire_lease('account:main', 'w1', 60)
+    
+    # آزاد کردن فقط توسط صاحب lease
+    db.release_lease('account:main', 'w1')
+    assert [lease['worker_id'] for lease in db.get_leases('account:')] == ['w2']
+    db.release_lease('account:main', 'w2')
+    assert db.get_leases('account:') == []
@@ -0,0 +1,94 @@
+"""
+مهاجرت‌ها روی دیتابیس قدیمی با داده واقعی
+"""
+import calendar
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+from database import ConnectionManager
+from migrations import MIGRATIONS, apply_migrations
+
+
+def epoch(text: str) -> int:
+    return calendar.timegm(datetime.strptime(text, '%Y-%m-%d %H:%M:%S').timetuple())
+
+
+# (channel_id, recorded_at به فرمت CURRENT_TIMESTAMP، member_count)
+SAMPLES = [
+    (1, '2025-01-01 10:00:00', 100),
+    (1, '2025-01-01 20:00:00', 110),
+    (1, '2025-01-02 08:00:00', 120),
+    (2, '2025-01-02 09:30:00', 50),
+]
+
+
+@pytest.fixture
+def v5_db(tmp_path):
+    """دیتابیس در نسخه 5 (recorded_at و day متنی) با چند نمونه آمار"""
+    path = str(tmp_path / 'theleton.db')
+    conn = sqlite3.connect(path, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    cursor.execute('''
+        CREATE TABLE schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    for version, description, migrate in MIGRATIONS[:5]:
+        migrate(cursor)
+        cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+    cursor.execute("INSERT INTO channels (id, username) VALUES (1, 'one'), (2, 'two'), (3, 'three')")
+    cursor.executemany('INSERT INTO channel_stats (channel_id, recorded_at, member_count) VALUES (?, ?, ?)',
+                       SAMPLES)
+    # نمونه با مقدار پیش‌فرض CURRENT_TIMESTAMP
+    cursor.execute('INSERT INTO channel_stats (channel_id, member_count) VALUES (3, 7)')
+    cursor.execute('COMMIT')
+    conn.close()
+    connections = ConnectionManager(path)
+    yield connections
+    connections.close_all()
+
+
+def test_integer_timestamps_migration_keeps_history(v5_db):
+    assert 6 in apply_migrations(v5_db)
+    conn = v5_db.get()
+    
+    rows = conn.execute('SELECT id, channel_id, recorded_at, day, member_count FROM channel_stats ORDER BY id').fetchall()
+    assert len(rows) == len(SAMPLES) + 1
+    for row, (channel_id, recorded_at, member_count) in zip(rows, SAMPLES):
+        assert (row['channel_id'], row['recorded_at'], row['member_count']) == (channel_id, epoch(recorded_at), member_count)
+        assert row['day'] == epoch(recorded_at) // 86400
+    assert abs(rows[-1]['recorded_at'] - time.time()) < 60
+    
+    latest = {row['channel_id']: (row['stats_id'], row['recorded_at'])
+              for row in conn.execute('SELECT * FROM channel_latest')}
+    assert latest == {
+        1: (rows[2]['id'], epoch('2025-01-02 08:00:00')),
+        2: (rows[3]['id'], epoch('2025-01-02 09:30:00')),
+        3: (rows[4]['id'], rows[4]['recorded_at']),
+    }
+    
+    day1 = epoch('2025-01-01 00:00:00') // 86400
+    daily = conn.execute('SELECT * FROM channel_daily WHERE channel_id = 1 AND day = ?', (day1,)).fetchone()
+    assert (daily['open_count'], daily['close_count'], daily['min_count'], daily['max_count'], daily['samples']) == \
+        (100, 110, 100, 110, 2)
+    assert (daily['first_at'], daily['last_at']) == (epoch('2025-01-01 10:00:00'), epoch('2025-01-01 20:00:00'))
+
+
+def test_rebuilt_triggers_update_latest_and_daily(v5_db):
+    apply_migrations(v5_db)
+    conn = v5_db.get()
+    recorded_at = epoch('2025-01-02 12:00:00')
+    cursor = conn.execute('INSERT INTO channel_stats (channel_id, recorded_at, day, member_count) VALUES (1, ?, ?, 130)',
+                          (recorded_at, recorded_at // 86400))
+    
+    latest = conn.execute('SELECT stats_id, recorded_at FROM channel_latest WHERE channel_id = 1').fetchone()
+    assert tuple(latest) == (cursor.lastrowid, recorded_at)
+    daily = conn.execute('SELECT * FROM channel_daily WHERE channel_id = 1 AND day = ?',
+                         (recorded_at // 86400,)).fetchone()
+    assert (daily['open_count'], daily['close_count'], daily['max_count'], daily['samples'], daily['last_at']) == \
+        (120, 130, 130, 2, recorded_at)
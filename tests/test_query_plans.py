@@ -0,0 +1,34 @@
+"""
+پرس‌وجوهای پرتکرار باید روی دیتابیس تازه (بعد از همه مهاجرت‌ها) از ایندکس مورد انتظار استفاده کنند
+"""
+import inspect
+import pytest
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'theleton.db'))
+    yield database
+    database.close()
+
+
+def test_hot_queries_use_expected_indexes(db):
+    assert db.check_query_plans() == {}
+
+
+@pytest.mark.parametrize('method_name', sorted(Database.HOT_QUERIES))
+def test_hot_query_is_the_sql_the_method_runs(method_name):
+    # plan همان SQL بررسی می‌شود که متد اجرا می‌کند، نه یک نسخه کپی شده
+    sql_name, _ = Database.HOT_QUERIES[method_name]
+    assert f'self.{sql_name}' in inspect.getsource(getattr(Database, method_name))
+
+
+def test_views_after_hours_reads_only_requested_channels(db):
+    # نمونه‌های post_stats فقط برای کانال‌های خواسته شده از کلید اصلی خوانده می‌شوند
+    with db.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + Database.VIEWS_AFTER_HOURS_SQL,
+                       {'channel_ids': '[1]', 'hours': 24, 'since': 0})
+        plan = [row[3] for row in cursor.fetchall()]
+    assert any('post_stats USING PRIMARY KEY (channel_id=?)' in step for step in plan)
+    assert not any(step.startswith('SCAN post_stats') for step in plan)
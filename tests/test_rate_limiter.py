@@ -0,0 +1,97 @@
+"""
+token bucket تطبیقی و RateLimiter با ساعت ساختگی (بدون صبر واقعی)
+"""
+import asyncio
+import types
+
+import pytest
+
+errors = pytest.importorskip('telethon.errors')
+import rate_limiter
+from rate_limiter import RateLimiter, RateLimitedError, TokenBucket
+
+
+class FakeFloodWait(errors.FloodWaitError):
+    """FloodWaitError با seconds دلخواه (سازنده Telethon به request نیاز دارد)"""
+    
+    def __init__(self, seconds):
+        Exception.__init__(self, f'A wait of {seconds} seconds is required')
+        self.seconds = seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.monotonic و asyncio.sleep ماژول rate_limiter روی یک ساعت ساختگی"""
+    state = types.SimpleNamespace(now=1000.0, slept=[])
+    
+    async def sleep(seconds):
+        state.slept.append(seconds)
+        state.now += seconds
+    
+    monkeypatch.setattr(rate_limiter, 'time', types.SimpleNamespace(monotonic=lambda: state.now))
+    monkeypatch.setattr(rate_limiter, 'asyncio', types.SimpleNamespace(Lock=asyncio.Lock, sleep=sleep))
+    return state
+
+
+def test_flood_wait_pauses_bucket_and_halves_rate(clock):
+    bucket = TokenBucket('GetFullChannelRequest', 1.0, 5)
+    bucket.on_flood_wait(60)
+    assert bucket.rate == 0.5
+    assert bucket.paused_until == clock.now + 60
+    
+    # توقف طولانی‌تر از max_wait صبر نمی‌شود
+    with pytest.raises(RateLimitedError) as info:
+        asyncio.run(bucket.acquire(max_wait=30))
+    assert info.value.seconds == 60
+    
+    # بدون max_wait تا پایان توقف و پر شدن یک token با نرخ جدید صبر می‌شود
+    start = clock.now
+    asyncio.run(bucket.acquire())
+    assert clock.now - start == pytest.approx(60 + 1 / 0.5)
+
+
+def test_rate_recovers_up_to_max_factor(clock):
+    limiter = RateLimiter({'rate_limits': {'GetChannelsRequest': (1.0, 2)}, 'rate_limit_max_factor': 1.5})
+    bucket = limiter.bucket('GetChannelsRequest')
+    bucket.on_flood_wait(1)
+    assert bucket.rate == 0.5
+    for _ in range(TokenBucket.SUCCESS_STREAK):
+        bucket.on_success()
+    assert bucket.rate == pytest.approx(0.6)
+    for _ in range(TokenBucket.SUCCESS_STREAK * 50):
+        bucket.on_success()
+    assert bucket.rate == pytest.approx(1.5)
+
+
+def test_short_flood_wait_is_waited_and_retried(clock):
+    limiter = RateLimiter({'max_flood_wait': 300})
+    calls = []
+    
+    async def request():
+        calls.append(clock.now)
+        if len(calls) == 1:
+            raise FakeFloodWait(10)
+        return 'ok'
+    
+    assert asyncio.run(limiter.run('GetFullChannelRequest', request)) == 'ok'
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 10
+    assert limiter.bucket('GetFullChannelRequest').rate == 0.5
+
+
+def test_long_flood_wait_raises_rate_limited(clock):
+    limiter = RateLimiter({'max_flood_wait': 300})
+    calls = []
+    
+    async def request():
+        calls.append(clock.now)
+        raise FakeFloodWait(900)
+    
+    with pytest.raises(RateLimitedError) as info:
+        asyncio.run(limiter.run('JoinChannelRequest', request))
+    assert info.value.seconds == 900
+    assert len(calls) == 1
+    # درخواست بعدی همین نوع بدون ارسال به تلگرام رد می‌شود
+    with pytest.raises(RateLimitedError):
+        asyncio.run(limiter.run('JoinChannelRequest', request))
+    assert len(calls) == 1
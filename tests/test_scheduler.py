@@ -0,0 +1,68 @@
+"""
+زمان‌بندی تطبیقی کانال‌ها (ChannelScheduler) با زمان ساختگی
+"""
+import pytest
+from scheduler import ChannelScheduler
+
+CONFIG = {'check_interval': 1800, 'min_check_interval': 300, 'max_check_interval': 7200, 'volatility_target': 10}
+NOW = 1_000_000.0
+
+
+@pytest.fixture
+def scheduler():
+    return ChannelScheduler(CONFIG)
+
+
+def test_interval_for_is_clamped(scheduler):
+    assert scheduler.interval_for(None) == 1800
+    assert scheduler.interval_for(0) == 7200
+    # 10 عضو تغییر در هر بررسی
+    assert scheduler.interval_for(10 / 1000) == pytest.approx(1000)
+    assert scheduler.interval_for(100) == 300
+    assert scheduler.interval_for(1e-9) == 7200
+
+
+def test_observe_smooths_rate(scheduler):
+    scheduler.add({'id': 1}, NOW)
+    # اولین بررسی فقط مبنا را ثبت می‌کند
+    scheduler.observe(1, 100, NOW)
+    assert scheduler.entries[1]['rate'] is None
+    scheduler.observe(1, 110, NOW + 1000)
+    assert scheduler.entries[1]['rate'] == pytest.approx(0.01)
+    assert scheduler.entries[1]['interval'] == pytest.approx(1000)
+    # نرخ جدید 0.05 با وزن SMOOTHING با نرخ قبلی ترکیب می‌شود
+    scheduler.observe(1, 160, NOW + 2000)
+    expected = 0.3 * 0.05 + 0.7 * 0.01
+    assert scheduler.entries[1]['rate'] == pytest.approx(expected)
+    assert scheduler.entries[1]['next_at'] == pytest.approx(NOW + 2000 + 10 / expected)
+
+
+def test_initial_rate_from_activity(scheduler):
+    scheduler.load_activity({1: {'samples': 3, 'total_change': 20, 'first_at': NOW - 4000,
+                                 'last_at': NOW - 2000, 'member_count': 50}})
+    scheduler.add({'id': 1}, NOW)
+    entry = scheduler.entries[1]
+    assert entry['rate'] == pytest.approx(0.01)
+    # آخرین بررسی 2000 ثانیه قبل بوده و فاصله 1000 ثانیه است: بلافاصله سررسید
+    assert entry['next_at'] == NOW
+
+
+def test_pop_due_orders_and_requeues_unchecked(scheduler):
+    for channel_id in (1, 2, 3):
+        scheduler.add({'id': channel_id}, NOW + channel_id)
+    assert [ch['id'] for ch in scheduler.pop_due(NOW + 2)] == [1, 2]
+    assert [ch['id'] for ch in scheduler.pop_due(NOW + 10, limit=5)] == [3]
+    assert scheduler.pop_due(NOW + 10) == []
+    
+    # کانال 1 بررسی شد، کانال 2 بررسی نشد (مثلاً FloodWait) و با فاصله فعلی دوباره سررسید می‌شود
+    scheduler.observe(1, 100, NOW + 5)
+    assert scheduler.entries[2]['next_at'] == NOW + 2 + 1800
+    due = scheduler.pop_due(NOW + 2 + 1800)
+    assert [ch['id'] for ch in due] == [2]
+
+
+def test_removed_channel_is_not_popped(scheduler):
+    scheduler.sync([{'id': 1}, {'id': 2}], NOW)
+    scheduler.sync([{'id': 2}], NOW)
+    assert [ch['id'] for ch in scheduler.pop_due(NOW)] == [2]
+    assert len(scheduler) == 1
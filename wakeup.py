@@ -0,0 +1,90 @@
+"""
+بیدار کردن فوری سرویس‌ها با یک بسته UDP
+
+صف اصلی (جدول commands) در دیتابیس است و پایدار می‌ماند؛ این بسته فقط سرویس
+مقابل را زودتر از poll بعدی بیدار می‌کند. اگر بسته گم شود، poll کند پشتیبان
+همان کار را انجام می‌دهد. هر دو container در یک شبکه docker هستند، پس
+admin_bot و channel_monitor می‌توانند با نام سرویس به یکدیگر بسته بفرستند
+(جدول commands به سمت monitor و جدول notifications به سمت admin_bot).
+"""
+import asyncio
+import json
+import os
+import socket
+from typing import Optional
+
+
+DEFAULT_MONITOR_PORT = 8765
+DEFAULT_ADMIN_PORT = 8766
+
+
+def get_wakeup_address(config: dict, host_key: str, port_key: str, env_prefix: str,
+                       default_host: str, default_port: int) -> tuple:
+    """آدرس (host, port) از متغیر محیطی یا فایل تنظیمات"""
+    host = os.environ.get(f'{env_prefix}_HOST') or config.get(host_key) or default_host
+    port = os.environ.get(f'{env_prefix}_PORT') or config.get(port_key) or default_port
+    return host, int(port)
+
+
+def send_wakeup(host: str, port: int, payload: dict = None) -> bool:
+    """ارسال یک بسته بیدارباش (best-effort؛ خطا فقط چاپ می‌شود)"""
+    data = json.dumps(payload or {}, ensure_ascii=False).encode('utf-8')
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(data, (host, port))
+        return True
+    except OSError as e:
+        print(f"⚠️ ارسال wakeup به {host}:{port} ناموفق بود (poll پشتیبان انجام می‌شود): {e}")
+        return False
+
+
+class _WakeupProtocol(asyncio.DatagramProtocol):
+    def __init__(self, listener: 'WakeupListener'):
+        self.listener = listener
+    
+    def datagram_received(self, data, addr):
+        try:
+            payload = json.loads(data.decode('utf-8')) if data else {}
+        except ValueError:
+            payload = {}
+        self.listener.last_payload = payload
+        self.listener.event.set()
+
+
+class WakeupListener:
+    """گوش دادن به بسته‌های بیدارباش و انتظار تا رسیدن بسته یا پایان timeout"""
+    
+    def __init__(self, port: int, host: str = '0.0.0.0'):
+        self.host = host
+        self.port = port
+        self.event = asyncio.Event()
+        self.last_payload: Optional[dict] = None
+        self._transport = None
+    
+    async def start(self) -> bool:
+        """شروع گوش دادن؛ در صورت خطا فقط poll پشتیبان کار می‌کند"""
+        try:
+            loop = asyncio.get_running_loop()
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _WakeupProtocol(self), local_addr=(self.host, self.port)
+            )
+            print(f"📡 گوش دادن به wakeup روی UDP {self.host}:{self.port}")
+            return True
+        except OSError as e:
+            print(f"⚠️ گوش دادن به wakeup روی پورت {self.port} ممکن نشد (فقط poll): {e}")
+            return False
+    
+    async def wait(self, timeout: float) -> bool:
+        """انتظار تا بیدارباش یا پایان timeout - برمی‌گرداند True اگر بیدارباش رسید"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout=max(0.0, timeout))
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        self.event.clear()
+        return woken
+    
+    def close(self):
+        if self._transport:
+            self._transport.close()
+            self._transport = None